@@ -1,21 +1,128 @@
-from flask import Flask
+from flask import Flask, g, request
 from flask_cors import CORS
+import logging
 import os
 
 def create_app():
     app = Flask(__name__)
     CORS(app)
     
+    # jsonify and request.get_json use orjson (with NumPy support) when it is installed
+    from .serialization import ResponseJSONProvider
+    app.json = ResponseJSONProvider(app)
+    
+    # Buffer file uploads in memory up to UPLOAD_MAX_MEMORY_MB and spool larger ones to temp files
+    from .uploads import UploadRequest, UploadSpoolStats
+    app.request_class = UploadRequest
+    app.extensions['upload_spool'] = UploadSpoolStats()
+    
     # Configuration
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')
     app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), '..', 'uploads')
-    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+    # Uploads are scored in bounded chunks, so large lab exports no longer need a tight size cap
+    app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 256)) * 1024 * 1024
+    app.config['PREDICT_CHUNK_SIZE'] = int(os.environ.get('PREDICT_CHUNK_SIZE', 50000))  # rows per scored chunk
+    app.config['PREDICT_PREVIEW_ROWS'] = int(os.environ.get('PREDICT_PREVIEW_ROWS', 1000))  # rows returned in 'data'
+    app.config['EXCEL_HEADER_SCAN_ROWS'] = int(os.environ.get('EXCEL_HEADER_SCAN_ROWS', 20))  # rows searched for the header
+    app.config['UPLOAD_MAX_MEMORY_SIZE'] = int(float(os.environ.get('UPLOAD_MAX_MEMORY_MB', 16)) * 1024 * 1024)
+    app.config['UPLOAD_SPOOL_DIR'] = os.environ.get('UPLOAD_SPOOL_DIR') or None  # default: system temp dir
+    
+    # 'background' warms the model up in a thread, 'lazy' loads it on first use, 'eager' before serving
+    app.config['MODEL_LOADING'] = os.environ.get('MODEL_LOADING', 'background')
+    app.config['MODEL_AUTOTRAIN'] = os.environ.get('MODEL_AUTOTRAIN', '0') == '1'  # train a missing model during warm-up
+    app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', os.cpu_count() or 1))  # background job processes
+    app.config['PREDICTION_CACHE_SIZE'] = int(os.environ.get('PREDICTION_CACHE_SIZE', 10000))  # 0 disables the cache
+    app.config['PREDICTION_CACHE_TTL'] = float(os.environ.get('PREDICTION_CACHE_TTL', 3600))  # seconds
+    app.config['INFERENCE_WORKERS'] = int(os.environ.get('INFERENCE_WORKERS', 0))  # 0/1 predicts in-process only
+    app.config['INFERENCE_PARALLEL_THRESHOLD'] = int(os.environ.get('INFERENCE_PARALLEL_THRESHOLD', 20000))  # min rows to parallelize
+    app.config['MICROBATCH_WINDOW_MS'] = float(os.environ.get('MICROBATCH_WINDOW_MS', 0))  # 0 disables micro-batching
+    app.config['MICROBATCH_MAX_SIZE'] = int(os.environ.get('MICROBATCH_MAX_SIZE', 64))  # rows per micro-batch
+    app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'WARNING').upper()  # DEBUG logs every predict request
+    
+    # Per-request debug output is off unless LOG_LEVEL asks for it
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    logging.getLogger(__name__).setLevel(app.config['LOG_LEVEL'])
     
     # Create uploads directory if it doesn't exist
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
+    # Background prediction jobs are stored under the uploads directory
+    from .jobs import JobManager
+    app.extensions['prediction_jobs'] = JobManager(
+        os.path.join(app.config['UPLOAD_FOLDER'], 'jobs'),
+        max_workers=app.config['JOB_WORKERS'],
+        chunk_size=app.config['PREDICT_CHUNK_SIZE'],
+        header_scan_rows=app.config['EXCEL_HEADER_SCAN_ROWS']
+    )
+    
     # Register blueprints
-    from .routes import main
+    from .features import resolve_columns
+    from .routes import main, MODEL_MMAP_MODE, MODEL_PATH, registry
     app.register_blueprint(main)
     
+    # Large batches are split across model-loading worker processes
+    from .inference import InferenceEngine
+    app.extensions['inference_engine'] = InferenceEngine(
+        MODEL_PATH,
+        workers=app.config['INFERENCE_WORKERS'],
+        threshold=app.config['INFERENCE_PARALLEL_THRESHOLD'],
+        mmap_mode=MODEL_MMAP_MODE
+    )
+    
+    # Repeated JSON samples are answered from an LRU cache keyed on the model version
+    from .cache import PredictionCache
+    app.extensions['prediction_cache'] = PredictionCache(
+        max_size=app.config['PREDICTION_CACHE_SIZE'],
+        ttl=app.config['PREDICTION_CACHE_TTL']
+    )
+    
+    # Concurrent single-sample predictions can share one model call
+    from .batching import MicroBatcher
+    batcher = app.extensions['micro_batcher'] = MicroBatcher(
+        window=app.config['MICROBATCH_WINDOW_MS'] / 1000,
+        max_size=app.config['MICROBATCH_MAX_SIZE']
+    )
+    
+    # Stage timings per request, recorded once the response has been sent
+    from .metrics import Metrics, RequestTimer
+    metrics = app.extensions['metrics'] = Metrics()
+    if batcher.enabled:
+        metrics.add_metric(batcher.batch_size)
+        metrics.add_metric(batcher.wait)
+    
+    @app.before_request
+    def start_request_timer():
+        g.request_timer = RequestTimer(request.endpoint or 'unknown')
+    
+    @app.after_request
+    def record_request_timer(response):
+        timer = g.get('request_timer')
+        if timer is not None:
+            # Streamed bodies are still being produced here, so wait for close
+            response.call_on_close(lambda: metrics.observe_request(timer, response.status_code))
+        return response
+    
+    metrics.add_collector(lambda: [
+        ('soil_model_loaded', 'gauge', 'Whether a model is loaded and serving', int(registry.active is not None)),
+        ('soil_prediction_cache_hits_total', 'counter', 'Prediction cache hits', app.extensions['prediction_cache'].hits),
+        ('soil_prediction_cache_misses_total', 'counter', 'Prediction cache misses', app.extensions['prediction_cache'].misses),
+        ('soil_header_cache_hits_total', 'counter', 'Header resolutions answered from cache', resolve_columns.cache_info().hits),
+        ('soil_upload_files_total', 'counter', 'Uploaded files buffered', app.extensions['upload_spool'].files),
+        ('soil_upload_spooled_bytes_total', 'counter', 'Upload bytes spooled to disk', app.extensions['upload_spool'].spooled_bytes),
+    ])
+    
+    # Worker pools and cached predictions belong to the previous model after a swap
+    registry.on_swap(lambda version: app.extensions['inference_engine'].reset())
+    registry.on_swap(lambda version: app.extensions['prediction_cache'].clear())
+    
+    # Start serving immediately; the model is loaded according to MODEL_LOADING
+    from .registry import LOADING_MODES
+    loading_mode = app.config['MODEL_LOADING']
+    if loading_mode not in LOADING_MODES:
+        raise ValueError(f"MODEL_LOADING must be one of: {', '.join(LOADING_MODES)}")
+    if loading_mode == 'eager':
+        registry.load()
+    elif loading_mode == 'background':
+        registry.start_warmup(autotrain=app.config['MODEL_AUTOTRAIN'])
+    
     return app
\ No newline at end of file
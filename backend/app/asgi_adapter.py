@@ -0,0 +1,173 @@
+"""
+ASGI adapter for the Flask app
+
+ASGIAdapter serves the unchanged WSGI app from an ASGI server such as
+uvicorn. Request bodies are received on the event loop into a spooled buffer
+(in memory up to UPLOAD_MAX_MEMORY_MB, then a temporary file), so a slow
+upload costs an idle coroutine instead of a blocked worker. Only once the
+body is complete does the request run, routes and all, on a thread pool where
+parsing, encoding and prediction can use the CPU without stalling the loop.
+Response chunks, including streamed NDJSON/CSV predictions, are sent back
+through the loop as the thread produces them.
+"""
+import asyncio
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+from .uploads import DEFAULT_MAX_MEMORY_SIZE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THREADS = 32
+
+
+class ClientDisconnected(Exception):
+    """The client went away while a response was being sent"""
+
+
+class ASGIAdapter:
+    """ASGI application that runs a Flask (WSGI) app on an executor"""
+
+    def __init__(self, wsgi_app, threads=DEFAULT_THREADS):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi-request')
+        config = getattr(wsgi_app, 'config', {})
+        self.max_content_length = config.get('MAX_CONTENT_LENGTH')
+        self.max_memory_size = config.get('UPLOAD_MAX_MEMORY_SIZE', DEFAULT_MAX_MEMORY_SIZE)
+        self.spool_dir = config.get('UPLOAD_SPOOL_DIR')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _receive_body(self, receive, body):
+        """Buffer the request body; returns the byte count or None if the client left"""
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunk = message.get('body', b'')
+            if chunk:
+                size += len(chunk)
+                # Past the limit the app answers 413 from the length alone, so stop buffering
+                if self.max_content_length is None or size <= self.max_content_length:
+                    body.write(chunk)
+            if not message.get('more_body', False):
+                return size
+
+    async def _http(self, scope, receive, send):
+        body = SpooledTemporaryFile(max_size=self.max_memory_size, mode='w+b', dir=self.spool_dir)
+        try:
+            size = await self._receive_body(receive, body)
+            if size is None:
+                return
+            body.seek(0)
+            environ = self._environ(scope, body, size)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, self._run_wsgi, environ, send, loop)
+        finally:
+            body.close()
+
+    def _environ(self, scope, body, size):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(size),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name == 'CONTENT_LENGTH':
+                continue  # the length actually received is authoritative
+            else:
+                key = f'HTTP_{name}'
+                environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    def _run_wsgi(self, environ, send, loop):
+        """Run the WSGI app in this worker thread, sending output through the event loop"""
+        def send_message(message):
+            try:
+                asyncio.run_coroutine_threadsafe(send(message), loop).result()
+            except Exception as e:
+                raise ClientDisconnected() from e
+
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started[:] = [status, headers]
+
+        def send_start():
+            status, headers = started
+            send_message({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            })
+
+        response_started = False
+        iterable = None
+        try:
+            iterable = self.wsgi_app(environ, start_response)
+            for chunk in iterable:
+                if not chunk:
+                    continue
+                if not response_started:
+                    send_start()
+                    response_started = True
+                send_message({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not response_started:
+                send_start()
+                response_started = True
+            send_message({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        except ClientDisconnected:
+            logger.debug("Client disconnected from %s", environ.get('PATH_INFO'))
+        except Exception as e:
+            logger.exception("Unhandled error serving %s: %s", environ.get('PATH_INFO'), e)
+            if not response_started:
+                send_message({
+                    'type': 'http.response.start',
+                    'status': 500,
+                    'headers': [(b'content-type', b'text/plain; charset=utf-8')],
+                })
+                send_message({'type': 'http.response.body', 'body': b'Internal Server Error', 'more_body': False})
+        finally:
+            # Runs call_on_close hooks (request metrics, upload buffers) like a WSGI server would
+            if iterable is not None and hasattr(iterable, 'close'):
+                iterable.close()
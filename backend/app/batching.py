@@ -0,0 +1,153 @@
+"""
+Micro-batching of concurrent single-sample predictions
+
+With MICROBATCH_WINDOW_MS above 0, request threads that need a prediction for
+one encoded row hand it to a MicroBatcher instead of calling the model
+themselves. A dispatcher thread takes the first waiting row, collects any
+others that arrive within the window (or until MICROBATCH_MAX_SIZE rows are
+queued), predicts them with one call per model version and wakes each
+request with its own result. Concurrent requests then share the per-call
+model overhead, at the cost of waiting up to one window.
+
+Batching only helps when one process serves requests concurrently, e.g.
+gunicorn with --threads, the threaded development server or the ASGI entry
+point; a sync worker handles one request at a time.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from .metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 64
+# Longest a request waits for its batch to be predicted before giving up
+RESULT_TIMEOUT = 30.0
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class _Pending:
+    __slots__ = ('predictor', 'version', 'row', 'columns', 'queued_at', 'done', 'result', 'error')
+
+    def __init__(self, predictor, version, features):
+        self.predictor = predictor
+        self.version = version
+        self.row = features.to_numpy()[0]
+        self.columns = features.columns
+        self.queued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Coalesces concurrent one-row predictions into batched model calls"""
+
+    def __init__(self, window=0.0, max_size=DEFAULT_MAX_SIZE):
+        self.window = window
+        self.max_size = max_size
+        self.batch_size = Histogram(
+            'soil_microbatch_size', 'Rows predicted per micro-batch', (), buckets=BATCH_SIZE_BUCKETS
+        )
+        self.wait = Histogram(
+            'soil_microbatch_wait_seconds', 'Time a row waited from submission until its batch was predicted', ()
+        )
+        self.batches = 0
+        self.rows = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The dispatcher thread does not survive fork; the child starts its own on demand
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.window > 0 and self.max_size > 1
+
+    def _ensure_dispatcher(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch_forever, name='micro-batcher', daemon=True)
+                self._thread.start()
+
+    def predict(self, predictor, features, version=None):
+        """Predict a one-row model-ready DataFrame as part of the next batch"""
+        self._ensure_dispatcher()
+        pending = _Pending(predictor, version, features)
+        self._queue.put(pending)
+        if not pending.done.wait(RESULT_TIMEOUT):
+            raise TimeoutError('Timed out waiting for a batched prediction')
+        if pending.error is not None:
+            raise pending.error
+        return np.array([pending.result])
+
+    def _collect(self):
+        """Block for the first row, then gather more until the window closes or the batch is full"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch_forever(self):
+        while True:
+            batch = self._collect()
+            # Requests pinned to different model versions are predicted separately
+            groups = {}
+            for pending in batch:
+                groups.setdefault((pending.version, id(pending.predictor)), []).append(pending)
+            for group in groups.values():
+                self._run(group)
+
+    def _run(self, group):
+        first = group[0]
+        try:
+            features = pd.DataFrame(np.vstack([pending.row for pending in group]), columns=first.columns)
+            predictions = first.predictor.predict(features)
+        except Exception as e:
+            logger.exception("Micro-batch of %d rows failed: %s", len(group), e)
+            for pending in group:
+                pending.error = e
+                pending.done.set()
+            return
+
+        finished = time.perf_counter()
+        self.batches += 1
+        self.rows += len(group)
+        self.batch_size.observe(len(group))
+        for pending, prediction in zip(group, predictions):
+            self.wait.observe(finished - pending.queued_at)
+            pending.result = prediction
+            pending.done.set()
+
+    def info(self):
+        return {
+            'enabled': self.enabled,
+            'window_ms': self.window * 1000,
+            'max_size': self.max_size,
+            'batches': self.batches,
+            'rows': self.rows,
+            'average_batch_size': self.rows / self.batches if self.batches else None
+        }
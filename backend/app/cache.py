@@ -0,0 +1,92 @@
+"""
+LRU cache of model predictions for repeated soil samples
+
+Entries are keyed on a hash of the encoded feature row (the canonical,
+mapped form of a sample, so differently spelled inputs with the same values
+share an entry) together with the model version that produced them.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PredictionCache:
+    """Thread-safe LRU cache with a size limit, TTL and hit/miss counters"""
+
+    def __init__(self, max_size=10000, ttl=3600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    @staticmethod
+    def keys_for(matrix, model_version):
+        """Hash each encoded feature row together with the model version"""
+        # Adding 0.0 turns -0.0 into 0.0 so equal values always hash the same
+        rows = np.ascontiguousarray(matrix) + 0.0
+        version = str(model_version).encode()
+        return [hashlib.blake2b(row.tobytes(), digest_size=16, key=version[:64]).digest() for row in rows]
+
+    def get_many(self, keys):
+        """Return (predictions, missing) with NaN predictions where missing is True"""
+        predictions = np.full(len(keys), np.nan)
+        missing = np.ones(len(keys), dtype=bool)
+        now = time.monotonic()
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                value, expires_at = entry
+                if expires_at < now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                predictions[i] = value
+                missing[i] = False
+            hit_count = len(keys) - int(missing.sum())
+            self.hits += hit_count
+            self.misses += len(keys) - hit_count
+        return predictions, missing
+
+    def put_many(self, keys, values):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._entries[key] = (float(value), expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry, e.g. when the active model changes"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
@@ -0,0 +1,258 @@
+"""
+Mini-batch k-means clustering of soil samples
+
+/api/cluster runs the clustering that kMeansClustering in
+lib/ml-algorithms.ts does in the browser, on the server. It uses the same 16
+features as extractFeatures, with the same defaults for missing or zero
+values, scales every feature to 0-1 by its min and max over the dataset, and
+returns centroids in the original units with the frontend's cluster colors
+and characteristics.
+
+Centroids start from k-means++ seeding on a sample of rows. Datasets that
+fit in one batch are then clustered with full Lloyd iterations until no
+assignment changes, as in the browser. Larger ones use mini-batch updates,
+where each center moves towards the mean of the batch rows assigned to it
+with a step of 1 / (rows it has seen so far). Updates stop when a smoothed
+batch inertia has not improved for MAX_NO_IMPROVEMENT batches. Every row is
+finally assigned to its nearest centroid in blocks of ASSIGN_BLOCK_ROWS,
+with distances computed as one matrix product per block.
+"""
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .features import resolve_columns
+
+# (feature column, frontend key, value used when missing or 0), in extractFeatures order
+CLUSTER_FEATURES = (
+    ('nitrogen', 'nitrogen', 0),
+    ('phosphorus', 'phosphorus', 0),
+    ('potassium', 'potassium', 0),
+    ('ph', 'ph', 7),
+    ('organic_matter', 'organicCarbon', 0),
+    ('electricalConductivity', 'electricalConductivity', 0),
+    ('sulphur', 'sulphur', 0),
+    ('zinc', 'zinc', 0),
+    ('iron', 'iron', 0),
+    ('copper', 'copper', 0),
+    ('manganese', 'manganese', 0),
+    ('boron', 'boron', 0),
+    ('moisture', 'soilMoisture', 50),
+    ('temperature', 'temperature', 25),
+    ('humidity', 'humidity', 60),
+    ('rainfall', 'rainfall', 100),
+)
+FEATURE_DEFAULTS = np.array([default for _, _, default in CLUSTER_FEATURES], dtype=np.float32)
+
+CLUSTER_COLORS = [
+    "hsl(145, 60%, 45%)",  # Green
+    "hsl(200, 70%, 50%)",  # Blue
+    "hsl(35, 80%, 55%)",  # Orange
+    "hsl(280, 60%, 55%)",  # Purple
+    "hsl(0, 70%, 55%)",  # Red
+]
+CLUSTER_CHARACTERISTICS = [
+    "High fertility - Rich in nutrients with optimal pH",
+    "Moderate fertility - Balanced nutrients, needs supplementation",
+    "Low fertility - Nutrient deficient, requires treatment",
+    "Acidic soil - Low pH, needs lime application",
+    "Alkaline soil - High pH, needs sulfur application",
+]
+
+DEFAULT_K = 3
+MAX_K = 50
+DEFAULT_MAX_ITERATIONS = 100
+DEFAULT_BATCH_SIZE = 4096
+MAX_NO_IMPROVEMENT = 10
+ASSIGN_BLOCK_ROWS = 65536
+
+KMeansResult = namedtuple('KMeansResult', ['labels', 'centroids', 'inertia', 'iterations', 'method', 'seconds'])
+
+
+def _apply_defaults(features):
+    """Replace missing (NaN) and zero values with the feature defaults, as `value || default` does"""
+    missing = np.isnan(features) | (features == 0)
+    features[missing] = np.broadcast_to(FEATURE_DEFAULTS, features.shape)[missing]
+    return features
+
+
+def record_features(records):
+    """Feature matrix of frontend SoilSample objects (or records with backend column names)"""
+    features = np.empty((len(records), len(CLUSTER_FEATURES)), dtype=np.float32)
+    for i, (column, key, _) in enumerate(CLUSTER_FEATURES):
+        values = [record.get(key, record.get(column)) if isinstance(record, dict) else None for record in records]
+        try:
+            # None becomes NaN; numbers and numeric strings convert directly
+            features[:, i] = np.array(values, dtype=np.float32)
+        except (TypeError, ValueError):
+            features[:, i] = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=np.float32, na_value=np.nan)
+    return _apply_defaults(features)
+
+
+def frame_features(chunk):
+    """Feature matrix of an uploaded chunk, resolving its header like predictions do"""
+    data = chunk.rename(columns=resolve_columns(tuple(chunk.columns)).rename)
+    features = np.full((len(data), len(CLUSTER_FEATURES)), np.nan, dtype=np.float32)
+    for i, (column, _, _) in enumerate(CLUSTER_FEATURES):
+        if column in data.columns:
+            features[:, i] = pd.to_numeric(data[column], errors='coerce').to_numpy(dtype=np.float32, na_value=np.nan)
+    return _apply_defaults(features)
+
+
+def assign(X, centroids):
+    """(labels, squared distances) of every row's nearest centroid"""
+    labels = np.empty(len(X), dtype=np.intp)
+    distances = np.empty(len(X), dtype=X.dtype)
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    for start in range(0, len(X), ASSIGN_BLOCK_ROWS):
+        block = X[start:start + ASSIGN_BLOCK_ROWS]
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2; the |x|^2 term does not change the argmin
+        partial = centroid_norms - 2 * (block @ centroids.T)
+        nearest = partial.argmin(axis=1)
+        labels[start:start + len(block)] = nearest
+        distances[start:start + len(block)] = np.maximum(
+            partial[np.arange(len(block)), nearest] + (block ** 2).sum(axis=1), 0
+        )
+    return labels, distances
+
+
+def cluster_sums(X, labels, k):
+    """(per-cluster row counts, per-cluster feature sums)"""
+    counts = np.bincount(labels, minlength=k)
+    sums = np.stack([np.bincount(labels, weights=X[:, j], minlength=k) for j in range(X.shape[1])], axis=1)
+    return counts, sums
+
+
+def kmeans_plus_plus(X, k, rng):
+    """k-means++ seeding: each next center is a row drawn with probability proportional to its squared distance"""
+    centers = [X[rng.randint(len(X))]]
+    closest = ((X - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        total = closest.sum()
+        if total <= 0:
+            # Fewer distinct rows than clusters; reuse a row like the browser would
+            index = rng.randint(len(X))
+        else:
+            index = min(np.searchsorted(np.cumsum(closest, dtype=np.float64), rng.random_sample() * total), len(X) - 1)
+        centers.append(X[index])
+        closest = np.minimum(closest, ((X - X[index]) ** 2).sum(axis=1))
+    return np.array(centers, dtype=X.dtype)
+
+
+def lloyd(X, centroids, max_iterations):
+    """Full-batch k-means until no assignment changes; returns (centroids, iterations)"""
+    labels = None
+    for iteration in range(1, max_iterations + 1):
+        new_labels, _ = assign(X, centroids)
+        if labels is not None and np.array_equal(new_labels, labels):
+            return centroids, iteration - 1
+        labels = new_labels
+        counts, sums = cluster_sums(X, labels, len(centroids))
+        # Empty clusters keep their centroid
+        filled = counts > 0
+        centroids = centroids.copy()
+        centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+    return centroids, max_iterations
+
+
+def minibatch(X, centroids, rng, batch_size, max_iterations):
+    """Mini-batch k-means over random batches; returns (centroids, batches)"""
+    centroids = centroids.astype(np.float64)
+    seen = np.zeros(len(centroids))
+    # Smoothing of the batch inertia over roughly one pass of the data
+    alpha = min(1.0, 2.0 * batch_size / (len(X) + 1))
+    smoothed = best = None
+    stalled = 0
+    max_batches = max(1, max_iterations * len(X) // batch_size)
+    for step in range(1, max_batches + 1):
+        batch = X[rng.randint(len(X), size=batch_size)]
+        labels, distances = assign(batch, centroids.astype(X.dtype))
+        counts, sums = cluster_sums(batch, labels, len(centroids))
+        filled = counts > 0
+        seen[filled] += counts[filled]
+        # Moving each center 1 / seen of the way per row sums to this weighted mean
+        centroids[filled] += (sums[filled] - counts[filled, np.newaxis] * centroids[filled]) / seen[filled, np.newaxis]
+
+        inertia = float(distances.mean())
+        smoothed = inertia if smoothed is None else smoothed + alpha * (inertia - smoothed)
+        if best is None or smoothed < best:
+            best, stalled = smoothed, 0
+        else:
+            stalled += 1
+            if stalled >= MAX_NO_IMPROVEMENT:
+                return centroids.astype(X.dtype), step
+    return centroids.astype(X.dtype), max_batches
+
+
+def kmeans(features, k=DEFAULT_K, max_iterations=DEFAULT_MAX_ITERATIONS, batch_size=DEFAULT_BATCH_SIZE,
+           random_state=0):
+    """Cluster a raw feature matrix; centroids are returned in the original units"""
+    start = time.perf_counter()
+    rng = np.random.RandomState(random_state)
+    k = min(k, len(features))
+
+    # Scale each feature to 0-1 over the dataset, as the browser does
+    low = features.min(axis=0)
+    span = features.max(axis=0) - low
+    span[span == 0] = 1
+    X = (features - low) / span
+
+    seed_rows = X if len(X) <= 3 * batch_size else X[rng.choice(len(X), 3 * batch_size, replace=False)]
+    centroids = kmeans_plus_plus(seed_rows, k, rng)
+    if len(X) <= batch_size:
+        centroids, iterations = lloyd(X, centroids, max_iterations)
+        method = 'lloyd'
+    else:
+        centroids, iterations = minibatch(X, centroids, rng, batch_size, max_iterations)
+        method = 'minibatch'
+    labels, distances = assign(X, centroids)
+
+    # A constant feature scales to 0, so its centroid maps back to its one value
+    return KMeansResult(
+        labels=labels,
+        centroids=centroids.astype(np.float64) * span + low,
+        inertia=float(distances.sum(dtype=np.float64)),
+        iterations=iterations,
+        method=method,
+        seconds=time.perf_counter() - start
+    )
+
+
+def cluster_summaries(result):
+    """ClusterResult objects without samples: cluster, centroid, size, characteristics, color"""
+    sizes = np.bincount(result.labels, minlength=len(result.centroids))
+    return [
+        {
+            'cluster': i,
+            'centroid': centroid.tolist(),
+            'size': int(sizes[i]),
+            'characteristics': CLUSTER_CHARACTERISTICS[i % len(CLUSTER_CHARACTERISTICS)],
+            'color': CLUSTER_COLORS[i % len(CLUSTER_COLORS)],
+        }
+        for i, centroid in enumerate(result.centroids)
+    ]
+
+
+def labeled_response(result, samples):
+    """The frontend's {clusters, labeledData} shape, with each cluster's samples"""
+    labeled = [dict(sample, cluster=label) for sample, label in zip(samples, result.labels.tolist())]
+    clusters = cluster_summaries(result)
+    members = {cluster['cluster']: [] for cluster in clusters}
+    for sample in labeled:
+        members[sample['cluster']].append(sample)
+    for cluster in clusters:
+        cluster['samples'] = members[cluster['cluster']]
+    return {'clusters': clusters, 'labeledData': labeled}
+
+
+def result_info(result):
+    return {
+        'k': len(result.centroids),
+        'total_records': len(result.labels),
+        'inertia': result.inertia,
+        'iterations': result.iterations,
+        'method': result.method,
+        'seconds': result.seconds,
+    }
@@ -0,0 +1,190 @@
+"""
+Model compaction: smaller, faster-loading forests for serving
+
+A trained RandomForestRegressor pickles 64 bytes of node record plus 8 bytes
+of value per node, most of which prediction never reads. Compaction rebuilds
+the forest as a CompactRegressor, which pickles 20 bytes per node (float32
+threshold and value, int32 feature and children), optionally keeping only
+the first trees and pruning every tree to a depth limit. Loading widens the
+indexes and thresholds back to the CompactForest layout, since NumPy indexes
+fastest with native integers. It is saved like any model, so the server, job
+workers and the inference pool load it from soil_model.pkl unchanged, and
+/api/model/info reports its profile.
+
+Profiles:
+  none     the sklearn model as trained
+  float32  every node, in compact dtypes
+  trees    float32, fewest trees within the accuracy budget
+  depth    float32, shallowest depth within the accuracy budget
+  pruned   float32, fewest nodes over trees x depth within the budget
+
+Thresholds are rounded down to float32, which keeps every split decision for
+float32 inputs exact; only leaf values lose precision (about 1e-7 relative).
+Dropping trees keeps a prefix: the trees are independent bootstrap fits, so
+any k of them are as good as any other k. Pruning turns the nodes at the
+depth limit into leaves that predict their training mean, which sklearn
+already stores for internal nodes.
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+from .forest import CompactForest, TreeNodes, node_depths, tree_nodes
+
+PROFILES = ('none', 'float32', 'trees', 'depth', 'pruned')
+DEFAULT_BUDGET = 0.005
+# Rows traversed per block, bounding the (rows x trees) slot matrix
+PREDICT_BLOCK_ROWS = 4096
+
+
+def prune_tree(nodes, max_depth):
+    """TreeNodes with the nodes at max_depth turned into leaves and everything below removed"""
+    depths = node_depths(nodes)
+    keep = depths <= max_depth
+    if keep.all() and not (depths == max_depth).any():
+        return nodes
+    renumber = np.cumsum(keep) - 1
+    leaf = (nodes.left == -1) | (depths == max_depth)
+    left = np.where(leaf, -1, renumber[nodes.left])
+    right = np.where(leaf, -1, renumber[nodes.right])
+    return TreeNodes(nodes.feature[keep], nodes.threshold[keep], left[keep], right[keep], nodes.value[keep])
+
+
+class CompactRegressor(CompactForest):
+    """Standalone compacted forest, saved in place of the sklearn model.
+
+    Predicts model-ready DataFrames like the sklearn model it was built from,
+    with no sklearn fallback: every batch size is traversed here, in blocks.
+    """
+
+    def __init__(self, trees, feature_names, compaction=None):
+        self.model = None
+        self.max_rows = None
+        self.feature_names_in_ = np.asarray(feature_names, dtype=object)
+        self.feature_names = pd.Index(self.feature_names_in_)
+        self.n_features_in_ = self.n_features = len(self.feature_names_in_)
+        self.n_estimators = len(trees)
+        self.compaction_ = dict(compaction or {})
+        self._build(trees, threshold_dtype=np.float32, value_dtype=np.float32, index_dtype=np.int32)
+        self._widen()
+
+    def _widen(self):
+        self.roots = self.roots.astype(np.intp)
+        self.feature = self.feature.astype(np.intp)
+        self.children = self.children.astype(np.intp)
+        self.threshold = self.threshold.astype(np.float64)
+
+    def __getstate__(self):
+        # Both slots of a node share feature, threshold and value, so one copy of each is stored
+        state = self.__dict__.copy()
+        state['roots'] = self.roots.astype(np.int32)
+        state['feature'] = self.feature[0::2].astype(np.int32)
+        state['threshold'] = self.threshold[0::2].astype(np.float32)
+        state['value'] = self.value[0::2]
+        state['children'] = self.children.astype(np.int32)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.feature = np.repeat(self.feature, 2)
+        self.threshold = np.repeat(self.threshold, 2)
+        self.value = np.repeat(self.value, 2)
+        self._widen()
+
+    def predict(self, features):
+        """Predict a model-ready DataFrame or array"""
+        if isinstance(features, pd.DataFrame):
+            if not features.columns.equals(self.feature_names):
+                raise ValueError("The feature names should match those that were passed during fit.")
+            X = features.to_numpy(dtype=np.float32)
+        else:
+            X = np.asarray(features, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"X has {X.shape[-1]} features, but the model expects {self.n_features}")
+        if not np.isfinite(X).all():
+            raise ValueError("Input X contains NaN or infinity.")
+        X = X.astype(np.float64)
+        if len(X) <= PREDICT_BLOCK_ROWS:
+            return self._predict_array(X)
+        return np.concatenate([
+            self._predict_array(X[start:start + PREDICT_BLOCK_ROWS]) for start in range(0, len(X), PREDICT_BLOCK_ROWS)
+        ])
+
+    def info(self):
+        return {
+            'trees': self.n_trees,
+            'nodes': self.n_nodes,
+            'max_depth': self.depth,
+            'max_rows': None,
+            'bytes': self.nbytes,
+            'profile': self.compaction_.get('profile')
+        }
+
+
+def r2_scores(predictions, y):
+    """R² of every column of predictions against y"""
+    ss_total = ((y - y.mean()) ** 2).sum()
+    return 1 - ((predictions - y[:, np.newaxis]) ** 2).sum(axis=0) / ss_total
+
+
+def candidate_scores(model, X, y):
+    """Validation R² and node count of every (trees, depth) prefix of the forest.
+
+    Returns (r2, nodes), both of shape (max_depth, n_trees): entry [d - 1, k - 1]
+    is the forest of the first k trees pruned to depth d. Each depth needs one
+    traversal; all tree counts then come from a running sum over trees.
+    """
+    trees = [tree_nodes(estimator.tree_) for estimator in model.estimators_]
+    max_depth = max(int(node_depths(nodes).max()) for nodes in trees)
+    X = np.asarray(X, dtype=np.float32).astype(np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    counts = np.arange(1, len(trees) + 1)
+
+    r2 = np.empty((max_depth, len(trees)))
+    nodes = np.empty((max_depth, len(trees)), dtype=np.int64)
+    for depth in range(1, max_depth + 1):
+        pruned = [prune_tree(tree, depth) for tree in trees]
+        forest = CompactRegressor(pruned, model.feature_names_in_)
+        leaf_values = forest.value[forest._leaves(X)].astype(np.float64)
+        r2[depth - 1] = r2_scores(np.cumsum(leaf_values, axis=1) / counts, y)
+        nodes[depth - 1] = np.cumsum([len(tree.feature) for tree in pruned])
+    return r2, nodes
+
+
+def choose_variant(profile, r2, nodes, baseline_r2, budget=DEFAULT_BUDGET):
+    """(trees, depth) for profile: the fewest nodes whose R² is within budget of baseline_r2"""
+    max_depth, n_trees = r2.shape
+    if profile == 'float32':
+        return n_trees, max_depth
+    allowed = r2 >= baseline_r2 - budget
+    if profile == 'trees':
+        allowed[:-1] = False
+    elif profile == 'depth':
+        allowed[:, :-1] = False
+    elif profile != 'pruned':
+        raise ValueError(f"Unknown compaction profile: {profile}")
+    if not allowed.any():
+        return n_trees, max_depth
+    # Fewest nodes, then the best R² among equally small variants
+    order = np.lexsort((-r2[allowed], nodes[allowed]))
+    depth_index, tree_index = (axis[order[0]] for axis in np.nonzero(allowed))
+    return int(tree_index) + 1, int(depth_index) + 1
+
+
+def compact_model(model, trees, depth, compaction=None):
+    """CompactRegressor of model's first trees, pruned to depth"""
+    if not isinstance(model, RandomForestRegressor) or model.n_outputs_ != 1:
+        raise TypeError(f"Compaction needs a single-output RandomForestRegressor, not {type(model).__name__}")
+    pruned = [prune_tree(tree_nodes(estimator.tree_), depth) for estimator in model.estimators_[:trees]]
+    metadata = dict(compaction or {}, trees=trees, max_depth=depth, dtype='float32',
+                    compacted_at=datetime.utcnow().isoformat())
+    return CompactRegressor(pruned, model.feature_names_in_, metadata)
+
+
+def compaction_info(model):
+    """Compaction metadata of a loaded model; sklearn models report profile 'none'"""
+    if isinstance(model, CompactRegressor):
+        return dict(model.compaction_)
+    return {'profile': 'none'}
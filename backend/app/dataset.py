@@ -0,0 +1,170 @@
+"""
+Out-of-core ingestion of training datasets
+
+A dataset is a file or a directory of CSV, .xlsx and Parquet files (see
+CUSTOM_DATASET_GUIDE.md) with the soil feature columns plus a productivity
+or yield target. Files are read in chunks by the same readers and column
+alias resolution as prediction uploads, and every valid row is offered to a
+fixed-size reservoir sample. Memory stays bounded by the chunk and reservoir
+sizes however many rows the files hold, and every row has the same chance of
+ending up in the sample.
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from .features import REQUIRED_COLUMNS, SOIL_TYPE_COLUMN, TARGET_COLUMN, resolve_columns, resolve_target
+from .scoring import DEFAULT_CHUNK_SIZE, iter_upload_chunks
+
+DATASET_EXTENSIONS = ('.csv', '.xlsx', '.parquet')
+DEFAULT_SAMPLE_SIZE = 200000
+
+
+def dataset_files(path):
+    """Dataset files under path (or path itself), in a stable order"""
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(DATASET_EXTENSIONS))
+    return files
+
+
+class Reservoir:
+    """Uniform fixed-size sample of a stream of rows (Algorithm R, vectorized per chunk)"""
+
+    def __init__(self, capacity, random_state=None):
+        self.capacity = capacity
+        self.rng = random_state if isinstance(random_state, np.random.RandomState) else np.random.RandomState(random_state)
+        self.numeric = np.empty((capacity, len(REQUIRED_COLUMNS)), dtype=np.float64)
+        self.soil_types = np.empty(capacity, dtype=object)
+        self.target = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+        self.seen = 0
+
+    def add(self, numeric, soil_types, target):
+        rows = len(target)
+        # Fill the free slots first
+        fill = min(rows, self.capacity - self.size)
+        if fill:
+            slots = slice(self.size, self.size + fill)
+            self.numeric[slots] = numeric[:fill]
+            self.soil_types[slots] = soil_types[:fill]
+            self.target[slots] = target[:fill]
+            self.size += fill
+
+        # Row number i (0-based over the stream) replaces a random slot with probability capacity / (i + 1)
+        if fill < rows:
+            stream_index = self.seen + np.arange(fill, rows)
+            slots = (self.rng.random_sample(rows - fill) * (stream_index + 1)).astype(np.int64)
+            accepted = np.flatnonzero(slots < self.capacity)
+            # Assigning to repeated indexes keeps an unspecified one, so only the
+            # last row drawing each slot is written, as in the sequential algorithm
+            _, last = np.unique(slots[accepted][::-1], return_index=True)
+            accepted = accepted[len(accepted) - 1 - last]
+            source = accepted + fill
+            self.numeric[slots[accepted]] = numeric[source]
+            self.soil_types[slots[accepted]] = soil_types[source]
+            self.target[slots[accepted]] = target[source]
+        self.seen += rows
+
+    def to_frame(self):
+        """The sample as a DataFrame of REQUIRED_COLUMNS, soilType and the target"""
+        data = pd.DataFrame(self.numeric[:self.size], columns=REQUIRED_COLUMNS)
+        data[SOIL_TYPE_COLUMN] = self.soil_types[:self.size]
+        data[TARGET_COLUMN] = self.target[:self.size]
+        return data
+
+    @property
+    def nbytes(self):
+        return self.numeric.nbytes + self.soil_types.nbytes + self.target.nbytes
+
+
+class IngestStats:
+    """Counters for one ingest run"""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.rows_read = 0
+        self.rows_valid = 0
+        self.skipped = []
+        self.partial = []
+        self.seconds = 0.0
+
+    @property
+    def rows_per_sec(self):
+        return self.rows_read / self.seconds if self.seconds else None
+
+    def to_dict(self):
+        return {
+            'files': self.files,
+            'bytes': self.bytes,
+            'rows_read': self.rows_read,
+            'rows_valid': self.rows_valid,
+            'rows_invalid': self.rows_read - self.rows_valid,
+            'skipped_files': list(self.skipped),
+            'partial_files': list(self.partial),
+            'seconds': self.seconds,
+            'rows_per_sec': self.rows_per_sec
+        }
+
+
+def _training_columns(chunk):
+    """(numeric, soil_types, target) arrays of a chunk's valid rows, or None without a target"""
+    resolution = resolve_columns(tuple(chunk.columns))
+    target_column = resolve_target(chunk.columns)
+    if resolution.missing:
+        raise ValueError(f"Missing required columns: {', '.join(resolution.missing)}")
+    if target_column is None:
+        return None
+    data = chunk.rename(columns=resolution.rename)
+
+    numeric = np.empty((len(data), len(REQUIRED_COLUMNS)), dtype=np.float64)
+    for i, col in enumerate(REQUIRED_COLUMNS):
+        numeric[:, i] = pd.to_numeric(data[col], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    target = pd.to_numeric(chunk[target_column], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    if SOIL_TYPE_COLUMN in data.columns:
+        soil_types = data[SOIL_TYPE_COLUMN].astype(object).where(data[SOIL_TYPE_COLUMN].notna(), None).to_numpy()
+    else:
+        soil_types = np.full(len(data), None, dtype=object)
+
+    valid = ~(np.isnan(numeric).any(axis=1) | np.isnan(target))
+    return numeric[valid], soil_types[valid], target[valid]
+
+
+def ingest(path, sample_size=DEFAULT_SAMPLE_SIZE, chunk_size=DEFAULT_CHUNK_SIZE, random_state=42):
+    """Stream every dataset file under path into a reservoir sample.
+
+    Returns (Reservoir, IngestStats). Files that cannot be read, or have no
+    target or required columns, are skipped and listed in stats.skipped. A
+    file that fails after some of its rows were sampled keeps those rows (a
+    reservoir cannot give them back) and is listed in stats.partial instead.
+    """
+    reservoir = Reservoir(sample_size, random_state)
+    stats = IngestStats()
+    start = time.perf_counter()
+    for file_path in dataset_files(path):
+        file_rows = 0
+        try:
+            filename = os.path.basename(file_path).lower()
+            for chunk in iter_upload_chunks(file_path, filename, chunk_size, keep_target=True):
+                columns = _training_columns(chunk)
+                if columns is None:
+                    raise ValueError("No productivity/yield target column")
+                reservoir.add(*columns)
+                stats.rows_read += len(chunk)
+                stats.rows_valid += len(columns[2])
+                file_rows += len(chunk)
+        except (ImportError, ValueError, OSError) as e:
+            if not file_rows:
+                stats.skipped.append({'file': file_path, 'error': str(e)})
+                continue
+            stats.partial.append({'file': file_path, 'error': str(e), 'rows_read': file_rows})
+        stats.files += 1
+        stats.bytes += os.path.getsize(file_path)
+    stats.seconds = time.perf_counter() - start
+    return reservoir, stats
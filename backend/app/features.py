@@ -0,0 +1,339 @@
+"""
+Feature encoding for the soil productivity model
+"""
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from .metrics import stage
+
+# Enhanced column mapping for flexibility
+COLUMN_MAPPING = {
+    # Basic nutrients
+    'N': 'nitrogen',
+    'n': 'nitrogen', 
+    'nitrogen': 'nitrogen',
+    
+    'P': 'phosphorus',
+    'p': 'phosphorus',
+    'phosphorus': 'phosphorus',
+    
+    'K': 'potassium',
+    'k': 'potassium',
+    'potassium': 'potassium',
+    
+    # Soil properties
+    'pH': 'ph',
+    'ph': 'ph',
+    'ph_value': 'ph',
+    'acidity': 'ph',
+    
+    # Organic matter
+    'OC': 'organic_matter',
+    'oc': 'organic_matter',
+    'organic_carbon': 'organic_matter',
+    
+    # Environmental factors
+    'Moisture': 'moisture',
+    'moisture': 'moisture',
+    'soil_moisture': 'moisture',
+    'soilmoisture': 'moisture',
+    'water_content': 'moisture',
+    'watercontent': 'moisture',
+    
+    'Temp': 'temperature',
+    'temp': 'temperature',
+    'Temperature': 'temperature',  # Added for Excel files with capital T
+    'temperature': 'temperature',
+    'soil_temp': 'temperature',
+    'soiltemp': 'temperature',
+    
+    # Electrical conductivity
+    'EC': 'electricalConductivity',
+    'ec': 'electricalConductivity',
+    'electrical_conductivity': 'electricalConductivity',
+    'conductivity': 'electricalConductivity',
+    
+    # Micronutrients
+    'S': 'sulphur',
+    's': 'sulphur',
+    'sulphur': 'sulphur',
+    'sulfur': 'sulphur',
+    
+    'Zn': 'zinc',
+    'zn': 'zinc',
+    'zinc': 'zinc',
+    
+    'Fe': 'iron',
+    'fe': 'iron',
+    'iron': 'iron',
+    
+    'Cu': 'copper',
+    'cu': 'copper',
+    'copper': 'copper',
+    
+    'Mn': 'manganese',
+    'mn': 'manganese',
+    'manganese': 'manganese',
+    
+    'B': 'boron',
+    'b': 'boron',
+    'boron': 'boron',
+    
+    # Humidity and Rainfall
+    'Humidity': 'humidity',
+    'humidity': 'humidity',
+    'relative_humidity': 'humidity',
+    
+    'Rainfall': 'rainfall',
+    'rain': 'rainfall',
+    'precipitation': 'rainfall',
+    
+    # Soil type - Enhanced mapping for Excel files
+    'soil_type': 'soilType',
+    'soiltype': 'soilType',
+    'texture': 'soilType',
+    'soil type': 'soilType',
+    'Soil Type': 'soilType',
+    'soil': 'soilType',
+    'Soil': 'soilType',
+    'soil_classification': 'soilType',
+    'soil_class': 'soilType',
+    'SOIL_TYPE': 'soilType',
+    'SOILTYPE': 'soilType',
+    'SOIL TYPE': 'soilType',
+    
+    # Location
+    'location': 'location',
+    'site': 'location',
+    'plot': 'location',
+}
+
+REQUIRED_COLUMNS = ['nitrogen', 'phosphorus', 'potassium', 'ph', 
+                    'organic_matter', 'electricalConductivity', 'sulphur', 'zinc', 'iron', 'copper', 'manganese', 'boron', 'moisture', 'temperature', 'humidity', 'rainfall']
+
+# Training target in user datasets, under any of these spellings (see CUSTOM_DATASET_GUIDE.md)
+TARGET_COLUMN = 'productivity'
+TARGET_ALIASES = ('productivity', 'productivity_score', 'productivityScore', 'yield', 'crop_yield')
+
+# Optional categorical column, one-hot encoded with this prefix by train_model.py
+SOIL_TYPE_COLUMN = 'soilType'
+SOIL_TYPE_PREFIX = 'soilType_'
+
+# Unit suffixes lab templates append to headers, e.g. "Nitrogen (kg/ha)", "Zn ppm", "Moisture %"
+_BRACKETED_SUFFIX = re.compile(r'\s*[\(\[\{][^\(\[\{]*[\)\]\}]\s*$')
+_UNIT_SUFFIX = re.compile(
+    r'(?:\s*(?:%|°\s*c|°\s*f)|[\s_]+(?:kg/ha|kg_ha|kgha|mg/kg|mg_kg|g/kg|ppm|ds/m|ds_m|ms/cm|mm|cm|pct|percent|deg_?c|celsius))$'
+)
+_NON_ALPHANUMERIC = re.compile(r'[^0-9a-z]+')
+
+HEADER_CACHE_SIZE = 256
+
+
+def normalize_header(name):
+    """Reduce a header to lowercase alphanumerics without unit suffixes.
+
+    "Soil Type", "SOIL_TYPE" and "soil-type" all become "soiltype", and
+    "Nitrogen (kg/ha)" becomes "nitrogen".
+    """
+    text = str(name).strip().lower()
+    while True:
+        stripped = _UNIT_SUFFIX.sub('', _BRACKETED_SUFFIX.sub('', text))
+        if stripped == text or not stripped:
+            break
+        text = stripped
+    return _NON_ALPHANUMERIC.sub('', text)
+
+
+# Names headers can resolve to: model inputs plus pass-through columns such as location
+FEATURE_TARGETS = frozenset(COLUMN_MAPPING.values()) | frozenset(REQUIRED_COLUMNS)
+
+
+def _build_normalized_aliases():
+    aliases = {}
+    for alias, feature in [(target, target) for target in sorted(FEATURE_TARGETS)] + list(COLUMN_MAPPING.items()):
+        key = normalize_header(alias)
+        if aliases.setdefault(key, feature) != feature:
+            raise ValueError(f"Column aliases '{alias}' and another spelling both normalize to '{key}'")
+    return aliases
+
+
+# Built once at import: normalized spelling -> feature name
+NORMALIZED_ALIASES = _build_normalized_aliases()
+NORMALIZED_TARGET_ALIASES = frozenset(normalize_header(alias) for alias in TARGET_ALIASES)
+
+
+def resolve_target(columns):
+    """Return the first header naming the training target, or None"""
+    for column in columns:
+        if normalize_header(column) in NORMALIZED_TARGET_ALIASES:
+            return column
+    return None
+
+
+class HeaderResolution:
+    """How one header row maps onto feature names.
+
+    Instances are cached and shared between requests, so treat them as read-only.
+    """
+
+    def __init__(self, rename, mapped, unmapped, duplicates, missing):
+        # rename only holds columns whose name changes
+        self.rename = rename
+        self.mapped = mapped
+        self.unmapped = unmapped
+        self.duplicates = duplicates
+        self.missing = missing
+
+    def to_dict(self):
+        return {
+            'mapped': [{'column': str(column), 'feature': feature, 'match': match} for column, feature, match in self.mapped],
+            'unmapped': [str(column) for column in self.unmapped],
+            'duplicates': [{'column': str(column), 'feature': feature} for column, feature in self.duplicates],
+            'missing': list(self.missing)
+        }
+
+
+def _resolve_header(column):
+    """Return (feature, match) for one header, or (None, None) if it is not recognised"""
+    if isinstance(column, str):
+        if column in COLUMN_MAPPING:
+            return COLUMN_MAPPING[column], 'exact'
+        if column in FEATURE_TARGETS:
+            return column, 'exact'
+    feature = NORMALIZED_ALIASES.get(normalize_header(column))
+    return (feature, 'normalized') if feature is not None else (None, None)
+
+
+@lru_cache(maxsize=HEADER_CACHE_SIZE)
+def resolve_columns(columns):
+    """Resolve a tuple of headers in one pass, cached per distinct header row.
+
+    When several headers resolve to the same feature, a header already named
+    after the feature wins, then the first one; the rest keep their names and
+    are reported as duplicates.
+    """
+    resolved = [(column, *_resolve_header(column)) for column in columns]
+    owners = {}
+    for column, feature, _ in resolved:
+        if feature is not None and (feature not in owners or column == feature):
+            owners[feature] = column
+    
+    rename = {}
+    mapped = []
+    unmapped = []
+    duplicates = []
+    for column, feature, match in resolved:
+        if feature is None:
+            unmapped.append(column)
+        elif owners[feature] != column:
+            duplicates.append((column, feature))
+        else:
+            mapped.append((column, feature, match))
+            if column != feature:
+                rename[column] = feature
+    missing = tuple(col for col in REQUIRED_COLUMNS if col not in owners)
+    return HeaderResolution(rename, tuple(mapped), tuple(unmapped), tuple(duplicates), missing)
+
+
+
+class FeatureEncoder:
+    """Encodes soil records straight into the model's feature matrix.
+
+    Built once per loaded model: the column index map and the soil type to
+    column offset table are computed up front, so encoding a request is a
+    single preallocated array write in model feature order instead of
+    pd.get_dummies plus per-column inserts, drops and a reorder.
+    """
+
+    def __init__(self, feature_names, dtype=np.float32):
+        # RandomForestRegressor casts its input to float32 before traversing
+        # the trees, so float32 is the cheapest dtype that gives identical scores
+        self.feature_names = [str(name) for name in feature_names]
+        self.dtype = np.dtype(dtype)
+        self.column_index = {name: i for i, name in enumerate(self.feature_names)}
+        
+        unknown_columns = [col for col in REQUIRED_COLUMNS if col not in self.column_index]
+        if unknown_columns:
+            raise ValueError(f"Model features do not include: {', '.join(unknown_columns)}")
+        self.numeric_offsets = np.array([self.column_index[col] for col in REQUIRED_COLUMNS], dtype=np.intp)
+        self.soil_type_offsets = {
+            name[len(SOIL_TYPE_PREFIX):]: i
+            for name, i in self.column_index.items()
+            if name.startswith(SOIL_TYPE_PREFIX)
+        }
+
+    @classmethod
+    def from_model(cls, model, dtype=np.float32):
+        return cls(model.feature_names_in_, dtype=dtype)
+
+    def encode(self, numeric, soil_types=None):
+        """Write numeric values and one-hot soil types into a new feature matrix.
+
+        numeric holds one column per entry of REQUIRED_COLUMNS, in that order.
+        Soil types the model was not trained on, and missing ones, leave every
+        soilType_* column at 0, as pd.get_dummies followed by a reindex would.
+        """
+        # Column-major layout keeps every column write contiguous and lets the
+        # DataFrame wrap the matrix as a single block without copying it
+        matrix = np.zeros((numeric.shape[0], len(self.feature_names)), dtype=self.dtype, order='F')
+        for i, offset in enumerate(self.numeric_offsets):
+            matrix[:, offset] = numeric[:, i]
+        
+        if soil_types is not None and self.soil_type_offsets:
+            codes, uniques = pd.factorize(np.asarray(soil_types, dtype=object))
+            # Trailing -1 entry catches the -1 code pd.factorize uses for missing values
+            lookup = np.array([self.soil_type_offsets.get(str(value), -1) for value in uniques] + [-1], dtype=np.intp)
+            offsets = lookup[codes]
+            rows = np.flatnonzero(offsets >= 0)
+            matrix[rows, offsets[rows]] = 1
+        
+        return matrix
+
+    def transform(self, data):
+        """Map, validate and encode a record dict or DataFrame for prediction"""
+        with stage('encode'):
+            return self._transform(data)
+
+    def _transform(self, data):
+        soil_types = None
+        
+        if isinstance(data, dict):
+            with stage('column_mapping'):
+                resolution = resolve_columns(tuple(data))
+            if resolution.missing:
+                raise ValueError(f"Missing required columns: {', '.join(resolution.missing)}")
+            mapped_data = {resolution.rename.get(col, col): value for col, value in data.items()}
+            
+            values = pd.Series([mapped_data[col] for col in REQUIRED_COLUMNS], dtype=object)
+            numeric = pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan).reshape(1, -1)
+            if SOIL_TYPE_COLUMN in mapped_data:
+                soil_types = pd.Series([mapped_data[SOIL_TYPE_COLUMN]], dtype=object, name=SOIL_TYPE_COLUMN)
+        else:
+            with stage('column_mapping'):
+                resolution = resolve_columns(tuple(data.columns))
+            if resolution.missing:
+                raise ValueError(f"Missing required columns in the file: {', '.join(resolution.missing)}. Found columns: {', '.join(map(str, data.columns))}")
+            if resolution.rename:
+                data = data.rename(columns=resolution.rename)
+            
+            numeric = np.empty((len(data), len(REQUIRED_COLUMNS)), dtype=np.float64, order='F')
+            for i, col in enumerate(REQUIRED_COLUMNS):
+                numeric[:, i] = pd.to_numeric(data[col], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+            if SOIL_TYPE_COLUMN in data.columns:
+                soil_types = data[SOIL_TYPE_COLUMN]
+        
+        invalid = np.isnan(numeric).any(axis=0)
+        if invalid.any():
+            columns = [col for col, bad in zip(REQUIRED_COLUMNS, invalid) if bad]
+            raise ValueError(f"Input contains invalid or missing values in: {', '.join(columns)}")
+        
+        df = pd.DataFrame(self.encode(numeric, soil_types), columns=self.feature_names, copy=False)
+        
+        # Store the original soil types as an attribute for later use
+        if soil_types is not None:
+            df.attrs['original_soil_types'] = soil_types.copy()
+        
+        return df
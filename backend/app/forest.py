@@ -0,0 +1,186 @@
+"""
+Compact random forest inference
+
+CompactForest flattens the trees of a fitted RandomForestRegressor into
+contiguous NumPy node arrays and evaluates every tree for a batch of rows at
+once, one tree level per step. This skips sklearn's input validation and
+per-tree joblib dispatch, which dominate the cost of predicting a few rows.
+Above max_rows, sklearn's per-tree loops are faster, so larger batches are
+passed to the wrapped model.
+
+Predictions match sklearn bit for bit. Inputs are rounded to float32 as in
+sklearn before they are compared with the float64 thresholds, and tree
+outputs are summed in estimator order before dividing by the number of
+trees, which is how RandomForestRegressor accumulates them.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+DEFAULT_MAX_ROWS = 1000
+VERIFY_ROWS = 512
+
+# One tree's nodes in sklearn's numbering; leaves have left == right == -1
+TreeNodes = namedtuple('TreeNodes', ['feature', 'threshold', 'left', 'right', 'value'])
+
+
+def tree_nodes(tree):
+    """TreeNodes of a fitted sklearn regression tree"""
+    return TreeNodes(tree.feature, tree.threshold, tree.children_left, tree.children_right, tree.value[:, 0, 0])
+
+
+def node_depths(nodes):
+    """Depth of every node, walking down one level at a time from the root"""
+    depths = np.zeros(len(nodes.feature), dtype=np.intp)
+    level = np.array([0])
+    depth = 0
+    while len(level):
+        depths[level] = depth
+        internal = level[nodes.left[level] != -1]
+        level = np.concatenate([nodes.left[internal], nodes.right[internal]])
+        depth += 1
+    return depths
+
+
+class CompactForest:
+    """Array-based evaluator for a single-output RandomForestRegressor.
+
+    Node i of the flattened forest occupies slots 2*i and 2*i + 1 of every
+    array, so a step computes the next slot as children[slot + went_right]
+    without a multiply. Leaves point back at themselves with an infinite
+    threshold, so all rows can take the same number of steps.
+    """
+
+    def __init__(self, model, max_rows=DEFAULT_MAX_ROWS):
+        if not isinstance(model, RandomForestRegressor) or model.n_outputs_ != 1:
+            raise TypeError(f"CompactForest supports single-output RandomForestRegressor, not {type(model).__name__}")
+
+        self.model = model
+        self.max_rows = max_rows
+        self.n_features = model.n_features_in_
+        self.feature_names = pd.Index(getattr(model, 'feature_names_in_', []))
+
+        self._build([tree_nodes(estimator.tree_) for estimator in model.estimators_])
+
+    def _build(self, trees, threshold_dtype=np.float64, value_dtype=np.float64, index_dtype=np.intp):
+        """Lay the TreeNodes of every tree out in the doubled-slot arrays"""
+        counts = np.array([len(nodes.feature) for nodes in trees])
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        n_nodes = int(counts.sum())
+
+        feature = np.zeros(n_nodes, dtype=index_dtype)
+        threshold = np.full(n_nodes, np.inf)
+        left = np.empty(n_nodes, dtype=np.intp)
+        right = np.empty(n_nodes, dtype=np.intp)
+        value = np.empty(n_nodes)
+        for nodes, offset in zip(trees, offsets):
+            block = slice(offset, offset + len(nodes.feature))
+            own = np.arange(offset, offset + len(nodes.feature))
+            leaf = nodes.left == -1
+            feature[block] = np.where(leaf, 0, nodes.feature)
+            threshold[block] = np.where(leaf, np.inf, nodes.threshold)
+            left[block] = np.where(leaf, own, nodes.left + offset)
+            right[block] = np.where(leaf, own, nodes.right + offset)
+            value[block] = nodes.value
+
+        if threshold_dtype != np.float64:
+            # Round thresholds down: for float32 inputs x <= t exactly when x <= t rounded down
+            narrow = threshold.astype(threshold_dtype)
+            above = narrow.astype(np.float64) > threshold
+            narrow[above] = np.nextafter(narrow[above], threshold_dtype(-np.inf))
+            threshold = narrow
+
+        self.n_trees = len(trees)
+        self.n_nodes = n_nodes
+        self.depth = max(int(node_depths(nodes).max()) for nodes in trees)
+        self.roots = 2 * offsets.astype(index_dtype)
+        self.feature = np.repeat(feature, 2)
+        self.threshold = np.repeat(threshold, 2)
+        self.value = np.repeat(value.astype(value_dtype), 2)
+        self.children = np.empty(2 * n_nodes, dtype=index_dtype)
+        self.children[0::2] = 2 * left
+        self.children[1::2] = 2 * right
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.roots, self.feature, self.threshold, self.value, self.children))
+
+    def _leaves(self, X):
+        """Leaf slot reached in every tree, shape (rows, trees)"""
+        feature, threshold, children = self.feature, self.threshold, self.children
+        if len(X) == 1:
+            x = X[0]
+            slots = self.roots
+            for _ in range(self.depth):
+                slots = children[slots + (x[feature[slots]] > threshold[slots])]
+            return slots[np.newaxis]
+
+        flat = X.ravel()
+        row_start = (np.arange(len(X)) * X.shape[1])[:, np.newaxis]
+        slots = np.broadcast_to(self.roots, (len(X), self.n_trees))
+        for _ in range(self.depth):
+            slots = children[slots + (flat[row_start + feature[slots]] > threshold[slots])]
+        return slots
+
+    def _predict_array(self, X):
+        leaf_values = self.value[self._leaves(X)]
+        # cumsum adds the trees one after another, like sklearn's accumulation
+        return np.cumsum(leaf_values, axis=1, dtype=np.float64)[:, -1] / self.n_trees
+
+    def predict(self, features):
+        """Predict a model-ready DataFrame or array like model.predict would"""
+        if len(features) > self.max_rows:
+            return self.model.predict(features)
+        if isinstance(features, pd.DataFrame):
+            if not features.columns.equals(self.feature_names):
+                # Let sklearn report mismatched columns
+                return self.model.predict(features)
+            X = features.to_numpy(dtype=np.float32)
+        else:
+            X = np.asarray(features, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features or not np.isfinite(X).all():
+            # sklearn rejects these or routes missing values by rules not flattened here
+            return self.model.predict(features)
+        return self._predict_array(np.ascontiguousarray(X, dtype=np.float64))
+
+    def verify(self, rows=VERIFY_ROWS, random_state=0):
+        """Check predictions equal sklearn's on probe rows that sit on and around split thresholds"""
+        rng = np.random.RandomState(random_state)
+        internal = self.threshold[0::2] != np.inf
+        split_features = self.feature[0::2][internal]
+        split_thresholds = self.threshold[0::2][internal]
+
+        X = np.zeros((rows, self.n_features))
+        for column in range(self.n_features):
+            candidates = split_thresholds[split_features == column]
+            if len(candidates):
+                picks = rng.choice(candidates, rows)
+                X[:, column] = picks + rng.choice([-1e-6, 0.0, 1e-6], rows) * np.maximum(np.abs(picks), 1)
+        X = X.astype(np.float32)
+
+        if len(self.feature_names):
+            probe = pd.DataFrame(X, columns=self.feature_names)
+        else:
+            probe = X
+        expected = self.model.predict(probe)
+        return np.array_equal(self._predict_array(X.astype(np.float64)), expected)
+
+    def info(self):
+        return {
+            'trees': self.n_trees,
+            'nodes': self.n_nodes,
+            'max_depth': self.depth,
+            'max_rows': self.max_rows,
+            'bytes': self.nbytes
+        }
+
+
+def compile_forest(model, max_rows=DEFAULT_MAX_ROWS):
+    """Return a verified CompactForest for model, or None if unsupported or inexact"""
+    try:
+        forest = CompactForest(model, max_rows)
+    except TypeError:
+        return None
+    return forest if forest.verify() else None
@@ -0,0 +1,148 @@
+"""
+Parallel inference for large prediction batches
+
+Batches at or above a row threshold are split into contiguous slices and
+scored by a persistent pool of worker processes, each of which loads the
+model file once when it starts, memory-mapped like the server's copy. Smaller
+batches are predicted in-process, where pool dispatch and pickling would cost
+more than they save. A batch whose pool breaks (a worker crashed) is predicted
+in-process and the pool is started afresh for the next one.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from .registry import model_file_version
+
+DEFAULT_PARALLEL_THRESHOLD = 20000
+
+logger = logging.getLogger(__name__)
+
+# Model loaded by this worker process
+_worker_model = None
+
+
+def _init_worker(model_path, mmap_mode=None):
+    global _worker_model
+    # The file is saved uncompressed, so its arrays map the shared page cache
+    # instead of being read into every worker; sklearn still copies the tree
+    # nodes into its own buffers when it unpickles them
+    _worker_model = joblib.load(model_path, mmap_mode=mmap_mode)
+
+
+def _predict_slice(matrix, feature_names):
+    # Keep feature names so sklearn validates columns the same way as in-process
+    return _worker_model.predict(pd.DataFrame(matrix, columns=feature_names, copy=False))
+
+
+class InferenceEngine:
+    """Routes predictions in-process or across a worker pool depending on batch size"""
+
+    def __init__(self, model_path, workers=0, threshold=DEFAULT_PARALLEL_THRESHOLD, mmap_mode=None):
+        self.model_path = model_path
+        self.mmap_mode = mmap_mode
+        self.workers = workers
+        self.threshold = threshold
+        self._executor = None
+        self._model_mtime = None
+        self._model_version = None
+        self._lock = threading.Lock()
+
+    @property
+    def parallel(self):
+        return self.workers > 1
+
+    def _pool(self):
+        # Workers hold the model from when the pool started; restart it if the file changed
+        mtime = os.stat(self.model_path).st_mtime_ns
+        with self._lock:
+            if self._executor is not None and mtime != self._model_mtime:
+                self._shutdown()
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.model_path, self.mmap_mode)
+                )
+                self._model_mtime = mtime
+                # Workers load whatever the file holds now, which may not be the caller's model
+                self._model_version = model_file_version(self.model_path)
+            return self._executor, self._model_version
+
+    def predict(self, model, features, version=None):
+        """Predict a model-ready DataFrame, in parallel when it is large enough.
+
+        model is the in-process predictor, a CompactForest or sklearn model.
+        version identifies the caller's model; if the workers hold a different
+        version (the model was swapped mid-request) the batch runs in-process.
+        """
+        if not self.parallel or len(features) < self.threshold or not os.path.exists(self.model_path):
+            return model.predict(features)
+
+        # reset() may shut the pool down between _pool() and submit; try once more
+        # on the pool that replaces it, then predict in-process
+        for _ in range(2):
+            pool, pool_version = self._pool()
+            if version is not None and version != pool_version:
+                return model.predict(features)
+            futures = self._submit(pool, features)
+            if futures is None:
+                continue
+            try:
+                return np.concatenate([future.result() for future in futures])
+            except BrokenProcessPool as e:
+                logger.warning("Inference pool broke (%s); predicting %d rows in-process", e, len(features))
+                self._discard(pool)
+                break
+        return model.predict(features)
+
+    def _submit(self, pool, features):
+        """Futures scoring contiguous slices of features, or None if the pool no longer accepts work"""
+        matrix = features.to_numpy()
+        feature_names = list(features.columns)
+        futures = []
+        try:
+            for part in np.array_split(matrix, self.workers):
+                if len(part):
+                    futures.append(pool.submit(_predict_slice, part, feature_names))
+        except RuntimeError:
+            # Shut down or broken (BrokenProcessPool is a RuntimeError)
+            for future in futures:
+                future.cancel()
+            return None
+        return futures
+
+    def _shutdown(self):
+        if self._executor is not None:
+            # Let slices already submitted finish on the old workers
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            self._model_mtime = None
+            self._model_version = None
+
+    def _discard(self, pool):
+        # Another request may already have replaced the broken pool
+        with self._lock:
+            if self._executor is pool:
+                self._shutdown()
+
+    def reset(self):
+        """Drop the worker pool, e.g. after the model was reloaded or retrained"""
+        with self._lock:
+            self._shutdown()
+
+    def info(self):
+        return {
+            'workers': self.workers,
+            'parallel_threshold': self.threshold,
+            'pool_running': self._executor is not None,
+            'pool_version': self._model_version
+        }
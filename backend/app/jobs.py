@@ -0,0 +1,187 @@
+"""
+Background prediction jobs for large file uploads
+
+Jobs are scored in a process pool so request workers stay free for
+interactive predictions. Each job lives in its own directory under
+UPLOAD_FOLDER/jobs, holding the uploaded input, a status.json file the
+worker rewrites after every chunk, and the scored result.csv.
+"""
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import joblib
+
+from .features import FeatureEncoder
+from .scoring import (DEFAULT_CHUNK_SIZE, DEFAULT_HEADER_SCAN_ROWS, PredictionSummary, iter_csv,
+                      iter_scored_chunks, iter_upload_chunks)
+
+STATUS_FILE = 'status.json'
+RESULT_FILE = 'result.csv'
+TERMINAL_STATES = ('completed', 'failed')
+
+_JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# Models loaded by this worker process, keyed by path and modification time
+_worker_models = {}
+
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+
+def write_status(job_dir, status):
+    """Atomically replace a job's status file so readers never see a partial write"""
+    tmp_path = os.path.join(job_dir, STATUS_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(tmp_path, os.path.join(job_dir, STATUS_FILE))
+
+
+def read_status(job_dir):
+    with open(os.path.join(job_dir, STATUS_FILE)) as f:
+        return json.load(f)
+
+
+def _load_worker_model(model_path):
+    """Load the model once per worker process, reloading only if the file changed"""
+    key = (model_path, os.stat(model_path).st_mtime_ns)
+    if key not in _worker_models:
+        _worker_models.clear()
+        model = joblib.load(model_path)
+        _worker_models[key] = (model, FeatureEncoder.from_model(model))
+    return _worker_models[key]
+
+
+def run_prediction_job(job_dir, input_path, filename, model_path, chunk_size=DEFAULT_CHUNK_SIZE,
+                       sheet=None, header_scan_rows=DEFAULT_HEADER_SCAN_ROWS):
+    """Worker process entry point: score an uploaded file and record progress"""
+    status = read_status(job_dir)
+    status.update({'status': 'running', 'started_at': _now(), 'rows_processed': 0})
+    write_status(job_dir, status)
+
+    result_path = os.path.join(job_dir, RESULT_FILE)
+    partial_path = result_path + '.part'
+    try:
+        model, encoder = _load_worker_model(model_path)
+        summary = PredictionSummary(preview_rows=0)
+
+        def results():
+            chunks = iter_upload_chunks(input_path, filename, chunk_size, sheet, header_scan_rows)
+            for result, predictions in iter_scored_chunks(model, encoder, chunks):
+                summary.update(result, predictions)
+                status['rows_processed'] = summary.total_records
+                status['updated_at'] = _now()
+                write_status(job_dir, status)
+                yield result
+
+        with open(partial_path, 'w', newline='') as f:
+            for text in iter_csv(results()):
+                f.write(text)
+
+        if summary.total_records == 0:
+            raise ValueError('File is empty or could not be parsed')
+
+        os.replace(partial_path, result_path)
+        status.update({'status': 'completed', 'finished_at': _now(), **summary.to_dict()})
+    except Exception as e:
+        status.update({
+            'status': 'failed',
+            'finished_at': _now(),
+            'error': str(e),
+            'traceback': traceback.format_exc()
+        })
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    finally:
+        if os.path.exists(input_path):
+            os.remove(input_path)
+
+    write_status(job_dir, status)
+    return status['status']
+
+
+class JobManager:
+    """Submits prediction jobs to a process pool and tracks them on disk"""
+
+    def __init__(self, root, max_workers=None, chunk_size=DEFAULT_CHUNK_SIZE, header_scan_rows=DEFAULT_HEADER_SCAN_ROWS):
+        self.root = root
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.header_scan_rows = header_scan_rows
+        self._executor = None
+        os.makedirs(self.root, exist_ok=True)
+
+    @property
+    def executor(self):
+        # Spawned workers do not inherit the server's threads or loaded model
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    def job_dir(self, job_id):
+        if not _JOB_ID_PATTERN.match(job_id):
+            raise KeyError(job_id)
+        job_dir = os.path.join(self.root, job_id)
+        if not os.path.isdir(job_dir):
+            raise KeyError(job_id)
+        return job_dir
+
+    def submit(self, file, filename, model_path, sheet=None):
+        """Save an uploaded file into a new job directory and queue it for scoring.
+
+        sheet selects the worksheet of an Excel upload.
+        """
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.root, job_id)
+        os.makedirs(job_dir)
+
+        input_path = os.path.join(job_dir, 'input.' + filename.rsplit('.', 1)[1].lower())
+        file.save(input_path)
+
+        write_status(job_dir, {
+            'job_id': job_id,
+            'filename': filename,
+            'sheet': sheet,
+            'status': 'queued',
+            'submitted_at': _now(),
+            'rows_processed': 0
+        })
+
+        future = self.executor.submit(
+            run_prediction_job, job_dir, input_path, filename, model_path,
+            self.chunk_size, sheet, self.header_scan_rows
+        )
+        future.add_done_callback(lambda f: self._on_done(job_dir, f))
+        return job_id
+
+    def _on_done(self, job_dir, future):
+        # Record jobs whose worker died before it could write a final status
+        error = future.exception()
+        if error is None:
+            return
+        try:
+            status = read_status(job_dir)
+            if status.get('status') not in TERMINAL_STATES:
+                status.update({'status': 'failed', 'finished_at': _now(), 'error': str(error)})
+                write_status(job_dir, status)
+        except OSError:
+            pass
+
+    def status(self, job_id):
+        return read_status(self.job_dir(job_id))
+
+    def result_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), RESULT_FILE)
+
+    def delete(self, job_id):
+        shutil.rmtree(self.job_dir(job_id))
@@ -0,0 +1,68 @@
+"""
+Resident memory of the current process
+
+On Linux this reads /proc/self/status and /proc/self/smaps_rollup, which
+split resident memory into private and shared pages. Pss (proportional set
+size) charges each shared page to the processes mapping it, so summing Pss
+across gunicorn workers shows what sharing the model actually saves.
+"""
+import os
+
+_STATUS_FIELDS = {
+    'VmRSS': 'rss_bytes',
+    'VmHWM': 'peak_rss_bytes',
+    'RssAnon': 'rss_anon_bytes',
+    'RssFile': 'rss_file_bytes',
+    'RssShmem': 'rss_shmem_bytes',
+}
+_ROLLUP_FIELDS = {
+    'Pss': 'pss_bytes',
+    'Shared_Clean': 'shared_clean_bytes',
+    'Shared_Dirty': 'shared_dirty_bytes',
+    'Private_Clean': 'private_clean_bytes',
+    'Private_Dirty': 'private_dirty_bytes',
+}
+
+
+def _read_kb_fields(path, fields):
+    values = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                name, _, rest = line.partition(':')
+                if name in fields:
+                    values[fields[name]] = int(rest.split()[0]) * 1024
+    except OSError:
+        pass
+    return values
+
+
+def process_memory():
+    """Return the current process's memory usage in bytes"""
+    memory = {'pid': os.getpid()}
+    memory.update(_read_kb_fields('/proc/self/status', _STATUS_FIELDS))
+    memory.update(_read_kb_fields('/proc/self/smaps_rollup', _ROLLUP_FIELDS))
+
+    if 'peak_rss_bytes' not in memory:
+        try:
+            import resource
+            import sys
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+            memory['peak_rss_bytes'] = peak if sys.platform == 'darwin' else peak * 1024
+        except ImportError:
+            pass
+    return memory
+
+
+def reset_peak_rss():
+    """Reset this process's peak RSS (VmHWM) so it can be measured per phase.
+
+    Linux only; returns False where the peak cannot be reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,224 @@
+"""
+Per-request stage timing and Prometheus text exposition
+
+Each request gets a RequestTimer in flask.g. Code on the prediction path
+wraps its stages (parse, column_mapping, encode, predict, serialize) in
+stage(); outside a request, e.g. in background job workers, stage() does
+nothing. When the response has been sent (for streamed responses, after the
+last chunk) the stage totals and the request duration are recorded in
+histograms labelled by request type, and rendered by /api/metrics.
+
+Metrics live in the process that served the request. Under gunicorn every
+worker keeps its own, so scrape each worker or aggregate on the Prometheus side.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+
+# Upper bounds in seconds; +Inf is implicit
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values"""
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, [list(s[0]), s[1], s[2]]) for labels, s in self._series.items())
+        for label_values, (counts, total, count) in series:
+            labels = list(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(labels + [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {count}')
+        return lines
+
+
+class Counter:
+    """Monotonic counter keyed by a tuple of label values"""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_format_labels(list(zip(self.label_names, label_values)))} {_format_value(value)}")
+        return lines
+
+
+class RequestTimer:
+    """Accumulates stage durations and scored rows for one request.
+
+    Stages may nest, e.g. a streamed serialize stage pulls chunks that are
+    parsed and predicted on demand. Only the innermost running stage is
+    charged, so stage totals never count the same time twice.
+    """
+
+    def __init__(self, request_type):
+        self.request_type = request_type
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.rows = 0
+        self._running = []
+        self._mark = self.started
+
+    def _charge(self, now):
+        if self._running:
+            stage_name = self._running[-1]
+            self.stages[stage_name] = self.stages.get(stage_name, 0.0) + now - self._mark
+        self._mark = now
+
+    def enter(self, stage_name):
+        self._charge(time.perf_counter())
+        self._running.append(stage_name)
+
+    def exit(self):
+        self._charge(time.perf_counter())
+        self._running.pop()
+
+
+class Metrics:
+    """Request metrics for this process plus collectors for other components' stats"""
+
+    def __init__(self):
+        self.request_duration = Histogram(
+            'soil_request_duration_seconds', 'Time from request start until the response was sent',
+            ('request_type', 'status')
+        )
+        self.stage_duration = Histogram(
+            'soil_request_stage_seconds', 'Time spent per request in each processing stage',
+            ('request_type', 'stage')
+        )
+        self.rows_scored = Counter('soil_rows_scored_total', 'Rows scored by the model', ('request_type',))
+        self._metrics = []
+        self._collectors = []
+
+    def add_metric(self, metric):
+        """Render a Histogram or Counter owned by another component"""
+        self._metrics.append(metric)
+
+    def add_collector(self, collector):
+        """Register collector() -> [(name, type, help, value)] read at render time"""
+        self._collectors.append(collector)
+
+    def observe_request(self, timer, status):
+        self.request_duration.observe(time.perf_counter() - timer.started, timer.request_type, str(status))
+        for stage_name, seconds in timer.stages.items():
+            self.stage_duration.observe(seconds, timer.request_type, stage_name)
+        if timer.rows:
+            self.rows_scored.inc(timer.rows, timer.request_type)
+
+    def render(self):
+        lines = self.request_duration.render() + self.stage_duration.render() + self.rows_scored.render()
+        for metric in self._metrics:
+            lines += metric.render()
+        for collector in self._collectors:
+            for name, metric_type, help_text, value in collector():
+                if value is None:
+                    continue
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}', f'{name} {_format_value(value)}']
+        return '\n'.join(lines) + '\n'
+
+
+def current_timer():
+    if has_request_context():
+        return g.get('request_timer')
+    return None
+
+
+def set_request_type(request_type):
+    """Label the current request's metrics, e.g. 'json_batch' or 'file_stream'"""
+    timer = current_timer()
+    if timer is not None:
+        timer.request_type = request_type
+
+
+def add_rows(count):
+    timer = current_timer()
+    if timer is not None:
+        timer.rows += count
+
+
+@contextmanager
+def stage(stage_name):
+    """Time a block as part of the current request's stage_name total"""
+    timer = current_timer()
+    if timer is None:
+        yield
+        return
+    timer.enter(stage_name)
+    try:
+        yield
+    finally:
+        timer.exit()
+
+
+def timed_iter(iterable, stage_name):
+    """Yield from iterable, charging the time spent producing each item to stage_name"""
+    iterator = iter(iterable)
+    while True:
+        with stage(stage_name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
@@ -0,0 +1,249 @@
+"""
+Model registry: owns the active model version and reports its loading state
+
+The app boots without touching the model. Depending on MODEL_LOADING the
+model file is then read eagerly, in a background warm-up thread, or on the
+first request that needs it. Loading only ever reads models/soil_model.pkl;
+training happens from train_model.py, /api/model/retrain, or (when
+MODEL_AUTOTRAIN is enabled) the background warm-up thread, never as a side
+effect of a request.
+
+Each loaded model is wrapped in an immutable ModelVersion. Requests take the
+active version once and use it throughout, so swapping in a reloaded or
+retrained model is a single reference assignment: in-flight requests finish
+on the version they started with and new requests get the new one.
+Loading also flattens the forest into a CompactForest for fast small-batch
+inference; requests predict through ModelVersion.predictor. A model file
+written by compact_model.py already is a CompactRegressor and is used as is.
+"""
+import hashlib
+import importlib.util
+import logging
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+import joblib
+
+from .compaction import CompactRegressor, compaction_info
+from .features import FeatureEncoder
+from .forest import DEFAULT_MAX_ROWS, compile_forest
+
+NOT_LOADED = 'not_loaded'
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+LOADING_MODES = ('background', 'lazy', 'eager')
+
+logger = logging.getLogger(__name__)
+
+class ModelVersion(namedtuple('ModelVersion', ['version', 'model', 'encoder', 'loaded_at', 'forest'])):
+    @property
+    def predictor(self):
+        """The CompactForest if one was compiled, otherwise the sklearn model"""
+        return self.forest if self.forest is not None else self.model
+
+
+class ModelRegistry:
+    """Holds the active ModelVersion, the loading state and background retraining"""
+
+    def __init__(self, model_path, mmap_mode=None, compact_max_rows=DEFAULT_MAX_ROWS, retrain_jobs=1):
+        self.model_path = model_path
+        self.mmap_mode = mmap_mode
+        # Largest batch predicted by the CompactForest; 0 always uses sklearn
+        self.compact_max_rows = compact_max_rows
+        # Threads building trees when training in this process, leaving the other cores to requests
+        self.retrain_jobs = retrain_jobs
+        self.active = None
+        self.state = NOT_LOADED
+        self.error = None
+        self.retrain_status = {'state': 'idle'}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._warmup_thread = None
+
+        # A warm-up thread does not survive fork (e.g. gunicorn workers), so a
+        # child that inherits the 'loading' state falls back to loading lazily
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._warmup_thread = None
+        if self.state == LOADING:
+            self.state = NOT_LOADED
+
+    @property
+    def model(self):
+        active = self.active
+        return active.model if active is not None else None
+
+    @property
+    def encoder(self):
+        active = self.active
+        return active.encoder if active is not None else None
+
+    @property
+    def version(self):
+        active = self.active
+        return active.version if active is not None else None
+
+    def on_swap(self, listener):
+        """Call listener after every model swap, with the new ModelVersion, e.g. to drop caches"""
+        self._listeners.append(listener)
+
+    def load(self):
+        """Read the model file and swap it in. Never trains a model."""
+        with self._load_lock:
+            return self._load()
+
+    def _load(self):
+        with self._lock:
+            # Keep serving the current version while a replacement is read
+            if self.state != READY:
+                self.state = LOADING
+        try:
+            if not os.path.exists(self.model_path):
+                raise FileNotFoundError(
+                    f"Model not found at {self.model_path}. "
+                    "Run: python train_model.py or POST /api/model/retrain"
+                )
+            version = model_file_version(self.model_path)
+            model = joblib.load(self.model_path, mmap_mode=self.mmap_mode)
+            forest = None
+            if self.compact_max_rows > 0 and not isinstance(model, CompactRegressor):
+                forest = compile_forest(model, self.compact_max_rows)
+                if forest is None:
+                    logger.warning("Model %s cannot be compacted exactly, predicting with sklearn", version)
+            loaded = ModelVersion(version, model, FeatureEncoder.from_model(model), datetime.utcnow().isoformat(), forest)
+        except Exception as e:
+            logger.error("Error loading model: %s", e)
+            with self._lock:
+                self.state = READY if self.active is not None else FAILED
+                self.error = str(e)
+            return None
+
+        with self._lock:
+            self.active = loaded
+            self.state = READY
+            self.error = None
+        logger.info("Model %s loaded from %s", loaded.version, self.model_path)
+
+        for listener in self._listeners:
+            try:
+                listener(loaded)
+            except Exception as e:
+                logger.exception("Model swap listener failed: %s", e)
+        return loaded
+
+    def get(self):
+        """Return the active ModelVersion without blocking on a warm-up or retrain.
+
+        In lazy mode the first call loads the model file synchronously. A model
+        that failed to load is retried once its file exists.
+        """
+        active = self.active
+        if active is not None:
+            return active
+        state = self.state
+        if state == NOT_LOADED or (state == FAILED and os.path.exists(self.model_path)):
+            with self._load_lock:
+                if self.active is not None:
+                    return self.active
+                return self._load()
+        return None
+
+    def start_warmup(self, autotrain=False):
+        """Load the model (training it first if allowed and missing) in a daemon thread"""
+        with self._lock:
+            if self.state == READY or (self._warmup_thread is not None and self._warmup_thread.is_alive()):
+                return
+            self.state = LOADING
+            self._warmup_thread = threading.Thread(
+                target=self._warmup, args=(autotrain,), name='model-warmup', daemon=True
+            )
+        self._warmup_thread.start()
+
+    def _warmup(self, autotrain):
+        if autotrain and not os.path.exists(self.model_path):
+            try:
+                logger.warning("Model not found at %s, training a new one in the background", self.model_path)
+                train_model_file(self.retrain_jobs)
+            except Exception as e:
+                logger.exception("Error training model: %s", e)
+        self.load()
+
+    def start_retrain(self):
+        """Retrain in a background thread and swap the new model in once it is ready.
+
+        Returns False if a retrain is already running.
+        """
+        with self._lock:
+            if self.retrain_status['state'] == 'running':
+                return False
+            self.retrain_status = {
+                'state': 'running',
+                'started_at': datetime.utcnow().isoformat(),
+                'previous_version': self.version
+            }
+        threading.Thread(target=self._retrain, name='model-retrain', daemon=True).start()
+        return True
+
+    def _retrain(self):
+        status = dict(self.retrain_status)
+        try:
+            train_model_file(self.retrain_jobs)
+            loaded = self.load()
+            if loaded is None:
+                raise Exception(f"Model retrained but could not be loaded: {self.error}")
+            status.update({'state': 'completed', 'version': loaded.version})
+        except Exception as e:
+            logger.exception("Error retraining model: %s", e)
+            status.update({'state': 'failed', 'error': str(e)})
+        status['finished_at'] = datetime.utcnow().isoformat()
+        with self._lock:
+            self.retrain_status = status
+
+    def info(self):
+        active = self.active
+        return {
+            'state': self.state,
+            'version': active.version if active is not None else None,
+            'error': self.error,
+            'loaded_at': active.loaded_at if active is not None else None,
+            'compact_forest': active.forest.info() if active is not None and active.forest is not None else None,
+            'compaction': compaction_info(active.model) if active is not None else None,
+            'retrain': dict(self.retrain_status)
+        }
+
+
+def model_file_version(path):
+    """Short content hash identifying a saved model, stable across processes"""
+    digest = hashlib.blake2b(digest_size=6)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def train_model_file(n_jobs=1):
+    """Run train_soil_model() from backend/train_model.py inside this process.
+
+    Trees are built by n_jobs threads, and the server's peak RSS counter is
+    left alone.
+    """
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    train_model_path = os.path.join(backend_dir, 'train_model.py')
+    if not os.path.exists(train_model_path):
+        raise FileNotFoundError(f"train_model.py not found at {train_model_path}")
+
+    spec = importlib.util.spec_from_file_location("train_model", train_model_path)
+    if spec is None or spec.loader is None:
+        raise Exception(f"Could not load module spec from {train_model_path}")
+    train_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(train_module)
+    return train_module.train_soil_model(n_jobs=n_jobs, track_memory=False)
@@ -1,67 +1,64 @@
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, Response, jsonify, request, current_app, send_file, stream_with_context
 import os
 import pandas as pd
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
-import joblib
 import numpy as np
 from datetime import datetime
+import itertools
 import json
+import logging
 import traceback
 
+from .clustering import (DEFAULT_BATCH_SIZE, DEFAULT_K, DEFAULT_MAX_ITERATIONS, MAX_K, cluster_summaries, frame_features,
+                         kmeans, labeled_response, record_features, result_info)
+from .compaction import compaction_info
+from .features import REQUIRED_COLUMNS, resolve_columns
+from .memory import process_memory
+from .metrics import add_rows, set_request_type, stage, timed_iter
+from .registry import LOADING, READY, ModelRegistry
+from .serialization import RESPONSE_SHAPES, frame_records, parse_flag
+from .scoring import SCORE_COLUMNS, STREAM_MIMETYPES, PredictionSummary, format_stream, iter_csv_chunks, iter_scored_chunks, iter_upload_chunks, productivity_levels
+
+logger = logging.getLogger(__name__)
+
 # Create a Blueprint
 main = Blueprint('main', __name__)
 
 # Load the trained model
 MODEL_PATH = os.path.join(os.path.dirname(__file__), '..', 'models', 'soil_model.pkl')
-model = None
+# The model is saved uncompressed, so its numpy arrays can be memory-mapped on load
+MODEL_MMAP_MODE = os.environ.get('MODEL_MMAP_MODE', 'r') or None
+# Batches up to this many rows skip sklearn's predict overhead; 0 disables the compact forest
+COMPACT_FOREST_MAX_ROWS = int(os.environ.get('COMPACT_FOREST_MAX_ROWS', 1000))
+# Threads building trees during /api/model/retrain, so retraining does not starve requests of CPU
+RETRAIN_JOBS = int(os.environ.get('RETRAIN_JOBS', 1))
+registry = ModelRegistry(MODEL_PATH, mmap_mode=MODEL_MMAP_MODE, compact_max_rows=COMPACT_FOREST_MAX_ROWS,
+                         retrain_jobs=RETRAIN_JOBS)
 
 def load_model(force_reload=False):
-    """Load the ML model, creating it if it doesn't exist"""
-    global model
-    if model is not None and not force_reload:
-        return model
-    
-    try:
-        # Ensure models directory exists
-        models_dir = os.path.dirname(MODEL_PATH)
-        os.makedirs(models_dir, exist_ok=True)
-        
-        if os.path.exists(MODEL_PATH):
-            model = joblib.load(MODEL_PATH)
-            print(f"✓ Model loaded successfully from {MODEL_PATH}")
-        else:
-            print(f"⚠ Model not found at {MODEL_PATH}")
-            print("  Training new model...")
-            # Import and train model
-            backend_dir = os.path.dirname(os.path.dirname(__file__))
-            train_model_path = os.path.join(backend_dir, 'train_model.py')
-            
-            if os.path.exists(train_model_path):
-                import importlib.util
-                spec = importlib.util.spec_from_file_location("train_model", train_model_path)
-                if spec is not None and spec.loader is not None:
-                    train_module = importlib.util.module_from_spec(spec)
-                    spec.loader.exec_module(train_module)
-                    train_module.train_soil_model()
-                    
-                    if os.path.exists(MODEL_PATH):
-                        model = joblib.load(MODEL_PATH)
-                        print(f"✓ New model trained and loaded successfully!")
-                    else:
-                        raise Exception("Model training completed but file not found")
-                else:
-                    raise Exception(f"Could not load module spec from {train_model_path}")
-            else:
-                raise FileNotFoundError(f"train_model.py not found at {train_model_path}")
-    except Exception as e:
-        print(f"❌ Error loading model: {e}")
-        print(traceback.format_exc())
-        model = None
-    
-    return model
+    """Return the active model, reading it from disk if forced or not loaded yet.
+
+    Never trains a model and never waits for a background warm-up; returns
+    None while the model is loading or if it could not be loaded.
+    """
+    active = registry.load() if force_reload else registry.get()
+    return active.model if active is not None else None
 
-# Try to load model on startup
-load_model()
+def model_unavailable():
+    """503 response explaining why no model is available"""
+    if registry.state == LOADING:
+        response = jsonify({
+            'error': 'Prediction model is still loading. Please retry shortly.',
+            'model_state': registry.state
+        })
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    return jsonify({
+        'error': 'Prediction model not loaded. Please train the model first.',
+        'model_state': registry.state,
+        'detail': registry.error
+    }), 503
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'xls'}
@@ -69,233 +66,254 @@ ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'xls'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def requested_response_format():
+    """Pick 'json', 'ndjson' or 'csv' from the format query parameter or Accept header"""
+    fmt = request.args.get('format')
+    if fmt:
+        return fmt.lower()
+    best = request.accept_mimetypes.best_match(['application/json'] + list(STREAM_MIMETYPES.values()))
+    for name, mimetype in STREAM_MIMETYPES.items():
+        if best == mimetype:
+            return name
+    return 'json'
+
+def requested_sheet():
+    """Worksheet to read from an Excel upload: ?sheet= or a 'sheet' form field"""
+    return request.args.get('sheet') or request.form.get('sheet') or None
+
+def requested_response_shape():
+    """'records' (default) or 'columnar' from the shape query parameter"""
+    return (request.args.get('shape') or 'records').lower()
+
+def requested_echo_inputs():
+    """Whether results repeat the submitted inputs; ?echo_inputs=0 leaves them out"""
+    return parse_flag(request.args.get('echo_inputs'))
+
+def requested_cluster_options(body=None):
+    """k, max_iterations, batch_size and random_state from the query string or a JSON object body"""
+    body = body if isinstance(body, dict) else {}
+    
+    def option(name, default, low, high):
+        value = request.args.get(name, body.get(name, default))
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be an integer")
+        if not low <= value <= high:
+            raise ValueError(f"{name} must be between {low} and {high}")
+        return value
+    
+    return {
+        'k': option('k', DEFAULT_K, 1, MAX_K),
+        'max_iterations': option('max_iterations', DEFAULT_MAX_ITERATIONS, 1, 10000),
+        'batch_size': option('batch_size', DEFAULT_BATCH_SIZE, 16, 1 << 20),
+        'random_state': option('random_state', 0, 0, 2 ** 32 - 1)
+    }
+
+def upload_chunks(file, filename):
+    """Chunks of an uploaded CSV or Excel file, read from the start of its buffer"""
+    file.stream.seek(0)
+    chunk_size = current_app.config['PREDICT_CHUNK_SIZE']
+    if filename.endswith('.csv'):
+        return iter_csv_chunks(file.stream, chunk_size)
+    return iter_upload_chunks(file.stream, filename, chunk_size, sheet=requested_sheet(),
+                              header_scan_rows=current_app.config['EXCEL_HEADER_SCAN_ROWS'])
+
+def stream_clusters(result, file, filename, stream_format):
+    """Re-read the upload and stream every row with its cluster label"""
+    def labeled_chunks():
+        offset = 0
+        for chunk in upload_chunks(file, filename):
+            if chunk.empty:
+                continue
+            yield chunk.assign(cluster=result.labels[offset:offset + len(chunk)])
+            offset += len(chunk)
+    
+    def generate():
+        if stream_format == 'ndjson':
+            # Centroids first, so a client has them before the rows
+            yield json.dumps({'clusters': cluster_summaries(result), **result_info(result)}) + '\n'
+        chunks = labeled_chunks()
+        try:
+            yield from timed_iter(format_stream(chunks, stream_format), 'serialize')
+        except Exception as e:
+            # Abort the chunked response, as stream_predictions does, so a CSV cannot look complete
+            logger.exception("Streaming clusters failed for %s: %s", filename, e)
+            if stream_format == 'ndjson':
+                yield json.dumps({'error': f'Processing error: {str(e)}'}) + '\n'
+            raise
+        finally:
+            chunks.close()
+    
+    headers = {}
+    if stream_format == 'csv':
+        headers['Content-Disposition'] = f'attachment; filename="{filename.rsplit(".", 1)[0]}_clusters.csv"'
+    return Response(stream_with_context(generate()), mimetype=STREAM_MIMETYPES[stream_format], headers=headers)
+
+def stream_predictions(first_result, scored, stream_format, filename, model_version=None, reader=None):
+    """Build a streamed response that writes every scored row as chunks are scored.
+
+    reader, the generator parsing the upload, is closed when streaming ends,
+    while the upload buffer it reads from is still open.
+    """
+    def results():
+        yield first_result
+        for result, _ in scored:
+            yield result
+    
+    def generate():
+        try:
+            yield from timed_iter(format_stream(results(), stream_format), 'serialize')
+        except Exception as e:
+            # Headers are already sent, so the status can no longer change. Re-raising
+            # makes the server abort the chunked response, so a truncated CSV is not
+            # mistaken for a complete one; NDJSON clients also get an error line first.
+            logger.exception("Streaming prediction failed for %s: %s", filename, e)
+            if stream_format == 'ndjson':
+                yield json.dumps({'error': f'Processing error: {str(e)}'}) + '\n'
+            raise
+        finally:
+            if reader is not None:
+                reader.close()
+    
+    headers = {'X-Model-Version': model_version or ''}
+    if stream_format == 'csv':
+        headers['Content-Disposition'] = f'attachment; filename="{filename.rsplit(".", 1)[0]}_predictions.csv"'
+    return Response(stream_with_context(generate()), mimetype=STREAM_MIMETYPES[stream_format], headers=headers)
+
 @main.route('/')
 def index():
     return "Welcome to Soil Productivity Prediction API!"
 
 @main.route('/api/health', methods=['GET'])
 def health_check():
-    # Try to reload model if not loaded
-    current_model = load_model()
+    # Report the model state without loading or training anything
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.utcnow().isoformat(),
         'service': 'Soil Productivity Prediction API',
-        'model_loaded': current_model is not None,
+        'model_loaded': registry.state == READY,
+        'model_state': registry.state,
         'version': '1.0.0'
     }), 200
 
-def preprocess_input(data):
-    # Enhanced column mapping for flexibility
-    column_mapping = {
-        # Basic nutrients
-        'N': 'nitrogen',
-        'n': 'nitrogen', 
-        'nitrogen': 'nitrogen',
-        
-        'P': 'phosphorus',
-        'p': 'phosphorus',
-        'phosphorus': 'phosphorus',
-        
-        'K': 'potassium',
-        'k': 'potassium',
-        'potassium': 'potassium',
-        
-        # Soil properties
-        'pH': 'ph',
-        'ph': 'ph',
-        'ph_value': 'ph',
-        'acidity': 'ph',
-        
-        # Organic matter
-        'OC': 'organic_matter',
-        'oc': 'organic_matter',
-        'organic_carbon': 'organic_matter',
-        
-        # Environmental factors
-        'Moisture': 'moisture',
-        'moisture': 'moisture',
-        'soil_moisture': 'moisture',
-        'soilmoisture': 'moisture',
-        'water_content': 'moisture',
-        'watercontent': 'moisture',
-        
-        'Temp': 'temperature',
-        'temp': 'temperature',
-        'Temperature': 'temperature',  # Added for Excel files with capital T
-        'temperature': 'temperature',
-        'soil_temp': 'temperature',
-        'soiltemp': 'temperature',
-        
-        # Electrical conductivity
-        'EC': 'electricalConductivity',
-        'ec': 'electricalConductivity',
-        'electrical_conductivity': 'electricalConductivity',
-        'conductivity': 'electricalConductivity',
-        
-        # Micronutrients
-        'S': 'sulphur',
-        's': 'sulphur',
-        'sulphur': 'sulphur',
-        'sulfur': 'sulphur',
-        
-        'Zn': 'zinc',
-        'zn': 'zinc',
-        'zinc': 'zinc',
-        
-        'Fe': 'iron',
-        'fe': 'iron',
-        'iron': 'iron',
-        
-        'Cu': 'copper',
-        'cu': 'copper',
-        'copper': 'copper',
-        
-        'Mn': 'manganese',
-        'mn': 'manganese',
-        'manganese': 'manganese',
-        
-        'B': 'boron',
-        'b': 'boron',
-        'boron': 'boron',
-        
-        # Humidity and Rainfall
-        'Humidity': 'humidity',
-        'humidity': 'humidity',
-        'relative_humidity': 'humidity',
-        
-        'Rainfall': 'rainfall',
-        'rain': 'rainfall',
-        'precipitation': 'rainfall',
-        
-        # Soil type - Enhanced mapping for Excel files
-        'soil_type': 'soilType',
-        'soiltype': 'soilType',
-        'texture': 'soilType',
-        'soil type': 'soilType',
-        'Soil Type': 'soilType',
-        'soil': 'soilType',
-        'Soil': 'soilType',
-        'soil_classification': 'soilType',
-        'soil_class': 'soilType',
-        'SOIL_TYPE': 'soilType',
-        'SOILTYPE': 'soilType',
-        'SOIL TYPE': 'soilType',
-        
-        # Location
-        'location': 'location',
-        'site': 'location',
-        'plot': 'location',
-    }
-    
-    # Apply column mapping
-    if isinstance(data, dict):
-        mapped_data = {}
-        for col, value in data.items():
-            mapped_col = column_mapping.get(col, col)
-            mapped_data[mapped_col] = value
-        data = mapped_data
-    else:
-        # For DataFrames, rename columns
-        data = data.copy()
-        rename_dict = {col: column_mapping[col] for col in data.columns if col in column_mapping}
-        if rename_dict:
-            data = data.rename(columns=rename_dict)
-    
-    required_columns = ['nitrogen', 'phosphorus', 'potassium', 'ph', 
-                       'organic_matter', 'electricalConductivity', 'sulphur', 'zinc', 'iron', 'copper', 'manganese', 'boron', 'moisture', 'temperature', 'humidity', 'rainfall']
-    
-    # Optional columns that may be present
-    optional_columns = ['soilType']
-    
-    if isinstance(data, dict):
-        missing_columns = [col for col in required_columns if col not in data]
-        if missing_columns:
-            raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
-        df = pd.DataFrame([data])
-    else:
-        missing_columns = [col for col in required_columns if col not in data.columns]
-        if missing_columns:
-            raise ValueError(f"Missing required columns in the file: {', '.join(missing_columns)}. Found columns: {', '.join(data.columns.tolist())}")
-        
-        # Include required columns plus optional columns for model prediction
-        final_columns = required_columns.copy()
-        # Add soilType if present (now included in trained model)
-        if 'soilType' in data.columns:
-            final_columns.append('soilType')
-        df = data[final_columns].copy()
-    
-    for col in required_columns:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-    
-    # Handle soilType as categorical feature
-    # Always get the model features to ensure all soil type columns are present
-    current_model = load_model()
-    if current_model is None:
+@main.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of request timings and service counters"""
+    return Response(
+        current_app.extensions['metrics'].render(),
+        mimetype='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+def preprocess_input(data, active=None):
+    """Encode a record dict or DataFrame into a model version's feature layout"""
+    active = active or registry.get()
+    if active is None:
         raise ValueError("Model not loaded. Cannot process features.")
     
-    model_features = current_model.feature_names_in_
-    soil_type_features = [feat for feat in model_features if feat.startswith('soilType_')]
-    
-    # Preserve original soil type information before encoding
-    original_soil_types = None
-    if 'soilType' in df.columns:
-        original_soil_types = df['soilType'].copy()
-        
-        # One-hot encode soilType for model prediction
-        df = pd.get_dummies(df, columns=['soilType'], prefix='soilType')
-        
-        # Ensure all soil type columns from training are present
-        for soil_feature in soil_type_features:
-            if soil_feature not in df.columns:
-                df[soil_feature] = 0
+    return active.encoder.transform(data)
+
+def run_model(active, features):
+    """Predict with the model, via the micro-batcher for single rows when it is enabled"""
+    batcher = current_app.extensions['micro_batcher']
+    if batcher.enabled and len(features) == 1:
+        return batcher.predict(active.predictor, features, active.version)
+    return current_app.extensions['inference_engine'].predict(active.predictor, features, active.version)
+
+def predict_features(active, features):
+    """Predict model-ready features, answering repeated rows from the prediction cache.
+
+    Only cache misses are sent to the model, as one batch.
+    """
+    cache = current_app.extensions['prediction_cache']
+    add_rows(len(features))
+    with stage('predict'):
+        if not cache.enabled:
+            return run_model(active, features)
         
-        # Remove any soil type columns that weren't in training
-        soil_type_columns = [col for col in df.columns if col.startswith('soilType_')]
-        for col in soil_type_columns:
-            if col not in soil_type_features:
-                df = df.drop(columns=[col])
-    else:
-        # If no soilType column in data, add all soil type columns as 0
-        for soil_feature in soil_type_features:
-            df[soil_feature] = 0
-    
-    # Reorder columns to match training order exactly
-    df = df[model_features]
+        keys = cache.keys_for(features.to_numpy(), active.version)
+        predictions, missing = cache.get_many(keys)
+        if missing.any():
+            missed = run_model(active, features.iloc[np.flatnonzero(missing)])
+            predictions[missing] = missed
+            cache.put_many([keys[i] for i in np.flatnonzero(missing)], missed)
+        return predictions
+
+def preprocess_batch(items, active=None):
+    """Validate a list of JSON records and encode the valid ones as a single batch.
+
+    Returns (indices, processed_data, errors) where indices are the positions in
+    items that were encoded, processed_data is the model-ready DataFrame for those
+    rows (None if no row is valid) and errors lists per-row problems by index.
+    """
+    errors = []
+    rows = []
+    indices = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'error': 'Each item must be a JSON object'})
+            continue
+        # Items sharing a key set resolve once thanks to the per-header cache
+        with stage('column_mapping'):
+            resolution = resolve_columns(tuple(item))
+        if resolution.missing:
+            errors.append({'index': index, 'error': f"Missing required columns: {', '.join(resolution.missing)}"})
+            continue
+        mapped_item = {resolution.rename.get(col, col): value for col, value in item.items()}
+        rows.append(mapped_item)
+        indices.append(index)
     
-    # Store the original soil types as an attribute for later use
-    if original_soil_types is not None:
-        df.attrs['original_soil_types'] = original_soil_types
+    if not rows:
+        return [], None, errors
     
-    # Check for null values in required columns only (exclude one-hot encoded soilType columns)
-    columns_to_check = [col for col in df.columns if not col.startswith('soilType_')]
-    if isinstance(df, pd.DataFrame) and len(columns_to_check) > 0:
-        if df[columns_to_check].isnull().values.any():
-            raise ValueError("Input contains invalid or missing values")
+    with stage('encode'):
+        data = pd.DataFrame(rows)
+        
+        # Reject rows with non-numeric or missing values before encoding the batch
+        numeric = data[REQUIRED_COLUMNS].apply(pd.to_numeric, errors='coerce')
+        invalid = numeric.isnull().any(axis=1).to_numpy()
+    if invalid.any():
+        for position in np.flatnonzero(invalid):
+            errors.append({'index': indices[position], 'error': 'Input contains invalid or missing values'})
+        errors.sort(key=lambda e: e['index'])
+        indices = [index for index, bad in zip(indices, invalid) if not bad]
+        data = data.loc[~invalid].reset_index(drop=True)
+        if data.empty:
+            return [], None, errors
     
-    return df
+    return indices, preprocess_input(data, active), errors
 
 @main.route('/api/reload-model', methods=['POST'])
 def reload_model():
     """Force reload the model"""
     try:
-        load_model(force_reload=True)
-        return jsonify({'message': 'Model reloaded successfully'}), 200
+        # Requests already running keep the version they started with
+        active = registry.load()
+        if active is None:
+            return jsonify({'error': f'Failed to reload model: {registry.error}'}), 500
+        return jsonify({'message': 'Model reloaded successfully', 'model_version': active.version}), 200
     except Exception as e:
         return jsonify({'error': f'Failed to reload model: {str(e)}'}), 500
 
 @main.route('/api/predict', methods=['POST'])
 def predict():
-    current_model = load_model()
-    if current_model is None:
-        return jsonify({'error': 'Prediction model not loaded. Please train the model first.'}), 503
+    # Use one model version for the whole request, even if a swap happens meanwhile
+    active = registry.get()
+    if active is None:
+        return model_unavailable()
+    
+    shape = requested_response_shape()
+    if shape not in RESPONSE_SHAPES:
+        return jsonify({'error': f"Unsupported response shape: {shape}. Use {' or '.join(RESPONSE_SHAPES)}."}), 400
+    echo_inputs = requested_echo_inputs()
     
     try:
-        print(f"Request method: {request.method}")
-        print(f"Request files: {request.files}")
-        print(f"Request JSON: {request.is_json}")
+        # Accessing request.files parses the multipart body into upload buffers
+        with stage('parse'):
+            has_file = 'file' in request.files
+        logger.debug("Predict request: files=%s json=%s", list(request.files), request.is_json)
         
-        if 'file' in request.files:
+        if has_file:
             file = request.files['file']
             file_filename = file.filename
             if not file_filename or file_filename == '':
@@ -304,23 +322,32 @@ def predict():
             if not allowed_file(file_filename):
                 return jsonify({'error': 'File type not allowed. Allowed types: CSV, XLS, XLSX'}), 400
             
+            response_format = requested_response_format()
+            if response_format != 'json' and response_format not in STREAM_MIMETYPES:
+                return jsonify({'error': f"Unsupported response format: {response_format}. Use json, ndjson or csv."}), 400
+            
             filename = secure_filename(file_filename)
-            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            set_request_type('file_stream' if response_format in STREAM_MIMETYPES else 'file_upload')
             
             try:
-                # Debug: Print file info
-                print(f"Processing file: {filename}")
-                print(f"File path: {filepath}")
-                print(f"File exists: {os.path.exists(filepath)}")
-                print(f"File size: {os.path.getsize(filepath) if os.path.exists(filepath) else 'N/A'} bytes")
+                logger.debug("Processing file: %s", filename)
                 
                 # Read file based on extension
                 if filename.endswith('.csv'):
-                    data = pd.read_csv(filepath)
+                    # Parse straight from the upload buffer in bounded chunks so peak
+                    # memory depends on the chunk size rather than the file size; columns the
+                    # model does not use are only read when the inputs are echoed back
+                    chunks = iter_csv_chunks(file.stream, current_app.config['PREDICT_CHUNK_SIZE'],
+                                             passthrough=echo_inputs)
                 elif filename.endswith(('.xlsx', '.xls')):
                     try:
-                        data = pd.read_excel(filepath)
+                        # .xlsx rows stream from a read-only workbook in the same chunks as CSV,
+                        # read in place from the upload buffer rather than a saved copy
+                        chunks = iter_upload_chunks(
+                            file.stream, filename, current_app.config['PREDICT_CHUNK_SIZE'],
+                            sheet=requested_sheet(),
+                            header_scan_rows=current_app.config['EXCEL_HEADER_SCAN_ROWS']
+                        )
                     except ImportError as e:
                         if 'openpyxl' in str(e):
                             return jsonify({
@@ -337,131 +364,113 @@ def predict():
                                 "Please upload CSV or Excel files (.xlsx, .xls)."
                     }), 400
                 
-                print(f"Data shape: {data.shape}")
-                print(f"Data columns: {list(data.columns)}")
-                print(f"Data empty: {data.empty}")
-                
-                # Check if soilType column exists
-                if 'soilType' in data.columns:
-                    print(f"Soil type values: {data['soilType'].head().tolist()}")
-                else:
-                    print("No soilType column found in data")
-                    # Check for similar column names
-                    similar_cols = [col for col in data.columns if 'soil' in col.lower() or 'type' in col.lower()]
-                    if similar_cols:
-                        print(f"Similar columns found: {similar_cols}")
-                
-                if data.empty:
+                # Every chunk shares the header row, so its resolution is reported once
+                reader = timed_iter(chunks, 'parse')
+                first_chunk = next(reader, None)
+                if first_chunk is None:
                     return jsonify({'error': 'File is empty or could not be parsed'}), 400
+                column_mapping = resolve_columns(tuple(first_chunk.columns)).to_dict()
+                chunks = itertools.chain([first_chunk], reader)
                 
-                # Store original data with soil type
-                original_data = data.copy()
+                scored = iter_scored_chunks(active.predictor, active.encoder, chunks, current_app.extensions['inference_engine'], active.version)
+                if not echo_inputs:
+                    scored = ((result[SCORE_COLUMNS], predictions) for result, predictions in scored)
                 
-                processed_data = preprocess_input(data)
-                predictions = current_model.predict(processed_data).tolist()
+                if response_format in STREAM_MIMETYPES:
+                    # Score the first chunk up front so validation errors still return a 400
+                    first = next(scored, None)
+                    if first is None:
+                        return jsonify({'error': 'File is empty or could not be parsed'}), 400
+                    return stream_predictions(first[0], scored, response_format, filename, active.version, reader)
                 
-                # Ensure predictions are within reasonable range (0-100)
-                predictions = [max(0, min(100, float(p))) for p in predictions]
+                # Score chunk by chunk, keeping only summary statistics and the preview rows
+                summary = PredictionSummary(current_app.config['PREDICT_PREVIEW_ROWS'])
+                for result, predictions in scored:
+                    summary.update(result, predictions)
                 
-                # Create result DataFrame with original data plus predictions
-                result = original_data.copy()
-                result['productivityScore'] = predictions
-                result['productivityClass'] = ['High' if p > 70 else 'Medium' if p > 40 else 'Low' for p in predictions]
+                logger.debug("Scored %d records from %s", summary.total_records, filename)
                 
-                # Map column names back to frontend format
-                frontend_mapping = {
-                    'nitrogen': 'nitrogen',
-                    'phosphorus': 'phosphorus', 
-                    'potassium': 'potassium',
-                    'ph': 'ph',
-                    'organic_matter': 'organicCarbon',
-                    'electricalConductivity': 'electricalConductivity',
-                    'sulphur': 'sulphur',
-                    'zinc': 'zinc',
-                    'iron': 'iron',
-                    'copper': 'copper',
-                    'manganese': 'manganese',
-                    'boron': 'boron',
-                    'moisture': 'soilMoisture',
-                    'temperature': 'temperature',
-                    'humidity': 'humidity',
-                    'rainfall': 'rainfall',
-                    'soilType': 'soilType'
-                }
-                
-                # Rename columns back to frontend format
-                result = result.rename(columns={v: k for k, v in frontend_mapping.items() if k != v})
-                
-                # Convert to records, handling all data types
-                result_dict = result.head(1000).to_dict(orient='records')
-                
-                # Debug: Check if soilType is in the result
-                if result_dict and len(result_dict) > 0:
-                    print(f"First record keys: {list(result_dict[0].keys())}")
-                    if 'soilType' in result_dict[0]:
-                        print(f"First record soilType: {result_dict[0]['soilType']}")
-                    else:
-                        print("soilType not found in first record")
+                if summary.total_records == 0:
+                    return jsonify({'error': 'File is empty or could not be parsed'}), 400
                 
-                return jsonify({
-                    'message': 'File processed successfully',
-                    'data': result_dict,
-                    'total_records': len(result),
-                    'average_productivity': float(np.mean(predictions)),
-                    'min_productivity': float(np.min(predictions)),
-                    'max_productivity': float(np.max(predictions))
-                }), 200
+                with stage('serialize'):
+                    return jsonify({
+                        'message': 'File processed successfully',
+                        'data': summary.preview_columns() if shape == 'columnar' else summary.preview_records(),
+                        **summary.to_dict(),
+                        'column_mapping': column_mapping,
+                        'model_version': active.version
+                    }), 200
                 
             except ValueError as e:
                 return jsonify({'error': f'Data validation error: {str(e)}'}), 400
             except Exception as e:
                 return jsonify({'error': f'Processing error: {str(e)}', 'traceback': traceback.format_exc()}), 500
-            finally:
-                if os.path.exists(filepath):
-                    try:
-                        os.remove(filepath)
-                    except:
-                        pass
                     
         elif request.is_json:
-            json_data = request.get_json()
+            with stage('parse'):
+                json_data = request.get_json()
             
             # Handle both single object and array of objects
             if isinstance(json_data, list):
-                # Multiple predictions
+                # Multiple predictions, encoded and scored as one batch
+                set_request_type('json_batch')
                 try:
-                    results = []
-                    for item in json_data:
-                        processed_data = preprocess_input(item)
-                        prediction = current_model.predict(processed_data)[0]
-                        prediction = max(0, min(100, float(prediction)))
-                        results.append({
-                            'input': item,
-                            'productivity_score': prediction,
-                            'productivity_level': 'High' if prediction > 70 else ('Medium' if prediction > 40 else 'Low')
-                        })
+                    indices, processed_data, errors = preprocess_batch(json_data, active)
+                    if processed_data is None:
+                        return jsonify({
+                            'error': 'No valid items to predict',
+                            'errors': errors,
+                            'count': 0
+                        }), 400
                     
-                    return jsonify({
-                        'message': 'Batch prediction successful',
-                        'results': results,
-                        'count': len(results),
-                        'average_productivity': float(np.mean([r['productivity_score'] for r in results]))
-                    }), 200
+                    predictions = np.clip(predict_features(active, processed_data), 0, 100)
+                    
+                    with stage('serialize'):
+                        levels = productivity_levels(predictions).tolist()
+                        if shape == 'columnar':
+                            # One list per field; the JSON provider writes the score array as is
+                            results = {'index': indices, 'productivity_score': predictions, 'productivity_level': levels}
+                            if echo_inputs:
+                                results['input'] = [json_data[index] for index in indices]
+                        else:
+                            results = [
+                                {'index': index, 'productivity_score': prediction, 'productivity_level': level}
+                                for index, prediction, level in zip(indices, predictions.tolist(), levels)
+                            ]
+                            if echo_inputs:
+                                for result in results:
+                                    result['input'] = json_data[result['index']]
+                        
+                        return jsonify({
+                            'message': 'Batch prediction successful',
+                            'results': results,
+                            'errors': errors,
+                            'count': len(indices),
+                            'average_productivity': float(np.mean(predictions)),
+                            'model_version': active.version
+                        }), 200
                 except Exception as e:
                     return jsonify({'error': str(e)}), 400
             else:
                 # Single prediction
+                set_request_type('json_single')
                 try:
-                    processed_data = preprocess_input(json_data)
-                    prediction = current_model.predict(processed_data)[0]
+                    processed_data = preprocess_input(json_data, active)
+                    prediction = predict_features(active, processed_data)[0]
                     prediction = max(0, min(100, float(prediction)))
                     
-                    return jsonify({
-                        'message': 'Prediction successful',
-                        'input': json_data,
-                        'productivity_score': prediction,
-                        'productivity_level': 'High' if prediction > 70 else ('Medium' if prediction > 40 else 'Low')
-                    }), 200
+                    with stage('serialize'):
+                        response = {
+                            'message': 'Prediction successful',
+                            'input': json_data,
+                            'productivity_score': prediction,
+                            'productivity_level': 'High' if prediction > 70 else ('Medium' if prediction > 40 else 'Low'),
+                            'model_version': active.version
+                        }
+                        if not echo_inputs:
+                            del response['input']
+                        return jsonify(response), 200
                 except ValueError as e:
                     return jsonify({'error': f'Data validation error: {str(e)}'}), 400
                 except Exception as e:
@@ -472,6 +481,159 @@ def predict():
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}', 'traceback': traceback.format_exc()}), 500
 
+@main.route('/api/cluster', methods=['POST'])
+def cluster():
+    """Cluster soil samples with k-means++ seeded (mini-batch) k-means, in the frontend's shape"""
+    try:
+        with stage('parse'):
+            has_file = 'file' in request.files
+        
+        if has_file:
+            file = request.files['file']
+            if not file.filename:
+                return jsonify({'error': 'No selected file'}), 400
+            if not allowed_file(file.filename):
+                return jsonify({'error': 'File type not allowed. Allowed types: CSV, XLS, XLSX'}), 400
+            response_format = requested_response_format()
+            if response_format != 'json' and response_format not in STREAM_MIMETYPES:
+                return jsonify({'error': f"Unsupported response format: {response_format}. Use json, ndjson or csv."}), 400
+            filename = secure_filename(file.filename)
+            set_request_type('cluster_stream' if response_format in STREAM_MIMETYPES else 'cluster_file')
+            options = requested_cluster_options()
+            
+            # Keep only the 16 clustering features of every row, plus the preview rows
+            preview_rows = current_app.config['PREDICT_PREVIEW_ROWS']
+            features, preview, column_mapping = [], [], None
+            for chunk in timed_iter(upload_chunks(file, filename), 'parse'):
+                if chunk.empty:
+                    continue
+                if column_mapping is None:
+                    column_mapping = resolve_columns(tuple(chunk.columns)).to_dict()
+                features.append(frame_features(chunk))
+                remaining = preview_rows - sum(len(rows) for rows in preview)
+                if remaining > 0:
+                    preview.append(chunk.iloc[:remaining])
+            if not features:
+                return jsonify({'error': 'File is empty or could not be parsed'}), 400
+            
+            with stage('cluster'):
+                result = kmeans(np.concatenate(features), **options)
+            
+            if response_format in STREAM_MIMETYPES:
+                return stream_clusters(result, file, filename, response_format)
+            
+            with stage('serialize'):
+                preview_records = frame_records(pd.concat(preview, ignore_index=True))
+                response = labeled_response(result, preview_records)
+                return jsonify({
+                    'message': 'File clustered successfully',
+                    **response,
+                    'assignments': result.labels,
+                    **result_info(result),
+                    'column_mapping': column_mapping
+                }), 200
+        
+        if request.is_json:
+            set_request_type('cluster_json')
+            with stage('parse'):
+                body = request.get_json()
+            samples = body.get('samples') if isinstance(body, dict) else body
+            if not isinstance(samples, list):
+                return jsonify({'error': 'Send a JSON array of samples, or an object with a "samples" array.'}), 400
+            if not samples:
+                return jsonify({'clusters': [], 'labeledData': []}), 200
+            # Every sample is echoed back with its label, so one bad item rejects the request
+            errors = [
+                {'index': index, 'error': 'Each item must be a JSON object'}
+                for index, sample in enumerate(samples)
+                if not isinstance(sample, dict)
+            ]
+            if errors:
+                return jsonify({'error': 'Every sample must be a JSON object', 'errors': errors}), 400
+            options = requested_cluster_options(body)
+            
+            with stage('cluster'):
+                result = kmeans(record_features(samples), **options)
+            
+            with stage('serialize'):
+                if parse_flag(request.args.get('include_samples')):
+                    response = labeled_response(result, samples)
+                else:
+                    response = {'clusters': cluster_summaries(result), 'assignments': result.labels}
+                return jsonify({**response, **result_info(result)}), 200
+        
+        return jsonify({'error': 'No valid input provided. Send JSON data or upload a file.'}), 400
+    
+    except HTTPException:
+        # e.g. 413 for bodies over MAX_UPLOAD_MB
+        raise
+    except ValueError as e:
+        return jsonify({'error': f'Data validation error: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': f'Clustering error: {str(e)}', 'traceback': traceback.format_exc()}), 500
+
+@main.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queue a file upload for background scoring and return its job id"""
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided. Upload a CSV or Excel file as "file".'}), 400
+    
+    file = request.files['file']
+    file_filename = file.filename
+    if not file_filename:
+        return jsonify({'error': 'No selected file'}), 400
+    if not allowed_file(file_filename):
+        return jsonify({'error': 'File type not allowed. Allowed types: CSV, XLS, XLSX'}), 400
+    if not os.path.exists(MODEL_PATH):
+        return jsonify({'error': 'Prediction model not found. Please train the model first.'}), 503
+    
+    try:
+        job_id = current_app.extensions['prediction_jobs'].submit(
+            file, secure_filename(file_filename), MODEL_PATH, sheet=requested_sheet()
+        )
+        return jsonify({
+            'message': 'Prediction job submitted',
+            'job_id': job_id,
+            'status_url': f'/api/jobs/{job_id}',
+            'result_url': f'/api/jobs/{job_id}/result'
+        }), 202
+    except Exception as e:
+        return jsonify({'error': f'Failed to submit job: {str(e)}'}), 500
+
+@main.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Report a job's state and the rows processed so far"""
+    try:
+        status = current_app.extensions['prediction_jobs'].status(job_id)
+    except KeyError:
+        return jsonify({'error': f'Job not found: {job_id}'}), 404
+    status.pop('traceback', None)
+    return jsonify(status), 200
+
+@main.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Download the scored CSV of a completed job"""
+    jobs = current_app.extensions['prediction_jobs']
+    try:
+        status = jobs.status(job_id)
+    except KeyError:
+        return jsonify({'error': f'Job not found: {job_id}'}), 404
+    
+    if status['status'] != 'completed':
+        return jsonify({'error': f"Job is {status['status']}", 'status': status['status'], 'error_detail': status.get('error')}), 409
+    
+    download_name = f"{status['filename'].rsplit('.', 1)[0]}_predictions.csv"
+    return send_file(jobs.result_path(job_id), mimetype='text/csv', as_attachment=True, download_name=download_name)
+
+@main.route('/api/jobs/<job_id>', methods=['DELETE'])
+def delete_job(job_id):
+    """Remove a job's stored input and result"""
+    try:
+        current_app.extensions['prediction_jobs'].delete(job_id)
+    except KeyError:
+        return jsonify({'error': f'Job not found: {job_id}'}), 404
+    return jsonify({'message': 'Job deleted', 'job_id': job_id}), 200
+
 @main.route('/api/soil-types', methods=['GET'])
 def get_soil_types():
     soil_types = ["Loam", "Clay", "Sandy", "Silt", "Peat", "Chalk", "Gravel", "Sand", "Clay Loam", "Sandy Loam", "Silty Clay", "Sandy Clay", "Loamy Sand", "Silt Loam", "Peat Loam", "Chalky Loam", "Gravelly Loam", "Silty Loam", "Clay Sand", "Humus", "Compost", "Topsoil", "Subsoil", "Black Soil", "Red Soil", "Yellow Soil", "Alluvial Soil", "Laterite Soil", "Saline Soil", "Acidic Soil", "Alkaline Soil"]
@@ -482,7 +644,7 @@ def model_info():
     """Get information about the loaded model"""
     current_model = load_model()
     if current_model is None:
-        return jsonify({'error': 'Model not loaded'}), 503
+        return model_unavailable()
     
     try:
         model_type = type(current_model).__name__
@@ -494,27 +656,47 @@ def model_info():
         return jsonify({
             'model_type': model_type,
             'n_estimators': n_estimators,
+            'model_version': registry.version,
+            'compaction_profile': compaction_info(current_model)['profile'],
             'model_path': MODEL_PATH,
-            'model_exists': os.path.exists(MODEL_PATH)
+            'model_exists': os.path.exists(MODEL_PATH),
+            'mmap_mode': MODEL_MMAP_MODE,
+            'loading': registry.info(),
+            'inference': current_app.extensions['inference_engine'].info(),
+            'cache': current_app.extensions['prediction_cache'].stats(),
+            'micro_batching': current_app.extensions['micro_batcher'].info(),
+            'header_cache': resolve_columns.cache_info()._asdict(),
+            'uploads': current_app.extensions['upload_spool'].stats(),
+            # Per-worker memory; compare pss_bytes across gunicorn workers to see shared pages
+            'memory': process_memory()
         }), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @main.route('/api/model/retrain', methods=['POST'])
 def retrain_model():
-    """Retrain model (admin endpoint)"""
+    """Retrain model in the background (admin endpoint)"""
     try:
-        import sys
-        sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-        from train_model import train_soil_model
-        
-        train_soil_model()
-        global model
-        model = joblib.load(MODEL_PATH)
+        if not registry.start_retrain():
+            return jsonify({
+                'error': 'A retrain is already running',
+                'retrain': registry.retrain_status
+            }), 409
         
+        # Predictions keep using the active version until the new one is loaded
         return jsonify({
-            'message': 'Model retrained successfully',
-            'model_path': MODEL_PATH
-        }), 200
+            'message': 'Model retraining started',
+            'model_path': MODEL_PATH,
+            'active_version': registry.version,
+            'status_url': '/api/model/retrain'
+        }), 202
     except Exception as e:
         return jsonify({'error': str(e), 'traceback': traceback.format_exc()}), 500
+
+@main.route('/api/model/retrain', methods=['GET'])
+def retrain_status():
+    """Report the state of the latest background retrain"""
+    return jsonify({
+        'retrain': registry.retrain_status,
+        'active_version': registry.version
+    }), 200
@@ -0,0 +1,470 @@
+"""
+Chunked scoring helpers for file uploads
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from .features import REQUIRED_COLUMNS, SOIL_TYPE_COLUMN, resolve_columns, resolve_target
+from .metrics import add_rows, stage
+from .serialization import frame_columns, frame_records, ndjson_text
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+    pa_csv = None
+
+# Map column names back to frontend format
+FRONTEND_MAPPING = {
+    'nitrogen': 'nitrogen',
+    'phosphorus': 'phosphorus',
+    'potassium': 'potassium',
+    'ph': 'ph',
+    'organic_matter': 'organicCarbon',
+    'electricalConductivity': 'electricalConductivity',
+    'sulphur': 'sulphur',
+    'zinc': 'zinc',
+    'iron': 'iron',
+    'copper': 'copper',
+    'manganese': 'manganese',
+    'boron': 'boron',
+    'moisture': 'soilMoisture',
+    'temperature': 'temperature',
+    'humidity': 'humidity',
+    'rainfall': 'rainfall',
+    'soilType': 'soilType'
+}
+RESULT_RENAME = {v: k for k, v in FRONTEND_MAPPING.items() if k != v}
+
+DEFAULT_CHUNK_SIZE = 50000
+DEFAULT_PREVIEW_ROWS = 1000
+# Rows at the top of a worksheet searched for the header row
+DEFAULT_HEADER_SCAN_ROWS = 20
+
+# Columns added by score_frame; the rest of a result echoes the uploaded data
+SCORE_COLUMNS = ['productivityScore', 'productivityClass']
+
+# Streamed response formats for file predictions
+STREAM_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+
+def productivity_levels(predictions):
+    """Vectorized High/Medium/Low classification of productivity scores"""
+    return np.where(predictions > 70, 'High', np.where(predictions > 40, 'Medium', 'Low'))
+
+
+def csv_read_plan(columns, keep_target=False, passthrough=True):
+    """Return (usecols, dtype) reading only the needed columns of a CSV header.
+
+    Required features are parsed straight to float64, so encoding does not
+    have to coerce object columns, and soil type becomes a categorical.
+    keep_target also reads the productivity/yield column of training data as
+    float64. With passthrough, the other columns (sample IDs, notes,
+    duplicates of a feature) are read as object and echoed back unchanged;
+    training reads (keep_target) never need them. usecols keeps the header's
+    order. Returns None if required columns are missing, leaving the error
+    to the encoder.
+    """
+    resolution = resolve_columns(tuple(columns))
+    if resolution.missing:
+        return None
+    dtype = {}
+    for column, feature, _ in resolution.mapped:
+        if feature in REQUIRED_COLUMNS:
+            dtype[column] = np.float64
+        elif feature == SOIL_TYPE_COLUMN:
+            dtype[column] = 'category'
+        else:
+            dtype[column] = object
+    target = resolve_target(columns) if keep_target else None
+    if target is not None and target not in dtype:
+        dtype[target] = np.float64
+    if passthrough and not keep_target:
+        for column in itertools.chain(resolution.unmapped, (column for column, _ in resolution.duplicates)):
+            dtype[column] = object
+    usecols = [column for column in columns if column in dtype]
+    return usecols, dtype
+
+
+def _read_csv_header(source):
+    """Read the header row, rewinding file objects so parsing starts again at the top"""
+    if isinstance(source, str):
+        return list(pd.read_csv(source, nrows=0).columns)
+    if not (hasattr(source, 'seekable') and source.seekable()):
+        return None
+    position = source.tell()
+    columns = list(pd.read_csv(source, nrows=0).columns)
+    source.seek(position)
+    return columns
+
+
+def _parse_numeric(column):
+    """float64 values of a column, or the column unchanged if a cell is not a number"""
+    try:
+        return pd.to_numeric(column)
+    except (TypeError, ValueError):
+        return column
+
+
+def _untyped(dtype):
+    """dtype without the float64 columns, which are then inferred and may stay object"""
+    return {column: kind for column, kind in dtype.items() if kind is not np.float64}
+
+
+class _CsvSource:
+    """Re-readable CSV path or seekable file object, parsed from any data row onwards"""
+
+    def __init__(self, source, columns, usecols):
+        self.source = source
+        self.start = None if isinstance(source, str) else source.tell()
+        self.columns = columns
+        self.usecols = usecols
+
+    def rewind(self):
+        if self.start is not None:
+            self.source.seek(self.start)
+        return self.source
+
+    def pandas_chunks(self, skip, dtype, chunk_size):
+        """Chunks after the first skip data rows, by the pandas C parser"""
+        with pd.read_csv(self.rewind(), chunksize=chunk_size, skiprows=skip + 1, header=None, names=self.columns,
+                         usecols=self.usecols, dtype=dtype) as reader:
+            yield from reader
+
+    def arrow_chunks(self, skip, dtype, chunk_size):
+        """Chunks after the first skip data rows, by pyarrow's multithreaded streaming reader.
+
+        Blocks are decoded on pyarrow's thread pool while memory stays bounded
+        by roughly chunk_size rows.
+        """
+        column_types = {
+            column: pa.float64() if kind is np.float64
+            else pa.dictionary(pa.int32(), pa.string()) if kind == 'category'
+            else pa.string()
+            for column, kind in dtype.items()
+        }
+        reader = pa_csv.open_csv(
+            self.rewind(),
+            read_options=pa_csv.ReadOptions(use_threads=True, skip_rows=skip + 1, column_names=self.columns),
+            convert_options=pa_csv.ConvertOptions(include_columns=self.usecols, column_types=column_types,
+                                                   strings_can_be_null=True)
+        )
+        batches = []
+        rows = 0
+        for batch in reader:
+            batches.append(batch)
+            rows += batch.num_rows
+            if rows >= chunk_size:
+                yield pa.Table.from_batches(batches).to_pandas()
+                batches = []
+                rows = 0
+        if batches:
+            yield pa.Table.from_batches(batches).to_pandas()
+
+
+def _iter_typed_chunks(csv_source, dtype, chunk_size):
+    """Yield typed chunks, re-reading only a chunk with a non-numeric feature cell without float64.
+
+    A float64 column cannot hold a cell such as "<0.1", and neither parser
+    can carry on after one, so the rows from the last chunk yielded onwards
+    are parsed again: chunk_size of them with inferred feature dtypes
+    (leaving the encoder or training to reject the bad rows), then the
+    typed reader resumes after them.
+    """
+    read = csv_source.arrow_chunks if pa_csv is not None else csv_source.pandas_chunks
+    rows = 0
+    while True:
+        chunks = read(rows, dtype, chunk_size)
+        try:
+            while True:
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                except ValueError:
+                    # pyarrow's ArrowInvalid is a ValueError too
+                    break
+                if chunk.empty:
+                    # pandas reads no rows rather than none at all when resuming at the end
+                    return
+                rows += len(chunk)
+                yield chunk
+        finally:
+            chunks.close()
+
+        chunk = next(csv_source.pandas_chunks(rows, _untyped(dtype), chunk_size), None)
+        if chunk is None or chunk.empty:
+            return
+        rows += len(chunk)
+        yield chunk
+
+
+def iter_csv_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE, typed=True, keep_target=False, passthrough=True):
+    """Yield DataFrames of at most chunk_size rows from a CSV path or file object.
+
+    With typed=True the header is resolved first and only the columns of
+    csv_read_plan are read, with explicit dtypes. pyarrow's multithreaded
+    reader is used when it is installed. Headers missing required columns,
+    and non-seekable streams, are read untyped.
+    """
+    plan = None
+    if typed:
+        columns = _read_csv_header(source)
+        plan = csv_read_plan(columns, keep_target, passthrough) if columns is not None else None
+    
+    if plan is None:
+        with pd.read_csv(source, chunksize=chunk_size) as reader:
+            for chunk in reader:
+                yield chunk
+        return
+    
+    usecols, dtype = plan
+    yield from _iter_typed_chunks(_CsvSource(source, columns, usecols), dtype, chunk_size)
+
+
+def _select_sheet(workbook, sheet):
+    if sheet is None or sheet == '':
+        return workbook.worksheets[0]
+    if sheet in workbook.sheetnames:
+        return workbook[sheet]
+    if str(sheet).isdigit() and int(sheet) < len(workbook.worksheets):
+        return workbook.worksheets[int(sheet)]
+    raise ValueError(f"Worksheet '{sheet}' not found. Available sheets: {', '.join(workbook.sheetnames)}")
+
+
+def _header_names(row):
+    # Name blank and repeated headers the way pd.read_excel does
+    names = []
+    seen = {}
+    for i, value in enumerate(row):
+        name = f'Unnamed: {i}' if value is None else str(value).strip()
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def find_header_row(rows):
+    """Pick the header among the first worksheet rows.
+
+    The first row that resolves every required column wins. Otherwise the row
+    resolving the most features, then the first non-empty row (so the encoder
+    reports what is missing). Returns its index in rows, or None if all are empty.
+    """
+    best = None
+    best_mapped = 0
+    for index, row in enumerate(rows):
+        if all(value is None for value in row):
+            continue
+        resolution = resolve_columns(tuple(_header_names(row)))
+        if not resolution.missing:
+            return index
+        if best is None or len(resolution.mapped) > best_mapped:
+            best, best_mapped = index, len(resolution.mapped)
+    return best
+
+
+def _excel_frame(rows, names, positions, dtypes):
+    data = {}
+    for name, position in zip(names, positions):
+        values = pd.Series([row[position] if position < len(row) else None for row in rows], dtype=object)
+        kind = dtypes.get(name)
+        if kind == 'category':
+            data[name] = values.astype('category')
+        elif kind is object:
+            data[name] = values
+        else:
+            data[name] = _parse_numeric(values)
+    return pd.DataFrame(data)
+
+
+def _iter_sheet_chunks(workbook, worksheet, chunk_size, header_scan_rows, keep_target=False):
+    try:
+        # Files from some writers carry wrong dimensions; read until the sheet really ends
+        worksheet.reset_dimensions()
+        rows = worksheet.iter_rows(values_only=True)
+        scanned = [row for _, row in zip(range(header_scan_rows), rows)]
+        header_index = find_header_row(scanned)
+        if header_index is None:
+            return
+        
+        header = _header_names(scanned[header_index])
+        plan = csv_read_plan(header, keep_target)
+        usecols, dtypes = plan if plan is not None else (None, {})
+        names = usecols if usecols is not None else header
+        positions = [header.index(name) for name in names]
+        
+        # Rows scanned after the header are data; the rest streams from the sheet
+        chunk = []
+        for row in itertools.chain(scanned[header_index + 1:], rows):
+            if all(value is None for value in row):
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield _excel_frame(chunk, names, positions, dtypes)
+                chunk = []
+        if chunk:
+            yield _excel_frame(chunk, names, positions, dtypes)
+    finally:
+        workbook.close()
+
+
+def iter_excel_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE, sheet=None, header_scan_rows=DEFAULT_HEADER_SCAN_ROWS,
+                      keep_target=False):
+    """Stream an .xlsx worksheet as DataFrames of at most chunk_size rows.
+
+    The workbook is opened read-only, so rows are parsed as they are iterated
+    instead of materializing the whole sheet. sheet is a name or 0-based
+    index (default: the first sheet). The header row is the best match among
+    the first header_scan_rows rows, and columns are typed as for CSV.
+    openpyxl is imported here, so a missing dependency raises ImportError
+    before iteration starts.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        worksheet = _select_sheet(workbook, sheet)
+    except Exception:
+        workbook.close()
+        raise
+    return _iter_sheet_chunks(workbook, worksheet, chunk_size, header_scan_rows, keep_target)
+
+
+def iter_parquet_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE, keep_target=False):
+    """Yield DataFrames of at most chunk_size rows from a Parquet file's row groups.
+
+    With keep_target only the resolved columns and the target are decoded.
+    Requires pyarrow.
+    """
+    if pa is None:
+        raise ImportError("Reading Parquet files requires pyarrow. Install it with: pip install pyarrow")
+    import pyarrow.parquet as pa_parquet
+
+    parquet_file = pa_parquet.ParquetFile(source)
+    plan = csv_read_plan(parquet_file.schema_arrow.names, keep_target)
+    columns = plan[0] if plan is not None else None
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+        yield batch.to_pandas()
+
+
+def iter_upload_chunks(source, filename, chunk_size=DEFAULT_CHUNK_SIZE, sheet=None,
+                       header_scan_rows=DEFAULT_HEADER_SCAN_ROWS, keep_target=False):
+    """Chunk a CSV, .xlsx, .parquet or legacy .xls file by extension"""
+    if filename.endswith('.csv'):
+        return iter_csv_chunks(source, chunk_size, keep_target=keep_target)
+    if filename.endswith('.xlsx'):
+        return iter_excel_chunks(source, chunk_size, sheet, header_scan_rows, keep_target)
+    if filename.endswith('.parquet'):
+        return iter_parquet_chunks(source, chunk_size, keep_target)
+    # openpyxl cannot read the legacy format; pandas reads it whole via xlrd
+    return [pd.read_excel(source, sheet_name=int(sheet) if str(sheet).isdigit() else (sheet or 0))]
+
+
+def score_frame(model, encoder, data, engine=None, version=None):
+    """Predict one chunk and return (result, predictions).
+
+    result is the uploaded data plus productivityScore/productivityClass
+    columns, with column names mapped back to frontend format. An
+    InferenceEngine, if given, decides whether the chunk is predicted in
+    parallel.
+    """
+    processed_data = encoder.transform(data)
+    with stage('predict'):
+        raw_predictions = engine.predict(model, processed_data, version) if engine is not None else model.predict(processed_data)
+    add_rows(len(raw_predictions))
+
+    # Ensure predictions are within reasonable range (0-100)
+    predictions = np.clip(raw_predictions, 0, 100)
+
+    result = data.assign(
+        productivityScore=predictions,
+        productivityClass=productivity_levels(predictions)
+    )
+    return result.rename(columns=RESULT_RENAME), predictions
+
+
+def iter_scored_chunks(model, encoder, chunks, engine=None, version=None):
+    """Score non-empty chunks lazily, yielding (result, predictions) pairs"""
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        yield score_frame(model, encoder, chunk, engine, version)
+
+
+def iter_ndjson(results):
+    """Serialize scored chunks as newline-delimited JSON, one record per line"""
+    for result in results:
+        yield ndjson_text(result)
+
+
+def iter_csv(results):
+    """Serialize scored chunks as CSV with a single header row"""
+    header = True
+    for result in results:
+        yield result.to_csv(index=False, header=header)
+        header = False
+
+
+def format_stream(results, fmt):
+    """Return the text generator for a STREAM_MIMETYPES format"""
+    if fmt == 'ndjson':
+        return iter_ndjson(results)
+    if fmt == 'csv':
+        return iter_csv(results)
+    raise ValueError(f"Unsupported stream format: {fmt}")
+
+
+class PredictionSummary:
+    """Accumulates summary statistics and a bounded preview across scored chunks"""
+
+    def __init__(self, preview_rows=DEFAULT_PREVIEW_ROWS):
+        self.preview_rows = preview_rows
+        self.preview = []
+        self.preview_count = 0
+        self.total_records = 0
+        self.total_productivity = 0.0
+        self.min_productivity = float('inf')
+        self.max_productivity = float('-inf')
+
+    def update(self, result, predictions):
+        if len(predictions) == 0:
+            return
+        self.total_records += len(predictions)
+        self.total_productivity += float(np.sum(predictions))
+        self.min_productivity = min(self.min_productivity, float(np.min(predictions)))
+        self.max_productivity = max(self.max_productivity, float(np.max(predictions)))
+
+        remaining = self.preview_rows - self.preview_count
+        if remaining > 0:
+            head = result.iloc[:remaining]
+            self.preview.append(head)
+            self.preview_count += len(head)
+
+    def preview_frame(self):
+        if not self.preview:
+            return pd.DataFrame()
+        return pd.concat(self.preview, ignore_index=True)
+
+    def preview_records(self):
+        return frame_records(self.preview_frame())
+
+    def preview_columns(self):
+        return frame_columns(self.preview_frame())
+
+    def to_dict(self):
+        return {
+            'total_records': self.total_records,
+            'average_productivity': self.total_productivity / self.total_records if self.total_records else None,
+            'min_productivity': self.min_productivity if self.total_records else None,
+            'max_productivity': self.max_productivity if self.total_records else None
+        }
@@ -0,0 +1,103 @@
+"""
+JSON encoding for API responses
+
+The app's JSON provider encodes with orjson when it is installed. orjson
+writes NumPy arrays and scalars natively, so prediction results are passed
+as columns (arrays) rather than converted to Python objects field by field,
+and request bodies are parsed by orjson too. Without orjson the standard
+library encoder is used and arrays are converted with tolist().
+
+NaN values are written as null by orjson, whereas the standard library
+writes the non-standard NaN token.
+"""
+import json
+
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Response shapes for lists of results: a list of row objects, or one list per field
+RESPONSE_SHAPES = ('records', 'columnar')
+
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+
+
+def _default(obj):
+    """Convert objects neither encoder handles natively"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return DefaultJSONProvider.default(obj)
+
+
+class ResponseJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson if available; used by jsonify and request.get_json"""
+
+    default = staticmethod(_default)
+
+    def _options(self, indent=False):
+        options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._options(kwargs.get('indent'))).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default, option=self._options(indent)) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def parse_flag(value, default=True):
+    """Read a boolean query parameter such as ?echo_inputs=0"""
+    if value is None or value == '':
+        return default
+    return value.lower() not in FALSE_VALUES
+
+
+def frame_columns(frame):
+    """Map each column to an array (numeric) or list (other dtypes) for columnar output"""
+    columns = {}
+    for name in frame.columns:
+        column = frame[name]
+        if column.dtype.kind in 'biuf':
+            columns[name] = column.to_numpy()
+        else:
+            columns[name] = column.astype(object).where(column.notna(), None).tolist()
+    return columns
+
+
+def frame_records(frame):
+    """Row objects for a DataFrame, built from whole columns rather than row by row"""
+    columns = frame_columns(frame)
+    names = list(columns)
+    values = [column.tolist() if isinstance(column, np.ndarray) else column for column in columns.values()]
+    return [dict(zip(names, row)) for row in zip(*values)]
+
+
+def ndjson_text(frame):
+    """A DataFrame's rows as newline-delimited JSON, with floats at full precision like the JSON responses"""
+    records = frame_records(frame)
+    if orjson is None:
+        return ''.join(json.dumps(record, default=_default) + '\n' for record in records)
+    options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+    return b''.join(orjson.dumps(record, default=_default, option=options) for record in records).decode()
@@ -0,0 +1,76 @@
+"""
+Upload buffering for multipart file uploads
+
+Uploaded files are parsed straight from the request body into a spooled
+buffer: files up to UPLOAD_MAX_MEMORY_MB stay in memory and larger ones roll
+over to an anonymous temporary file, which has no name to collide on and is
+removed by the OS when it is closed. Routes read the buffer in place rather
+than saving it under UPLOAD_FOLDER and reading it back.
+"""
+import os
+import threading
+from tempfile import SpooledTemporaryFile
+
+from flask import Request, current_app
+
+DEFAULT_MAX_MEMORY_SIZE = 16 * 1024 * 1024
+
+
+class UploadSpoolStats:
+    """Thread-safe counters of uploads kept in memory versus spooled to disk"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.files = 0
+        self.spooled_files = 0
+        self.memory_bytes = 0
+        self.spooled_bytes = 0
+
+    def record(self, size, spooled):
+        with self._lock:
+            self.files += 1
+            if spooled:
+                self.spooled_files += 1
+                self.spooled_bytes += size
+            else:
+                self.memory_bytes += size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': self.files,
+                'in_memory_files': self.files - self.spooled_files,
+                'spooled_files': self.spooled_files,
+                'in_memory_bytes': self.memory_bytes,
+                'spooled_bytes': self.spooled_bytes
+            }
+
+
+class UploadSpool(SpooledTemporaryFile):
+    """SpooledTemporaryFile that reports its size and whether it hit disk when closed"""
+
+    def __init__(self, max_size, stats=None, dir=None):
+        super().__init__(max_size=max_size, mode='w+b', dir=dir)
+        self._stats = stats
+
+    @property
+    def spooled(self):
+        return self._rolled
+
+    def close(self):
+        if self._stats is not None and not self.closed:
+            self._stats.record(self.seek(0, os.SEEK_END), self._rolled)
+            self._stats = None
+        super().close()
+
+
+class UploadRequest(Request):
+    """Request whose file parts are buffered in an UploadSpool sized by app config"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        config = current_app.config
+        return UploadSpool(
+            config.get('UPLOAD_MAX_MEMORY_SIZE', DEFAULT_MAX_MEMORY_SIZE),
+            stats=current_app.extensions.get('upload_spool'),
+            dir=config.get('UPLOAD_SPOOL_DIR')
+        )
@@ -0,0 +1,31 @@
+"""
+ASGI entry point for the Flask application
+
+Usage: uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Request bodies are received asynchronously and each request then runs on a
+thread pool of ASGI_THREADS threads (see app/asgi_adapter.py), so slow
+uploads do not hold a worker. The /api/* routes and responses are the same
+as under wsgi.py or gunicorn.
+"""
+import sys
+import os
+
+# Add the backend directory to the Python path
+backend_dir = os.path.dirname(os.path.abspath(__file__))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+from app import create_app
+from app.asgi_adapter import ASGIAdapter
+
+flask_app = create_app()
+app = ASGIAdapter(flask_app, threads=int(os.environ.get('ASGI_THREADS', 32)))
+
+if __name__ == "__main__":
+    try:
+        import uvicorn
+    except ImportError:
+        print("ERROR: uvicorn is not installed. Install it with: pip install uvicorn")
+        sys.exit(1)
+    uvicorn.run(app, host=os.environ.get('ASGI_HOST', '0.0.0.0'), port=int(os.environ.get('ASGI_PORT', 5000)))
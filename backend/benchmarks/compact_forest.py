@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark CompactForest against sklearn's RandomForestRegressor.predict
+
+Usage: python benchmarks/compact_forest.py [--rows 1 10 100 1000 2000 10000] [--check-rows 100000]
+Times both predictors on encoded random samples per batch size and checks
+that the compact forest's predictions equal sklearn's exactly. Requires a
+trained model at models/soil_model.pkl (run: python train_model.py).
+"""
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+
+# Add the backend directory to the Python path
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+from app.features import FeatureEncoder
+from app.forest import CompactForest
+from train_model import generate_soil_data
+
+MODEL_PATH = os.path.join(backend_dir, 'models', 'soil_model.pkl')
+
+
+def best_of(predict, features, min_seconds=0.5):
+    """Fastest single call in seconds, repeating for at least min_seconds"""
+    best = float('inf')
+    deadline = time.perf_counter() + min_seconds
+    while True:
+        start = time.perf_counter()
+        predict(features)
+        best = min(best, time.perf_counter() - start)
+        if time.perf_counter() > deadline:
+            return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1, 10, 100, 1000, 2000, 10000], help='batch sizes to time')
+    parser.add_argument('--check-rows', type=int, default=100000, help='rows compared against sklearn')
+    args = parser.parse_args()
+
+    if not os.path.exists(MODEL_PATH):
+        print(f"Model not found at {MODEL_PATH}. Run: python train_model.py")
+        return 1
+
+    model = joblib.load(MODEL_PATH)
+    encoder = FeatureEncoder.from_model(model)
+    start = time.perf_counter()
+    forest = CompactForest(model, max_rows=max(args.rows + [args.check_rows]))
+    print(f"compiled {forest.n_trees} trees, {forest.n_nodes} nodes, {forest.nbytes / 1e6:.1f} MB "
+          f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    features = encoder.transform(generate_soil_data(args.check_rows, np.random.RandomState(0)))
+    expected = model.predict(features)
+    actual = forest.predict(features)
+    print(f"{args.check_rows} rows: exact match {np.array_equal(expected, actual)}, "
+          f"max abs difference {np.max(np.abs(expected - actual)):.3g}")
+
+    print(f"{'rows':>8} {'sklearn ms':>11} {'compact ms':>11} {'speed-up':>9}")
+    for rows in args.rows:
+        batch = features.iloc[:rows]
+        sklearn_seconds = best_of(model.predict, batch)
+        compact_seconds = best_of(forest.predict, batch)
+        print(f"{rows:>8} {sklearn_seconds * 1000:>11.3f} {compact_seconds * 1000:>11.3f} "
+              f"{sklearn_seconds / compact_seconds:>8.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark the typed CSV upload reader against untyped pd.read_csv chunks
+
+Usage: python benchmarks/csv_reader.py [--rows 500000] [--chunk-size 50000] [--no-pyarrow]
+Times reading and encoding a generated CSV the way /api/predict does, without
+needing a trained model.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+# Add the backend directory to the Python path
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+from app import scoring
+from app.features import REQUIRED_COLUMNS, SOIL_TYPE_PREFIX, FeatureEncoder
+from app.scoring import iter_csv_chunks
+
+SOIL_TYPES = ['Alluvial', 'Black', 'Clay', 'Laterite', 'Loamy', 'Red', 'Sandy']
+
+
+def write_csv(path, n_rows, seed=0):
+    """Write n_rows of random samples with lab-style headers and an extra notes column"""
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({col: rng.uniform(0, 100, n_rows).round(2) for col in REQUIRED_COLUMNS})
+    data = data.rename(columns={'nitrogen': 'Nitrogen (kg/ha)', 'moisture': 'Moisture %'})
+    data['Soil Type'] = rng.choice(SOIL_TYPES, n_rows)
+    data['notes'] = 'sampled'
+    data.to_csv(path, index=False)
+
+
+def time_reader(path, encoder, chunk_size, typed, repeat):
+    """Return (best seconds, rows, largest parsed chunk in bytes)"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = 0
+        for chunk in iter_csv_chunks(path, chunk_size, typed=typed):
+            rows += len(encoder.transform(chunk))
+        timings.append(time.perf_counter() - start)
+    chunk_bytes = max(
+        chunk.memory_usage(deep=True).sum() for chunk in iter_csv_chunks(path, chunk_size, typed=typed)
+    )
+    return min(timings), rows, chunk_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500000, help='rows in the generated CSV')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='rows per chunk')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per reader')
+    parser.add_argument('--no-pyarrow', action='store_true', help='use the pandas parser even if pyarrow is installed')
+    args = parser.parse_args()
+    if args.no_pyarrow:
+        scoring.pa_csv = None
+
+    encoder = FeatureEncoder(REQUIRED_COLUMNS + [SOIL_TYPE_PREFIX + name for name in SOIL_TYPES])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'samples.csv')
+        write_csv(path, args.rows)
+        size_mb = os.path.getsize(path) / 1e6
+
+        print(f"{args.rows} rows, {size_mb:.1f} MB, chunks of {args.chunk_size}, "
+              f"pyarrow {'used' if scoring.pa_csv is not None else 'not used'}")
+        print(f"{'reader':>8} {'seconds':>9} {'rows/sec':>12} {'speedup':>8} {'MB/chunk':>9}")
+        baseline = None
+        for name, typed in (('untyped', False), ('typed', True)):
+            seconds, rows, chunk_bytes = time_reader(path, encoder, args.chunk_size, typed, args.repeat)
+            baseline = baseline or seconds
+            print(f"{name:>8} {seconds:>9.3f} {rows / seconds:>12,.0f} {baseline / seconds:>7.2f}x "
+                  f"{chunk_bytes / 1e6:>9.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
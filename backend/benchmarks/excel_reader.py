@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark streamed .xlsx ingestion against pd.read_excel by sheet size
+
+Usage: python benchmarks/excel_reader.py [--rows 10000 50000 100000] [--chunk-size 50000]
+Reports wall time and peak Python heap (tracemalloc) of reading a generated
+worksheet whole versus in read-only chunks, without needing a trained model.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# Add the backend directory to the Python path
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+from app.features import REQUIRED_COLUMNS
+from app.scoring import iter_excel_chunks
+
+SOIL_TYPES = ['Alluvial', 'Black', 'Clay', 'Laterite', 'Loamy', 'Red', 'Sandy']
+
+
+def write_xlsx(path, n_rows, seed=0):
+    """Write n_rows of random samples to a single-sheet workbook"""
+    from openpyxl import Workbook
+
+    rng = np.random.default_rng(seed)
+    values = rng.uniform(0, 100, (n_rows, len(REQUIRED_COLUMNS))).round(2).tolist()
+    soil_types = rng.choice(SOIL_TYPES, n_rows).tolist()
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Samples')
+    worksheet.append(REQUIRED_COLUMNS + ['soilType'])
+    for row, soil_type in zip(values, soil_types):
+        worksheet.append(row + [soil_type])
+    workbook.save(path)
+
+
+def read_whole(path, chunk_size):
+    return len(pd.read_excel(path))
+
+
+def read_streamed(path, chunk_size):
+    return sum(len(chunk) for chunk in iter_excel_chunks(path, chunk_size))
+
+
+def measure(reader, path, chunk_size):
+    """Return (seconds, peak traced bytes, rows); tracing slows reads, so time a separate run"""
+    start = time.perf_counter()
+    rows = reader(path, chunk_size)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    reader(path, chunk_size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 50000, 100000], help='sheet sizes to compare')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='rows per streamed chunk')
+    args = parser.parse_args()
+
+    print(f"chunks of {args.chunk_size} rows")
+    print(f"{'rows':>8} {'reader':>9} {'seconds':>9} {'peak MB':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_rows in args.rows:
+            path = os.path.join(tmp, f'samples_{n_rows}.xlsx')
+            write_xlsx(path, n_rows)
+            for name, reader in (('whole', read_whole), ('streamed', read_streamed)):
+                seconds, peak, rows = measure(reader, path, args.chunk_size)
+                assert rows == n_rows, f"{name} read {rows} of {n_rows} rows"
+                print(f"{n_rows:>8} {name:>9} {seconds:>9.2f} {peak / 1e6:>9.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
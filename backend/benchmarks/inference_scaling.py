@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark rows/sec of the parallel inference engine by worker count
+
+Usage: python benchmarks/inference_scaling.py [--rows 500000] [--workers 1 2 4 8]
+Requires a trained model at models/soil_model.pkl (run: python train_model.py).
+"""
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+# Add the backend directory to the Python path
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+from app.features import REQUIRED_COLUMNS, FeatureEncoder
+from app.inference import InferenceEngine
+
+MODEL_PATH = os.path.join(backend_dir, 'models', 'soil_model.pkl')
+
+
+def make_features(encoder, n_rows, seed=0):
+    """Encode n_rows of random soil samples in the model's feature layout"""
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({col: rng.uniform(0, 100, n_rows) for col in REQUIRED_COLUMNS})
+    data['soilType'] = rng.choice(sorted(encoder.soil_type_offsets), n_rows)
+    return encoder.transform(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500000, help='rows per batch')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1],
+                        help='worker counts to compare (1 = in-process)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per worker count')
+    args = parser.parse_args()
+
+    if not os.path.exists(MODEL_PATH):
+        print(f"Model not found at {MODEL_PATH}. Run: python train_model.py")
+        return 1
+
+    model = joblib.load(MODEL_PATH)
+    features = make_features(FeatureEncoder.from_model(model), args.rows)
+    baseline = None
+
+    print(f"{args.rows} rows, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'seconds':>9} {'rows/sec':>12} {'speedup':>8}")
+    for workers in sorted(set(args.workers)):
+        engine = InferenceEngine(MODEL_PATH, workers=workers, threshold=0, mmap_mode='r')
+        engine.predict(model, features.iloc[:workers * 10])  # start the pool and load the model in each worker
+
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            engine.predict(model, features)
+            timings.append(time.perf_counter() - start)
+        engine.reset()
+
+        seconds = min(timings)
+        rows_per_sec = args.rows / seconds
+        baseline = baseline or rows_per_sec
+        print(f"{workers:>8} {seconds:>9.3f} {rows_per_sec:>12,.0f} {rows_per_sec / baseline:>7.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Concurrent load test against a running prediction server
+
+Usage:
+  python benchmarks/load_test.py --url http://localhost:5000 --concurrency 1 8 32
+  python benchmarks/load_test.py --kind list_100 --requests 500 --concurrency 16
+  python benchmarks/load_test.py --slow-uploads 8 --concurrency 8
+
+Each concurrency level runs that many client threads, each sending requests
+over its own connections until --requests have completed. Reports
+throughput, latency percentiles and failures per level, so deployments
+(sync workers, threads, micro-batching, the ASGI entry point) can be compared
+on the same machine. With --slow-uploads, that many extra connections keep
+trickling CSV uploads at --slow-rate bytes/sec while each level runs, which
+shows whether slow clients starve everyone else of workers. Unlike
+run_benchmarks.py this needs a server to be running; start it in another
+terminal first.
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import numpy as np
+
+# Add the backend directory to the Python path
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+from train_model import generate_soil_data
+
+# name: (payload kind, rows per request)
+KINDS = {
+    'single': ('json', 1),
+    'list_100': ('json', 100),
+    'csv_10k': ('csv', 10000),
+}
+
+
+def make_bodies(kind, count, seed=0):
+    """Return (content_type, [body, ...]) with distinct samples per request"""
+    payload, rows = KINDS[kind]
+    rng = np.random.RandomState(seed)
+    if payload == 'json':
+        data = generate_soil_data(rows * count, rng)
+        records = data.to_dict(orient='records')
+        if rows == 1:
+            return 'application/json', [json.dumps(record).encode() for record in records]
+        return 'application/json', [json.dumps(records[i:i + rows]).encode() for i in range(0, len(records), rows)]
+
+    boundary = uuid.uuid4().hex
+    csv_text = generate_soil_data(rows, rng).round(2).to_csv(index=False)
+    body = io.BytesIO()
+    body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="samples.csv"\r\n'
+               f'Content-Type: text/csv\r\n\r\n'.encode())
+    body.write(csv_text.encode())
+    body.write(f'\r\n--{boundary}--\r\n'.encode())
+    # Uploads reuse one file; the parser does not benefit from having seen it
+    return f'multipart/form-data; boundary={boundary}', [body.getvalue()]
+
+
+def slow_uploader(url, rate, stop):
+    """Send CSV uploads at rate bytes/sec, over and over, until stop is set"""
+    target = urlsplit(url)
+    path = (target.path.rstrip('/') or '') + '/api/predict'
+    content_type, (body,) = make_bodies('csv_10k', 1, seed=1)
+    piece = max(1, int(rate / 10))
+    while not stop.is_set():
+        connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=60)
+        try:
+            connection.putrequest('POST', path)
+            connection.putheader('Content-Type', content_type)
+            connection.putheader('Content-Length', str(len(body)))
+            connection.endheaders()
+            for start in range(0, len(body), piece):
+                if stop.wait(0.1):
+                    break
+                connection.send(body[start:start + piece])
+            else:
+                connection.getresponse().read()
+        except Exception:
+            stop.wait(0.1)
+        finally:
+            connection.close()
+
+
+def run_level(url, content_type, bodies, concurrency, total, timeout):
+    target = urlsplit(url)
+    path = (target.path.rstrip('/') or '') + '/api/predict'
+    latencies = []
+    failures = []
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def worker():
+        connection = None
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                break
+            body = bodies[index % len(bodies)]
+            start = time.perf_counter()
+            try:
+                if connection is None:
+                    connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=timeout)
+                connection.request('POST', path, body=body, headers={'Content-Type': content_type})
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    failures.append(f'HTTP {response.status}')
+                elif response.getheader('Connection', '').lower() == 'close' or response.version == 10:
+                    connection.close()
+                    connection = None
+            except Exception as e:
+                failures.append(type(e).__name__)
+                if connection is not None:
+                    connection.close()
+                connection = None
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+        if connection is not None:
+            connection.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies_ms = np.array(latencies) * 1000 if latencies else np.array([np.nan])
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'failures': len(failures),
+        'requests_per_sec': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000', help='server base URL')
+    parser.add_argument('--kind', choices=list(KINDS), default='single', help='request payload')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32], help='client threads per level')
+    parser.add_argument('--requests', type=int, default=1000, help='requests per level')
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds before a request counts as failed')
+    parser.add_argument('--slow-uploads', type=int, default=0, help='connections trickling uploads during each level')
+    parser.add_argument('--slow-rate', type=float, default=20000, help='bytes/sec sent by each slow upload')
+    parser.add_argument('--save', metavar='PATH', help='write the results as JSON')
+    args = parser.parse_args()
+
+    content_type, bodies = make_bodies(args.kind, min(args.requests, 1000))
+    stop = threading.Event()
+    slow_threads = [
+        threading.Thread(target=slow_uploader, args=(args.url, args.slow_rate, stop), daemon=True)
+        for _ in range(args.slow_uploads)
+    ]
+    for thread in slow_threads:
+        thread.start()
+    if slow_threads:
+        time.sleep(1.0)  # let the slow uploads occupy their connections first
+
+    print(f"{args.kind} requests to {args.url}" + (f" alongside {args.slow_uploads} slow uploads" if slow_threads else ''))
+    print(f"{'clients':>8} {'requests':>9} {'failed':>7} {'req/sec':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    results = []
+    for concurrency in args.concurrency:
+        result = run_level(args.url, content_type, bodies, concurrency, args.requests, args.timeout)
+        results.append(result)
+        print(f"{concurrency:>8} {result['requests']:>9} {result['failures']:>7} {result['requests_per_sec']:>9.1f} "
+              f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f}")
+    stop.set()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'url': args.url, 'kind': args.kind, 'slow_uploads': args.slow_uploads, 'levels': results}, f, indent=2)
+        print(f"\nResults saved to {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the prediction service
+
+Usage:
+  python benchmarks/run_benchmarks.py                        # run and print every scenario
+  python benchmarks/run_benchmarks.py --save baseline.json   # ... and save the results
+  python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json
+  python benchmarks/run_benchmarks.py --scenarios json_single csv_10k
+
+Requests go through the Flask test client, so no server or network is
+involved. Inputs are random samples from train_model.generate_soil_data.
+Each scenario reports latency percentiles, rows/sec and the peak RSS
+reached while it ran. --compare flags scenarios whose p50 latency or
+rows/sec regressed by more than --threshold against a saved run, and exits
+with status 1 if any did. Requires a trained model at models/soil_model.pkl
+(run: python train_model.py).
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+# Add the backend directory to the Python path
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+# Load the model before the first timed request
+os.environ.setdefault('MODEL_LOADING', 'eager')
+
+from app import create_app
+from app.memory import process_memory, reset_peak_rss
+from train_model import generate_soil_data
+
+MODEL_PATH = os.path.join(backend_dir, 'models', 'soil_model.pkl')
+
+# name: (kind, rows per request, timed repetitions)
+SCENARIOS = {
+    'json_single': ('json_single', 1, 200),
+    'json_list_100': ('json_list', 100, 50),
+    'json_list_10k': ('json_list', 10000, 5),
+    'csv_10k': ('csv', 10000, 5),
+    'csv_100k': ('csv', 100000, 3),
+    'csv_1m': ('csv', 1000000, 1),
+    'excel_10k': ('xlsx', 10000, 3),
+}
+
+# Metrics where a larger value is a regression, and where a smaller one is
+LOWER_IS_BETTER = ('p50_ms', 'p95_ms')
+HIGHER_IS_BETTER = ('rows_per_sec',)
+
+
+def make_payloads(kind, rows, repeat, seed=0):
+    """Build one request payload per repetition, with distinct rows each time"""
+    rng = np.random.RandomState(seed)
+    if kind == 'json_single':
+        data = generate_soil_data(repeat, rng)
+        return [{'json': record} for record in data.to_dict(orient='records')]
+    if kind == 'json_list':
+        return [{'json': generate_soil_data(rows, rng).to_dict(orient='records')} for _ in range(repeat)]
+
+    # Uploads reuse one file; the parser does not benefit from having seen it.
+    # Lab exports carry a couple of decimals, which also keeps 1M rows under MAX_UPLOAD_MB
+    data = generate_soil_data(rows, rng).round(2)
+    if kind == 'csv':
+        body = data.to_csv(index=False).encode()
+    else:
+        buffer = io.BytesIO()
+        data.to_excel(buffer, index=False)
+        body = buffer.getvalue()
+    return [{'file': body, 'filename': f'samples.{kind}'} for _ in range(repeat)]
+
+
+def send(client, payload):
+    if 'json' in payload:
+        response = client.post('/api/predict', json=payload['json'])
+    else:
+        response = client.post(
+            '/api/predict',
+            data={'file': (io.BytesIO(payload['file']), payload['filename'])},
+            content_type='multipart/form-data'
+        )
+    body = response.get_data()
+    status = response.status_code
+    # Closing runs the on-close hooks a WSGI server would (metrics, upload buffers)
+    response.close()
+    if status != 200:
+        raise RuntimeError(f"HTTP {status}: {body[:200]!r}")
+    return len(body)
+
+
+def run_scenario(client, name):
+    kind, rows, repeat = SCENARIOS[name]
+    payloads = make_payloads(kind, rows, repeat + 1)
+
+    send(client, payloads[0])  # warm-up request, not timed
+    reset_peak_rss()
+    latencies = []
+    response_bytes = 0
+    for payload in payloads[1:]:
+        start = time.perf_counter()
+        response_bytes = send(client, payload)
+        latencies.append(time.perf_counter() - start)
+    peak = process_memory().get('peak_rss_bytes')
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'rows': rows,
+        'requests': repeat,
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'mean_ms': float(latencies_ms.mean()),
+        'rows_per_sec': rows * repeat / float(np.sum(latencies)),
+        'response_bytes': response_bytes,
+        'peak_rss_mb': peak / 1e6 if peak else None,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return a list of (scenario, metric, baseline, current, change) regressions"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > threshold if metric in LOWER_IS_BETTER else change < -threshold
+            if worse:
+                regressions.append((name, metric, old, new, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS),
+                        help='scenarios to run (default: all)')
+    parser.add_argument('--save', metavar='PATH', help='write the results as a baseline JSON file')
+    parser.add_argument('--compare', metavar='PATH', help='compare against a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='relative change treated as a regression (default: 0.15)')
+    args = parser.parse_args()
+
+    if not os.path.exists(MODEL_PATH):
+        print(f"Model not found at {MODEL_PATH}. Run: python train_model.py")
+        return 1
+
+    client = create_app().test_client()
+
+    print(f"{'scenario':<14} {'rows':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rows/sec':>12} {'peak RSS MB':>12}")
+    results = {}
+    for name in args.scenarios:
+        result = results[name] = run_scenario(client, name)
+        peak = f"{result['peak_rss_mb']:.0f}" if result['peak_rss_mb'] is not None else '-'
+        print(f"{name:<14} {result['rows']:>8} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} "
+              f"{result['p99_ms']:>9.1f} {result['rows_per_sec']:>12,.0f} {peak:>12}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'created_at': datetime.utcnow().isoformat(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cpu_count': os.cpu_count(),
+                'scenarios': results
+            }, f, indent=2)
+        print(f"\nResults saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        print(f"\nCompared with {args.compare} ({baseline.get('cpu_count')} CPUs, {baseline.get('created_at')})")
+        for name, metric, old, new, change in regressions:
+            print(f"  REGRESSION {name} {metric}: {old:,.1f} -> {new:,.1f} ({change:+.0%})")
+        if regressions:
+            return 1
+        print(f"  No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
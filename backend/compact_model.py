@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Compact the trained model and report the size/latency/accuracy trade-off
+
+Usage:
+  python compact_model.py                          # report only
+  python compact_model.py --profile pruned --budget 0.005
+  python compact_model.py --profile none           # serve the full sklearn model again
+  python compact_model.py --data /path/to/holdout --save compaction.json
+
+Builds every profile in app/compaction.py from the full sklearn model and
+prints, per profile: trees, depth, nodes, artifact bytes, load time (as the
+server loads it, including compiling the compact forest for sklearn models),
+one-row and 10,000-row prediction latency and validation R². The budget is
+the largest R² drop from the full model the trees/depth/pruned profiles may
+take. Validation rows are fresh synthetic samples, or a sample of --data,
+which should not contain the rows the model was trained on.
+
+With --profile, that variant is written to --output (the served
+soil_model.pkl by default). The full model is first kept at
+soil_model.full.pkl, and later runs compact from that copy, so profiles can
+be switched without retraining. POST /api/reload-model picks the new file up.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+
+# Add the backend directory to the Python path, so the script runs from any working directory
+backend_dir = os.path.dirname(os.path.abspath(__file__))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+from app.compaction import (DEFAULT_BUDGET, PROFILES, CompactRegressor, candidate_scores, choose_variant,
+                            compact_model, r2_scores)
+from app.dataset import DEFAULT_SAMPLE_SIZE
+from app.forest import compile_forest
+from app.registry import model_file_version
+from app.scoring import DEFAULT_CHUNK_SIZE
+from train_model import MODEL_PATH, MODELS_DIR, load_training_dataset, make_training_data, save_model
+from tune_model import BATCH_ROWS, median_ms
+
+FULL_MODEL_PATH = os.path.join(MODELS_DIR, 'soil_model.full.pkl')
+# Differs from the training seed, so synthetic validation rows are unseen
+VALIDATION_SEED = 7
+LOAD_REPEATS = 5
+
+
+def load_full_model(model_path):
+    """(model, path) of the full sklearn model, following a compacted file back to its full copy"""
+    model = joblib.load(model_path)
+    if isinstance(model, CompactRegressor):
+        if not os.path.exists(FULL_MODEL_PATH):
+            raise FileNotFoundError(f"{model_path} is already compacted and {FULL_MODEL_PATH} is missing; retrain first")
+        return joblib.load(FULL_MODEL_PATH), FULL_MODEL_PATH
+    return model, model_path
+
+
+def copy_model_file(source, destination):
+    """Copy a model file byte for byte, so its version hash is unchanged, replacing destination atomically"""
+    tmp_path = f'{destination}.{os.getpid()}.tmp'
+    shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, destination)
+
+
+def load_ms(path):
+    """Median time to load the file the way the server does, in milliseconds"""
+    times = []
+    for _ in range(LOAD_REPEATS):
+        start = time.perf_counter()
+        model = joblib.load(path, mmap_mode='r')
+        if not isinstance(model, CompactRegressor):
+            compile_forest(model)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1000
+
+
+def measure(model, X, y, work_dir, name):
+    """Artifact bytes, load and prediction latency, and validation R² of one variant"""
+    path = save_model(model, os.path.join(work_dir, f'{name}.pkl'))
+    predictor = model if isinstance(model, CompactRegressor) else (compile_forest(model) or model)
+    rng = np.random.RandomState(0)
+    single = X.iloc[rng.randint(len(X), size=1)]
+    batch = X.iloc[rng.randint(len(X), size=BATCH_ROWS)]
+    return {
+        'bytes': os.path.getsize(path),
+        'load_ms': load_ms(path),
+        'single_row_ms': median_ms(predictor.predict, single),
+        'batch_10k_ms': median_ms(predictor.predict, batch),
+        'r2': float(r2_scores(predictor.predict(X)[:, np.newaxis], y)[0]),
+    }
+
+
+def build_variants(model, X, y, budget):
+    """{profile: model} for every profile, plus the baseline R² and validation details"""
+    baseline_r2 = float(r2_scores(model.predict(X)[:, np.newaxis], y)[0])
+    r2, nodes = candidate_scores(model, X, y)
+    variants = {'none': model}
+    for profile in PROFILES[1:]:
+        trees, depth = choose_variant(profile, r2, nodes, baseline_r2, budget)
+        variants[profile] = compact_model(model, trees, depth, {
+            'profile': profile,
+            'budget': budget,
+            'baseline_r2': baseline_r2,
+            'validation_r2': float(r2[depth - 1, trees - 1]),
+            'validation_rows': len(y),
+            'nodes': int(nodes[depth - 1, trees - 1]),
+        })
+    return variants, baseline_r2
+
+
+def print_report(report, baseline_r2):
+    print(f"\n{'profile':<8} {'trees':>5} {'depth':>5} {'nodes':>8} {'size MB':>8} {'load ms':>8} "
+          f"{'1 row ms':>9} {'10k ms':>8} {'R²':>8} {'ΔR²':>8}")
+    for row in report:
+        print(f"{row['profile']:<8} {row['trees']:>5} {row['max_depth']:>5} {row['nodes']:>8} {row['bytes'] / 1e6:>8.2f} "
+              f"{row['load_ms']:>8.1f} {row['single_row_ms']:>9.3f} {row['batch_10k_ms']:>8.1f} {row['r2']:>8.4f} "
+              f"{row['r2'] - baseline_r2:>+8.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compact the trained model for serving')
+    parser.add_argument('--model', default=MODEL_PATH, help='model to compact (default: the served model)')
+    parser.add_argument('--profile', choices=PROFILES, help='write this variant to --output')
+    parser.add_argument('--output', default=MODEL_PATH, help='where --profile writes the variant')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, help='largest allowed validation R² drop')
+    parser.add_argument('--samples', type=int, default=5000, help='synthetic validation rows')
+    parser.add_argument('--data', metavar='PATH', help='validate on a sample of these dataset files instead')
+    parser.add_argument('--sample-size', type=int, default=DEFAULT_SAMPLE_SIZE, help='rows sampled from --data')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='rows read per chunk from --data')
+    parser.add_argument('--save', metavar='PATH', help='write the report as JSON')
+    args = parser.parse_args()
+
+    model, source_path = load_full_model(args.model)
+    source_version = model_file_version(source_path)
+    if args.data:
+        X, y, _ = load_training_dataset(args.data, args.sample_size, args.chunk_size)
+    else:
+        X, y = make_training_data(args.samples, random_state=VALIDATION_SEED)
+    X = X.reindex(columns=model.feature_names_in_, fill_value=0)
+    y = np.asarray(y, dtype=np.float64)
+    print(f"Compacting model {source_version} ({source_path}) against {len(y):,} validation rows, budget ΔR² ≤ {args.budget}")
+
+    variants, baseline_r2 = build_variants(model, X, y, args.budget)
+    report = []
+    with tempfile.TemporaryDirectory(dir=MODELS_DIR) as work_dir:
+        for profile, variant in variants.items():
+            row = {'profile': profile}
+            if isinstance(variant, CompactRegressor):
+                variant.compaction_['source_version'] = source_version
+                row.update(trees=variant.n_trees, max_depth=variant.depth, nodes=variant.n_nodes)
+            else:
+                row.update(trees=len(variant.estimators_), max_depth=max(e.tree_.max_depth for e in variant.estimators_),
+                           nodes=sum(e.tree_.node_count for e in variant.estimators_))
+            row.update(measure(variant, X, y, work_dir, profile))
+            report.append(row)
+    print_report(report, baseline_r2)
+
+    if args.profile:
+        output = os.path.abspath(args.output)
+        if args.profile == 'none':
+            if output != os.path.abspath(source_path):
+                copy_model_file(source_path, output)
+        else:
+            if output == os.path.abspath(source_path):
+                # Keep the full model so other profiles can be built later without retraining
+                copy_model_file(source_path, FULL_MODEL_PATH)
+            save_model(variants[args.profile], output)
+        print(f"\n✓ Wrote the '{args.profile}' profile to {output} (model {model_file_version(output)})")
+        print("  Reload the server's model with: POST /api/reload-model")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'source_version': source_version, 'budget': args.budget, 'baseline_r2': baseline_r2,
+                       'validation_rows': len(y), 'profiles': report}, f, indent=2)
+        print(f"\nReport saved to {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,27 @@
+"""
+Gunicorn configuration for the Soil Productivity Prediction API
+
+Usage: gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is preloaded in the master process, so the model is loaded once and
+its tree arrays are shared copy-on-write by every forked worker instead of
+each worker holding a private copy. Check the effect with the per-worker
+`memory` section of /api/model/info (sum `pss_bytes` across workers).
+"""
+import gc
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+# Load wsgi:app (and with it the model) before forking workers. A background
+# warm-up thread would not survive the fork, so load the model eagerly here.
+preload_app = True
+os.environ.setdefault('MODEL_LOADING', 'eager')
+
+
+def when_ready(server):
+    # Move everything allocated so far into the permanent GC generation so
+    # collections in the workers do not write to, and un-share, those pages
+    gc.freeze()
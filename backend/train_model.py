@@ -1,43 +1,63 @@
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import KFold, train_test_split
 from sklearn.metrics import mean_squared_error, r2_score
 import joblib
+import argparse
+import multiprocessing
 import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 
-def train_soil_model():
-    # Generate sample data (replace with your actual data)
-    np.random.seed(42)
-    n_samples = 1000
-    
-    data = {
-        'nitrogen': np.random.uniform(0, 200, n_samples),
-        'phosphorus': np.random.uniform(5, 100, n_samples),
-        'potassium': np.random.uniform(50, 300, n_samples),
-        'ph': np.random.uniform(4.5, 8.5, n_samples),
-        'organic_matter': np.random.uniform(0.5, 5.0, n_samples),
-        'electricalConductivity': np.random.uniform(0.1, 5.0, n_samples),
-        'sulphur': np.random.uniform(5, 50, n_samples),
-        'zinc': np.random.uniform(0.5, 10, n_samples),
-        'iron': np.random.uniform(2, 50, n_samples),
-        'copper': np.random.uniform(0.2, 5, n_samples),
-        'manganese': np.random.uniform(1, 25, n_samples),
-        'boron': np.random.uniform(0.1, 2, n_samples),
-        'moisture': np.random.uniform(10, 60, n_samples),
-        'temperature': np.random.uniform(15, 35, n_samples),
-        'humidity': np.random.uniform(30, 80, n_samples),
-        'rainfall': np.random.uniform(50, 300, n_samples),
-        'soilType': np.random.choice(['Loam', 'Clay', 'Sandy', 'Silt', 'Peat', 'Chalk', 'Gravel', 'Sand', 'Clay Loam', 'Sandy Loam', 'Silty Clay', 'Sandy Clay', 'Loamy Sand', 'Silt Loam', 'Peat Loam', 'Chalky Loam', 'Gravelly Loam', 'Silty Loam', 'Clay Sand', 'Humus', 'Compost', 'Topsoil', 'Subsoil', 'Black Soil', 'Red Soil', 'Yellow Soil', 'Alluvial Soil', 'Laterite Soil', 'Saline Soil', 'Acidic Soil', 'Alkaline Soil', 'Loamy', 'Silty', 'Sandy Clay Loam', 'Silty Clay Loam', 'Clayey', 'Silty Sand', 'Clayey Sand'], n_samples),
-    }
-    
-    # Create target variable (productivity score 0-100)
-    X = pd.DataFrame(data)
-    
-    # Encode soilType as numeric using one-hot encoding
-    X = pd.get_dummies(X, columns=['soilType'], prefix='soilType')
-    # Calculate base productivity score
-    base_score = (
+# Add the backend directory to the Python path, so the script runs from any working directory
+backend_dir = os.path.dirname(os.path.abspath(__file__))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+from app.dataset import DEFAULT_SAMPLE_SIZE, ingest
+from app.features import TARGET_COLUMN
+from app.memory import process_memory, reset_peak_rss
+from app.scoring import DEFAULT_CHUNK_SIZE
+
+# Absolute, so training from another working directory still writes where the server loads from
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+MODEL_PATH = os.path.join(MODELS_DIR, 'soil_model.pkl')
+
+EVALUATIONS = ('holdout', 'kfold', 'none')
+MODEL_PARAMS = {'n_estimators': 100, 'random_state': 42, 'max_depth': 10}
+
+SOIL_TYPES = ['Loam', 'Clay', 'Sandy', 'Silt', 'Peat', 'Chalk', 'Gravel', 'Sand', 'Clay Loam', 'Sandy Loam', 'Silty Clay', 'Sandy Clay', 'Loamy Sand', 'Silt Loam', 'Peat Loam', 'Chalky Loam', 'Gravelly Loam', 'Silty Loam', 'Clay Sand', 'Humus', 'Compost', 'Topsoil', 'Subsoil', 'Black Soil', 'Red Soil', 'Yellow Soil', 'Alluvial Soil', 'Laterite Soil', 'Saline Soil', 'Acidic Soil', 'Alkaline Soil', 'Loamy', 'Silty', 'Sandy Clay Loam', 'Silty Clay Loam', 'Clayey', 'Silty Sand', 'Clayey Sand']
+
+def generate_soil_data(n_samples, random_state=None):
+    """Random soil samples in the upload layout (numeric columns plus soilType)"""
+    rng = random_state if isinstance(random_state, np.random.RandomState) else np.random.RandomState(random_state)
+    return pd.DataFrame({
+        'nitrogen': rng.uniform(0, 200, n_samples),
+        'phosphorus': rng.uniform(5, 100, n_samples),
+        'potassium': rng.uniform(50, 300, n_samples),
+        'ph': rng.uniform(4.5, 8.5, n_samples),
+        'organic_matter': rng.uniform(0.5, 5.0, n_samples),
+        'electricalConductivity': rng.uniform(0.1, 5.0, n_samples),
+        'sulphur': rng.uniform(5, 50, n_samples),
+        'zinc': rng.uniform(0.5, 10, n_samples),
+        'iron': rng.uniform(2, 50, n_samples),
+        'copper': rng.uniform(0.2, 5, n_samples),
+        'manganese': rng.uniform(1, 25, n_samples),
+        'boron': rng.uniform(0.1, 2, n_samples),
+        'moisture': rng.uniform(10, 60, n_samples),
+        'temperature': rng.uniform(15, 35, n_samples),
+        'humidity': rng.uniform(30, 80, n_samples),
+        'rainfall': rng.uniform(50, 300, n_samples),
+        'soilType': rng.choice(SOIL_TYPES, n_samples),
+    })
+
+def productivity_score(X):
+    """Noise-free productivity score (0-100 scale) the synthetic target is built from"""
+    return (
         0.15 * (X['nitrogen'] / 200) * 100 +  # Normalize to 0-100 scale
         0.10 * (X['phosphorus'] / 100) * 100 +
         0.10 * (X['potassium'] / 300) * 100 +
@@ -55,37 +75,234 @@ def train_soil_model():
         0.07 * (X['rainfall'] / 300) * 100 +
         0.05 * (1 - abs(X['ph'] - 7.0) / 3.5) * 100  # Optimal pH around 7
     )
+
+class TrainingReport:
+    """Wall time and peak RSS of each training stage.
+
+    Peak RSS is measured by resetting the process's peak counter, so pass
+    track_memory=False when training inside the server, whose own peak must
+    not be cleared; stages then report wall time only.
+    """
+
+    def __init__(self, track_memory=True):
+        self.track_memory = track_memory
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        if self.track_memory:
+            reset_peak_rss()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            peak = process_memory().get('peak_rss_bytes') if self.track_memory else None
+            self.stages.append((name, time.perf_counter() - start, peak))
+
+    def print(self):
+        print(f"{'stage':<10} {'seconds':>9} {'peak RSS MB':>12}")
+        for name, seconds, peak in self.stages:
+            print(f"{name:<10} {seconds:>9.2f} {peak / 1e6 if peak else float('nan'):>12.0f}")
+        print(f"{'total':<10} {sum(seconds for _, seconds, _ in self.stages):>9.2f}")
+
+
+def make_training_data(n_samples=1000, random_state=42):
+    """Encoded synthetic features and a noisy 0-100 productivity target"""
+    rng = np.random.RandomState(random_state)
+    X = generate_soil_data(n_samples, rng)
     
-    # Add some noise and ensure range is 0-100
-    y = np.clip(base_score + np.random.normal(0, 5, n_samples), 0, 100)
-    
-    # Train the model
-    model = RandomForestRegressor(n_estimators=100, random_state=42, max_depth=10)
-    model.fit(X, y)
+    # Encode soilType as numeric using one-hot encoding
+    X = encode_training_frame(X)
+    # Add some noise to the base score and ensure range is 0-100
+    y = np.clip(productivity_score(X) + rng.normal(0, 5, n_samples), 0, 100)
+    return X, y
+
+
+def _fit_fold(X, y, train_index, test_index, params):
+    """Fit and score one cross-validation fold (runs in a worker process)"""
+    reset_peak_rss()
+    model = RandomForestRegressor(**params, n_jobs=1)
+    model.fit(X.iloc[train_index], y[train_index])
+    y_pred = model.predict(X.iloc[test_index])
+    return mean_squared_error(y[test_index], y_pred), r2_score(y[test_index], y_pred), process_memory().get('peak_rss_bytes')
+
+
+def cross_validate(X, y, folds=5, workers=None, params=MODEL_PARAMS):
+    """k-fold MSE/R² per fold, with folds fitted in parallel worker processes"""
+    splits = list(KFold(n_splits=folds, shuffle=True, random_state=params.get('random_state')).split(X))
+    workers = min(workers or os.cpu_count() or 1, folds)
+    if workers <= 1:
+        return [_fit_fold(X, y, train_index, test_index, params) for train_index, test_index in splits]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(_fit_fold, X, y, train_index, test_index, params) for train_index, test_index in splits]
+        return [future.result() for future in futures]
+
+
+def save_model(model, model_path=MODEL_PATH):
+    """Write the model atomically: dump to a temporary file, then rename it into place.
+
+    A server loading (or memory-mapping) the old file keeps a complete copy,
+    and never sees a half-written one.
+    """
+    models_dir = os.path.dirname(os.path.abspath(model_path))
+    os.makedirs(models_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=models_dir, prefix='.soil_model.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            # Keep the artifact uncompressed so the server can load it with mmap_mode='r'
+            joblib.dump(model, f, compress=0)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file private; keep the permissions of the file being replaced
+        os.chmod(tmp_path, os.stat(model_path).st_mode & 0o777 if os.path.exists(model_path) else 0o644)
+        os.replace(tmp_path, model_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return model_path
+
+
+def encode_training_frame(data):
+    """One-hot encode soilType the same way for synthetic and user data"""
+    return pd.get_dummies(data, columns=['soilType'], prefix='soilType')
+
+
+def fit_and_save(X, y, report, evaluation='holdout', n_jobs=1, folds=5, fold_workers=None, model_path=MODEL_PATH,
+                 params=MODEL_PARAMS):
+    """Fit once for the evaluation strategy, save the model and return (model, metrics, rows fitted)"""
+    metrics = {}
+    if evaluation == 'holdout':
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    else:
+        X_train, y_train = X, y
+        if evaluation == 'kfold':
+            with report.stage('kfold'):
+                scores = cross_validate(X, y, folds, fold_workers, params)
+            mse, r2, peaks = zip(*scores)
+            metrics = {'CV MSE': f"{np.mean(mse):.2f} ± {np.std(mse):.2f}", 'CV R² Score': f"{np.mean(r2):.3f} ± {np.std(r2):.3f}"}
+            if all(peaks):
+                metrics['Fold peak RSS'] = f"{max(peaks) / 1e6:.0f} MB"
     
-    # Evaluate model
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-    model.fit(X_train, y_train)
-    y_pred = model.predict(X_test)
+    with report.stage('fit'):
+        model = RandomForestRegressor(**params, n_jobs=n_jobs)
+        model.fit(X_train, y_train)
+    # Serving predicts in-process; training parallelism should not carry over
+    model.set_params(n_jobs=None)
     
-    mse = mean_squared_error(y_test, y_pred)
-    r2 = r2_score(y_test, y_pred)
+    if evaluation == 'holdout':
+        with report.stage('evaluate'):
+            y_pred = model.predict(X_test)
+        metrics = {'Test MSE': f"{mean_squared_error(y_test, y_pred):.2f}", 'Test R² Score': f"{r2_score(y_test, y_pred):.3f}"}
     
+    with report.stage('save'):
+        save_model(model, model_path)
+    return model, metrics, len(X_train)
+
+
+def print_summary(model, model_path, metrics, report, rows_line):
     print(f"Model trained successfully!")
-    print(f"Test MSE: {mse:.2f}")
-    print(f"Test R² Score: {r2:.3f}")
-    
-    # Save the model
-    models_dir = 'models'
-    os.makedirs(models_dir, exist_ok=True)
-    model_path = os.path.join(models_dir, 'soil_model.pkl')
-    joblib.dump(model, model_path)
     print(f"✓ Model saved to {model_path}")
     print(f"  Model type: {type(model).__name__}")
-    print(f"  Test R² Score: {r2:.3f}")
-    print(f"  Test MSE: {mse:.2f}")
+    print(f"  Rows: {rows_line}")
+    for name, value in metrics.items():
+        print(f"  {name}: {value}")
+    report.print()
+
+
+def train_soil_model(n_samples=1000, evaluation='holdout', n_jobs=1, folds=5, fold_workers=None,
+                     model_path=MODEL_PATH, params=MODEL_PARAMS, track_memory=True):
+    """Train, evaluate and save the productivity model with one fit per evaluation strategy.
+
+    'holdout' fits on an 80% split and reports test scores, 'kfold' scores
+    k folds in worker processes and then fits on all rows, 'none' only fits
+    on all rows. n_jobs is the number of threads building trees (the CLI
+    uses every CPU; the server's background retrain keeps it bounded), and
+    params the forest hyperparameters (see tune_model.py for choosing them).
+    track_memory=False leaves the process's peak RSS counter alone.
+    """
+    if evaluation not in EVALUATIONS:
+        raise ValueError(f"evaluation must be one of: {', '.join(EVALUATIONS)}")
+    report = TrainingReport(track_memory)
     
+    # Generate sample data (replace with your actual data)
+    with report.stage('generate'):
+        X, y = make_training_data(n_samples)
+    
+    model, metrics, rows = fit_and_save(X, y, report, evaluation, n_jobs, folds, fold_workers, model_path, params)
+    print_summary(model, model_path, metrics, report, f"{rows} of {n_samples} ({evaluation} evaluation)")
     return model
 
+
+def load_training_dataset(data_path, sample_size=DEFAULT_SAMPLE_SIZE, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Encoded features and target sampled from the dataset files under data_path, plus IngestStats"""
+    reservoir, stats = ingest(data_path, sample_size, chunk_size)
+    for skipped in stats.skipped:
+        print(f"  Skipped {skipped['file']}: {skipped['error']}")
+    for partial in stats.partial:
+        print(f"  Partially read {partial['file']} ({partial['rows_read']:,} rows used): {partial['error']}")
+    if reservoir.size == 0:
+        raise ValueError(f"No valid training rows found under {data_path}")
+    print(f"Ingested {stats.rows_read:,} rows from {stats.files} files ({stats.bytes / 1e6:.1f} MB) in {stats.seconds:.1f}s: "
+          f"{stats.rows_per_sec:,.0f} rows/sec, {stats.bytes / 1e6 / stats.seconds:.1f} MB/sec")
+    print(f"  Valid rows: {stats.rows_valid:,}; sampled {reservoir.size:,} ({reservoir.nbytes / 1e6:.0f} MB reservoir)")
+    
+    data = reservoir.to_frame()
+    del reservoir
+    y = data.pop(TARGET_COLUMN).to_numpy()
+    return encode_training_frame(data), y, stats
+
+
+def train_from_dataset(data_path, sample_size=DEFAULT_SAMPLE_SIZE, chunk_size=DEFAULT_CHUNK_SIZE, evaluation='holdout',
+                       n_jobs=1, folds=5, fold_workers=None, model_path=MODEL_PATH, params=MODEL_PARAMS):
+    """Train on CSV/Excel/Parquet files under data_path with bounded memory.
+
+    Files are streamed in chunks of chunk_size rows into a uniform sample of
+    at most sample_size rows, which the forest is then fitted on. The target
+    is the productivity/yield column, on the same 0-100 scale the API reports.
+    """
+    if evaluation not in EVALUATIONS:
+        raise ValueError(f"evaluation must be one of: {', '.join(EVALUATIONS)}")
+    report = TrainingReport()
+    
+    with report.stage('ingest'):
+        X, y, stats = load_training_dataset(data_path, sample_size, chunk_size)
+    
+    model, metrics, rows = fit_and_save(X, y, report, evaluation, n_jobs, folds, fold_workers, model_path, params)
+    print_summary(model, model_path, metrics, report,
+                  f"{rows:,} fitted of {stats.rows_valid:,} valid ({evaluation} evaluation)")
+    return model
+
+def parse_max_depth(value):
+    """argparse type for max_depth: a positive integer or 'none' for unlimited"""
+    return None if value.lower() == 'none' else int(value)
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the soil productivity model')
+    parser.add_argument('--data', metavar='PATH', help='train on a CSV/Excel/Parquet file or directory instead of synthetic data')
+    parser.add_argument('--samples', type=int, default=1000, help='synthetic rows to generate')
+    parser.add_argument('--sample-size', type=int, default=DEFAULT_SAMPLE_SIZE,
+                        help='rows sampled from --data for fitting (default: %(default)s)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='rows read per chunk from --data')
+    parser.add_argument('--evaluation', choices=EVALUATIONS, default='holdout',
+                        help='holdout: fit on 80%% and test on 20%%; kfold: cross-validate, then fit on all rows')
+    parser.add_argument('--folds', type=int, default=5, help='folds for --evaluation kfold')
+    parser.add_argument('--fold-workers', type=int, help='processes fitting folds (default: CPU count)')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='threads building trees (default: all CPUs)')
+    parser.add_argument('--output', default=MODEL_PATH, help='model file to write')
+    parser.add_argument('--n-estimators', type=int, default=MODEL_PARAMS['n_estimators'], help='trees in the forest')
+    parser.add_argument('--max-depth', type=parse_max_depth, default=MODEL_PARAMS['max_depth'],
+                        help="tree depth limit, or 'none' (default: %(default)s)")
+    parser.add_argument('--min-samples-leaf', type=int, default=1, help='fewest training rows per leaf')
+    args = parser.parse_args()
+    params = dict(MODEL_PARAMS, n_estimators=args.n_estimators, max_depth=args.max_depth)
+    if args.min_samples_leaf != 1:
+        params['min_samples_leaf'] = args.min_samples_leaf
+    if args.data:
+        train_from_dataset(args.data, args.sample_size, args.chunk_size, args.evaluation, args.n_jobs,
+                           args.folds, args.fold_workers, args.output, params)
+    else:
+        train_soil_model(args.samples, args.evaluation, args.n_jobs, args.folds, args.fold_workers, args.output, params)
+
 if __name__ == "__main__":
-    train_soil_model()
\ No newline at end of file
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Hyperparameter search for the soil productivity forest
+
+Usage:
+  python tune_model.py
+  python tune_model.py --n-estimators 50 100 200 --max-depth 8 10 none --min-samples-leaf 1 5
+  python tune_model.py --data /path/to/soil-data --sample-size 100000 --save leaderboard.json
+
+Every combination of the given forest settings is cross-validated, with one
+(configuration, fold) fit per task spread over --workers processes. The
+encoded feature matrix, target and fold indices are cached under
+models/tune_cache, keyed by the data source and fold settings, so a repeated
+search skips generating or ingesting and encoding the data; workers
+memory-map the cached arrays instead of receiving copies.
+
+The first fold's model of each configuration is saved like train_model.py
+saves models, then timed one configuration at a time once all fits are done:
+one-row latency through the predictor the server would use and a 10,000-row
+batch. The leaderboard shows those and the artifact size next to CV R²/MSE,
+and marks the configurations no other one beats on R², one-row latency and
+size at once.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.model_selection import KFold
+
+# Add the backend directory to the Python path, so the script runs from any working directory
+backend_dir = os.path.dirname(os.path.abspath(__file__))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+from app.dataset import DEFAULT_SAMPLE_SIZE, dataset_files
+from app.forest import compile_forest
+from app.scoring import DEFAULT_CHUNK_SIZE
+from train_model import (MODELS_DIR, MODEL_PARAMS, load_training_dataset, make_training_data, parse_max_depth,
+                         save_model)
+
+CACHE_DIR = os.path.join(MODELS_DIR, 'tune_cache')
+# Bump when the cached layout or preprocessing changes
+CACHE_FORMAT = 1
+
+SORT_KEYS = {
+    'r2': ('cv_r2', True),
+    'mse': ('cv_mse', False),
+    'latency': ('single_row_ms', False),
+    'size': ('size_bytes', False),
+}
+LATENCY_SECONDS = 0.3
+BATCH_ROWS = 10000
+
+
+def source_description(args):
+    """What the cached matrix is built from; changing any of it invalidates the cache"""
+    if args.data:
+        files = [(path, os.path.getsize(path), os.path.getmtime(path)) for path in dataset_files(args.data)]
+        source = {'data': os.path.abspath(args.data), 'files': files, 'sample_size': args.sample_size,
+                  'chunk_size': args.chunk_size}
+    else:
+        source = {'samples': args.samples}
+    return dict(source, folds=args.folds, random_state=MODEL_PARAMS['random_state'], format=CACHE_FORMAT)
+
+
+def prepare_cache(args):
+    """Return the cache directory for this data source, building it on first use"""
+    source = source_description(args)
+    key = hashlib.sha256(json.dumps(source, sort_keys=True).encode()).hexdigest()[:16]
+    cache_dir = os.path.join(args.cache_dir, key)
+    if os.path.exists(os.path.join(cache_dir, 'meta.json')):
+        print(f"Using cached features in {cache_dir}")
+        return cache_dir
+
+    start = time.perf_counter()
+    if args.data:
+        X, y, _ = load_training_dataset(args.data, args.sample_size, args.chunk_size)
+    else:
+        X, y = make_training_data(args.samples)
+    # Trees split on float32 values, so the cached matrix fits the same forests as the DataFrame
+    features = X.to_numpy(dtype=np.float32)
+    target = np.asarray(y, dtype=np.float64)
+    splits = KFold(n_splits=args.folds, shuffle=True, random_state=MODEL_PARAMS['random_state']).split(features)
+
+    building = f'{cache_dir}.{os.getpid()}.tmp'
+    os.makedirs(building, exist_ok=True)
+    np.save(os.path.join(building, 'X.npy'), features)
+    np.save(os.path.join(building, 'y.npy'), target)
+    np.savez(os.path.join(building, 'folds.npz'), **{f'test_{i}': test for i, (_, test) in enumerate(splits)})
+    with open(os.path.join(building, 'meta.json'), 'w') as f:
+        json.dump({'source': source, 'columns': list(X.columns), 'rows': len(target)}, f, indent=2)
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.replace(building, cache_dir)
+    print(f"Cached {len(target):,} encoded rows in {cache_dir} ({time.perf_counter() - start:.1f}s)")
+    return cache_dir
+
+
+def load_cache(cache_dir):
+    """(X, y, columns, [test indices per fold]) with X and y memory-mapped"""
+    with open(os.path.join(cache_dir, 'meta.json')) as f:
+        meta = json.load(f)
+    X = np.load(os.path.join(cache_dir, 'X.npy'), mmap_mode='r')
+    y = np.load(os.path.join(cache_dir, 'y.npy'), mmap_mode='r')
+    with np.load(os.path.join(cache_dir, 'folds.npz')) as folds:
+        tests = [folds[f'test_{i}'] for i in range(len(folds.files))]
+    return X, y, pd.Index(meta['columns']), tests
+
+
+def config_name(params):
+    return ' '.join(f'{name}={value}' for name, value in params.items())
+
+
+def _evaluate_fold(cache_dir, params, fold, model_path=None):
+    """Fit and score one configuration on one fold (runs in a worker process)"""
+    X, y, columns, tests = load_cache(cache_dir)
+    train = np.ones(len(y), dtype=bool)
+    train[tests[fold]] = False
+    start = time.perf_counter()
+    model = RandomForestRegressor(**dict(MODEL_PARAMS, **params), n_jobs=1)
+    model.fit(pd.DataFrame(X[train], columns=columns), y[train])
+    fit_seconds = time.perf_counter() - start
+    y_pred = model.predict(pd.DataFrame(X[tests[fold]], columns=columns))
+    if model_path:
+        save_model(model, model_path)
+    nodes = sum(estimator.tree_.node_count for estimator in model.estimators_)
+    return mean_squared_error(y[tests[fold]], y_pred), r2_score(y[tests[fold]], y_pred), fit_seconds, nodes
+
+
+def median_ms(predict, features, min_seconds=LATENCY_SECONDS):
+    """Median wall time of predict(features) in milliseconds over at least min_seconds of calls"""
+    times = []
+    deadline = time.perf_counter() + min_seconds
+    while len(times) < 5 or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        predict(features)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1000
+
+
+def measure_serving(model_path, X, columns):
+    """One-row latency through the serving predictor and a 10k-row batch, like the server loads the model"""
+    model = joblib.load(model_path)
+    predictor = compile_forest(model) or model
+    rng = np.random.RandomState(0)
+    single = pd.DataFrame(X[rng.randint(len(X), size=1)], columns=columns)
+    batch = pd.DataFrame(X[rng.randint(len(X), size=BATCH_ROWS)], columns=columns)
+    return {
+        'single_row_ms': median_ms(predictor.predict, single),
+        'batch_10k_ms': median_ms(predictor.predict, batch),
+        'compact_forest': predictor is not model,
+    }
+
+
+def pareto_front(results):
+    """Indexes of results no other result matches or beats on R², one-row latency and size at once"""
+    keys = [(-r['cv_r2'], r['single_row_ms'], r['size_bytes']) for r in results]
+    return {
+        i for i, a in enumerate(keys)
+        if not any(b != a and all(x <= y for x, y in zip(b, a)) for b in keys)
+    }
+
+
+def search(args, grid):
+    cache_dir = prepare_cache(args)
+    X, y, columns, tests = load_cache(cache_dir)
+    models_dir = os.path.join(cache_dir, 'models')
+    os.makedirs(models_dir, exist_ok=True)
+    workers = args.workers or os.cpu_count() or 1
+    print(f"Searching {len(grid)} configurations x {len(tests)} folds on {len(y):,} rows with {workers} workers")
+
+    scores = {i: {} for i in range(len(grid))}
+    tasks = [(i, fold) for i in range(len(grid)) for fold in range(len(tests))]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {
+            pool.submit(_evaluate_fold, cache_dir, grid[i], fold,
+                        os.path.join(models_dir, f'config_{i}.pkl') if fold == 0 else None): (i, fold)
+            for i, fold in tasks
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            i, fold = futures[future]
+            scores[i][fold] = future.result()
+            print(f"\r  {done}/{len(tasks)} fits", end='', flush=True)
+    print(f" in {time.perf_counter() - start:.1f}s")
+
+    # Timed one at a time, after the pool is gone, so fits do not compete with the measurements
+    results = []
+    for i, params in enumerate(grid):
+        mse, r2, fit_seconds, nodes = zip(*(scores[i][fold] for fold in range(len(tests))))
+        model_path = os.path.join(models_dir, f'config_{i}.pkl')
+        result = {
+            'params': params,
+            'cv_r2': float(np.mean(r2)),
+            'cv_r2_std': float(np.std(r2)),
+            'cv_mse': float(np.mean(mse)),
+            'fit_seconds': float(np.mean(fit_seconds)),
+            'nodes': int(nodes[0]),
+            'size_bytes': os.path.getsize(model_path),
+        }
+        result.update(measure_serving(model_path, X, columns))
+        results.append(result)
+        if not args.keep_models:
+            os.remove(model_path)
+    return results
+
+
+def print_leaderboard(results):
+    front = pareto_front(results)
+    print(f"\n{'rank':>4}  {'configuration':<52} {'CV R²':>14} {'CV MSE':>8} {'1 row ms':>9} {'10k ms':>8} "
+          f"{'size MB':>8} {'fit s':>7}")
+    for rank, result in enumerate(results, 1):
+        marker = '*' if rank - 1 in front else ' '
+        print(f"{rank:>4}{marker} {config_name(result['params']):<52} "
+              f"{result['cv_r2']:>7.4f} ± {result['cv_r2_std']:.3f} {result['cv_mse']:>8.2f} "
+              f"{result['single_row_ms']:>9.3f} {result['batch_10k_ms']:>8.1f} {result['size_bytes'] / 1e6:>8.1f} "
+              f"{result['fit_seconds']:>7.1f}")
+    print("* not beaten on R², one-row latency and size together by any other configuration")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search forest hyperparameters by accuracy and serving cost')
+    parser.add_argument('--data', metavar='PATH', help='tune on a CSV/Excel/Parquet file or directory instead of synthetic data')
+    parser.add_argument('--samples', type=int, default=1000, help='synthetic rows to generate')
+    parser.add_argument('--sample-size', type=int, default=DEFAULT_SAMPLE_SIZE, help='rows sampled from --data')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='rows read per chunk from --data')
+    parser.add_argument('--folds', type=int, default=5, help='cross-validation folds')
+    parser.add_argument('--n-estimators', type=int, nargs='+', default=[50, 100, 200])
+    parser.add_argument('--max-depth', type=parse_max_depth, nargs='+', default=[8, 10, 14, None],
+                        help="depth limits to try; 'none' for unlimited")
+    parser.add_argument('--min-samples-leaf', type=int, nargs='+', default=[1, 5])
+    parser.add_argument('--workers', type=int, help='processes fitting in parallel (default: CPU count)')
+    parser.add_argument('--sort', choices=list(SORT_KEYS), default='r2', help='leaderboard order')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='where encoded features and folds are cached')
+    parser.add_argument('--keep-models', action='store_true', help="keep each configuration's first-fold model")
+    parser.add_argument('--save', metavar='PATH', help='write the leaderboard as JSON')
+    args = parser.parse_args()
+
+    grid = [
+        {'n_estimators': n_estimators, 'max_depth': max_depth, 'min_samples_leaf': min_samples_leaf}
+        for n_estimators, max_depth, min_samples_leaf
+        in itertools.product(args.n_estimators, args.max_depth, args.min_samples_leaf)
+    ]
+    results = search(args, grid)
+    key, descending = SORT_KEYS[args.sort]
+    results.sort(key=lambda result: result[key], reverse=descending)
+    print_leaderboard(results)
+
+    best = results[0]['params']
+    data_args = f' --data {args.data} --sample-size {args.sample_size}' if args.data else f' --samples {args.samples}'
+    print(f"\nTrain the top configuration with:\n  python train_model.py{data_args} "
+          f"--n-estimators {best['n_estimators']} --max-depth {str(best['max_depth']).lower()} "
+          f"--min-samples-leaf {best['min_samples_leaf']}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'source': source_description(args), 'sort': args.sort, 'results': results}, f, indent=2)
+        print(f"\nLeaderboard saved to {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -5,9 +5,27 @@ Test script to verify backend API is working correctly
 
 import requests
 import json
+import os
 import sys
+import time
 
 BASE_URL = "http://localhost:5000"
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+MODEL_PATH = os.path.join(BACKEND_DIR, "models", "soil_model.pkl")
+
+def import_backend():
+    """Make the backend package importable for tests that run in-process"""
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+def load_backend_model():
+    """Load the trained model in-process, or None if it is missing"""
+    import_backend()
+    if not os.path.exists(MODEL_PATH):
+        print("✗ Model not found. Run: python backend/train_model.py")
+        return None
+    import joblib
+    return joblib.load(MODEL_PATH)
 
 def test_health():
     """Test health endpoint"""
@@ -65,6 +83,21 @@ def test_prediction():
         print(f"✗ Error: {e}")
         return False
 
+def sample_csv(rows, bad_row=None):
+    """CSV text of random soil samples; bad_row gets a non-numeric ph value"""
+    import_backend()
+    import numpy as np
+    import pandas as pd
+    from app.features import REQUIRED_COLUMNS
+    
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame({col: rng.uniform(0, 100, rows).round(2) for col in REQUIRED_COLUMNS})
+    data['soilType'] = rng.choice(['Loamy', 'Clay', 'Sandy'], rows)
+    if bad_row is not None:
+        data['ph'] = data['ph'].astype(object)
+        data.loc[bad_row, 'ph'] = '<0.1'
+    return data.to_csv(index=False)
+
 def test_soil_types():
     """Test soil types endpoint"""
     print("\nTesting soil types endpoint...")
@@ -82,6 +115,150 @@ def test_soil_types():
         print(f"✗ Error: {e}")
         return False
 
+def test_feature_encoder():
+    """Test the feature encoder against pd.get_dummies plus a reindex"""
+    print("\nTesting feature encoder...")
+    try:
+        model = load_backend_model()
+        if model is None:
+            return False
+        import numpy as np
+        import pandas as pd
+        from app.features import REQUIRED_COLUMNS, FeatureEncoder
+        
+        encoder = FeatureEncoder.from_model(model)
+        rng = np.random.default_rng(0)
+        data = pd.DataFrame({col: rng.uniform(0, 100, 1000) for col in REQUIRED_COLUMNS})
+        # Include a soil type the model has never seen and a missing one
+        data['soilType'] = rng.choice(sorted(encoder.soil_type_offsets) + ['Unknown', None], 1000)
+        
+        expected = pd.get_dummies(data, columns=['soilType'], prefix='soilType', dtype=float)
+        expected = expected.reindex(columns=encoder.feature_names, fill_value=0)
+        encoded = encoder.transform(data)
+        
+        if list(encoded.columns) == list(expected.columns) and np.array_equal(encoded.to_numpy(), expected.to_numpy(dtype=encoder.dtype)):
+            print(f"✓ Encoder matches get_dummies on {len(data)} rows")
+            return True
+        else:
+            print("✗ Encoder output differs from get_dummies")
+            return False
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        return False
+
+def test_compact_forest():
+    """Test that the compact forest predicts exactly what sklearn predicts"""
+    print("\nTesting compact forest...")
+    try:
+        model = load_backend_model()
+        if model is None:
+            return False
+        import numpy as np
+        import pandas as pd
+        from app.features import REQUIRED_COLUMNS, FeatureEncoder
+        from app.forest import CompactForest
+        
+        forest = CompactForest(model, max_rows=1 << 20)
+        encoder = FeatureEncoder.from_model(model)
+        rng = np.random.default_rng(0)
+        data = pd.DataFrame({col: rng.uniform(0, 100, 5000) for col in REQUIRED_COLUMNS})
+        data['soilType'] = rng.choice(sorted(encoder.soil_type_offsets), 5000)
+        features = encoder.transform(data)
+        
+        # verify() probes rows on and right next to every split threshold
+        if forest.verify() and np.array_equal(forest.predict(features), model.predict(features)):
+            print(f"✓ Compact forest matches sklearn bit for bit ({forest.n_trees} trees)")
+            return True
+        else:
+            print("✗ Compact forest predictions differ from sklearn")
+            return False
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        return False
+
+def test_job_matches_stream():
+    """Test that a background job's result equals the streamed CSV response"""
+    print("\nTesting prediction job result...")
+    try:
+        body = sample_csv(2000)
+        response = requests.post(f"{BASE_URL}/api/jobs", files={"file": ("samples.csv", body)}, timeout=10)
+        if response.status_code != 202:
+            print(f"✗ Job submission failed: {response.status_code}")
+            print(f"  Response: {response.text}")
+            return False
+        job = response.json()
+        
+        deadline = time.time() + 60
+        while True:
+            status = requests.get(f"{BASE_URL}{job['status_url']}", timeout=5).json()
+            if status['status'] in ('completed', 'failed') or time.time() > deadline:
+                break
+            time.sleep(0.5)
+        if status['status'] != 'completed':
+            print(f"✗ Job did not complete: {status['status']} {status.get('error', '')}")
+            return False
+        
+        result = requests.get(f"{BASE_URL}{job['result_url']}", timeout=10)
+        streamed = requests.post(f"{BASE_URL}/api/predict?format=csv", files={"file": ("samples.csv", body)}, timeout=30)
+        requests.delete(f"{BASE_URL}{job['status_url']}", timeout=5)
+        
+        if result.status_code == 200 and streamed.status_code == 200 and result.text == streamed.text:
+            print(f"✓ Job result matches the streamed response ({status['rows_processed']} rows)")
+            return True
+        else:
+            print(f"✗ Job result differs from the streamed response: {result.status_code}, {streamed.status_code}")
+            return False
+    except requests.exceptions.ConnectionError:
+        print("✗ Cannot connect to backend. Is it running?")
+        return False
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        return False
+
+def read_stream(response):
+    """Return the bytes of a streamed response and whether the server aborted it"""
+    body = b""
+    try:
+        for block in response.iter_content(1 << 16):
+            body += block
+    except requests.exceptions.ChunkedEncodingError:
+        return body, True
+    return body, False
+
+def test_stream_bad_cell():
+    """Test that a bad value after the first chunk cuts a streamed response short"""
+    print("\nTesting streamed prediction with a bad value...")
+    try:
+        # With the default PREDICT_CHUNK_SIZE of 50000 the bad row is in the second chunk,
+        # after the 200 status and the first rows have been sent
+        rows = 100000
+        body = sample_csv(rows, bad_row=rows - 1)
+        passed = True
+        for fmt in ("csv", "ndjson"):
+            response = requests.post(f"{BASE_URL}/api/predict?format={fmt}", files={"file": ("samples.csv", body)},
+                                     stream=True, timeout=60)
+            received, aborted = read_stream(response)
+            lines = received.splitlines()
+            # Less the CSV header or the NDJSON error line
+            scored = len(lines) - 1
+            if fmt == "ndjson" and "error" not in (json.loads(lines[-1]) if lines else {}):
+                print("✗ NDJSON stream did not end with an error line")
+                passed = False
+            # Servers abort the chunked response; the debug server (python wsgi.py) ends it
+            # instead, so the missing rows are what tells a client the upload failed
+            if scored >= rows:
+                print(f"✗ {fmt} stream returned all {rows} rows")
+                passed = False
+            else:
+                print(f"✓ {fmt} stream {'aborted' if aborted else 'ended'} after {scored} of {rows} rows")
+        return passed
+    except requests.exceptions.ConnectionError:
+        print("✗ Cannot connect to backend. Is it running?")
+        return False
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        return False
+
 def main():
     print("=" * 50)
     print("Backend API Test Suite")
@@ -91,6 +268,10 @@ def main():
     results.append(("Health Check", test_health()))
     results.append(("Prediction", test_prediction()))
     results.append(("Soil Types", test_soil_types()))
+    results.append(("Feature Encoder", test_feature_encoder()))
+    results.append(("Compact Forest", test_compact_forest()))
+    results.append(("Prediction Job", test_job_matches_stream()))
+    results.append(("Stream Bad Value", test_stream_bad_cell()))
     
     print("\n" + "=" * 50)
     print("Test Results Summary")